@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import metrics
+
+CACHE_PATH = "data/ads_cache.db"
+
+# how long responses are kept (seconds) and how much space they can take up (bytes)
+DEFAULT_TTL = float(os.environ.get("GEOFFREY_ADS_CACHE_TTL", 12 * 60 * 60))
+DEFAULT_MAX_SIZE = int(os.environ.get("GEOFFREY_ADS_CACHE_SIZE", 200 * 1024**2))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+
+CREATE TABLE IF NOT EXISTS response_orcids (
+    orcid TEXT NOT NULL,
+    key TEXT NOT NULL REFERENCES responses (key) ON DELETE CASCADE,
+    PRIMARY KEY (orcid, key)
+);
+CREATE INDEX IF NOT EXISTS response_orcids_key ON response_orcids (key);
+"""
+
+ORCID_PATTERN = re.compile(r"\d{4}-\d{4}-\d{4}-\d{3}[\dX]")
+
+
+def normalise_params(params):
+    """Put the parameters of an ADS search into a canonical form
+
+    Parameters
+    ----------
+    params : `dict`
+        Solr parameters for the search
+
+    Returns
+    -------
+    params : `dict`
+        Normalised parameters
+    """
+    params = dict(params)
+    if "q" in params:
+        params["q"] = " ".join(params["q"].split())
+    if "fl" in params:
+        fl = params["fl"].split(",") if isinstance(params["fl"], str) else params["fl"]
+        params["fl"] = ",".join(sorted(set(field.strip() for field in fl)))
+    return {key: str(value) for key, value in params.items()}
+
+
+def cache_key(params):
+    """Work out the cache key for an ADS search
+
+    Parameters
+    ----------
+    params : `dict`
+        Solr parameters for the search
+
+    Returns
+    -------
+    key : `str`
+        Hash of the normalised parameters
+    """
+    return hashlib.sha256(json.dumps(normalise_params(params), sort_keys=True).encode()).hexdigest()
+
+
+class ADSCache():
+    """An on-disk cache of ADS search responses
+
+    Entries expire after a fixed time, the least recently used entries are evicted once the cache gets too
+    big and every entry can be invalidated by any of the ORCIDs in its query.
+
+    Parameters
+    ----------
+    path : `str`, optional
+        Path to the SQLite database, by default `CACHE_PATH`
+    ttl : `float`, optional
+        Time in seconds that entries are kept, by default `DEFAULT_TTL`
+    max_size : `int`, optional
+        Maximum total size of the stored responses in bytes, by default `DEFAULT_MAX_SIZE`
+    """
+    def __init__(self, path=None, ttl=None, max_size=None):
+        self.path = CACHE_PATH if path is None else path
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else max_size
+
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._con.row_factory = sqlite3.Row
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA foreign_keys=ON")
+        self._con.executescript(SCHEMA)
+
+    def get(self, params):
+        """Get the cached response to a search
+
+        Parameters
+        ----------
+        params : `dict`
+            Solr parameters for the search
+
+        Returns
+        -------
+        response : `dict`
+            Decoded JSON response, or None if there isn't a fresh one in the cache
+        """
+        key = cache_key(params)
+        now = time.time()
+        with self._lock, self._con:
+            row = self._con.execute("SELECT created, payload FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                metrics.ADS_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            if now - row["created"] > self.ttl:
+                self._con.execute("DELETE FROM responses WHERE key = ?", (key,))
+                metrics.ADS_CACHE_LOOKUPS.inc(result="expired")
+                return None
+            self._con.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        metrics.ADS_CACHE_LOOKUPS.inc(result="hit")
+        return json.loads(zlib.decompress(row["payload"]))
+
+    def put(self, params, response):
+        """Save the response to a search
+
+        Parameters
+        ----------
+        params : `dict`
+            Solr parameters for the search
+        response : `dict`
+            Decoded JSON response
+        """
+        key = cache_key(params)
+        payload = zlib.compress(json.dumps(response).encode())
+        now = time.time()
+        query = normalise_params(params).get("q", "")
+
+        with self._lock, self._con:
+            self._con.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, query, now, now, len(payload), payload))
+            self._con.executemany("INSERT OR IGNORE INTO response_orcids VALUES (?, ?)",
+                                  [(orcid, key) for orcid in set(ORCID_PATTERN.findall(query))])
+            self._evict(now)
+
+    def _evict(self, now):
+        """Drop expired entries and then the least recently used ones until the cache is small enough"""
+        self._con.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+
+        total = self._con.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        to_delete = []
+        for row in self._con.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_size:
+                break
+            to_delete.append((row["key"],))
+            total -= row["size"]
+        self._con.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def invalidate(self, orcids):
+        """Forget every cached response to a query that includes any of these ORCIDs
+
+        Parameters
+        ----------
+        orcids : `list`
+            List of ORCIDs
+        """
+        orcids = list(set(orcids))
+        with self._lock, self._con:
+            for start in range(0, len(orcids), 500):
+                batch = orcids[start:start + 500]
+                self._con.execute(f"""DELETE FROM responses WHERE key IN
+                                      (SELECT key FROM response_orcids
+                                       WHERE orcid IN ({','.join('?' * len(batch))}))""", batch)
+
+    def clear(self):
+        """Forget every cached response"""
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM responses")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the shared ADS response cache, creating it the first time
+
+    Returns
+    -------
+    cache : `ADSCache`
+        The shared cache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ADSCache()
+    return _cache
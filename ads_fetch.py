@@ -0,0 +1,538 @@
+import ads
+import ads.base
+import ads.config
+import asyncio
+import os
+import random
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ads.exceptions import APIResponseError
+
+# aiohttp is only needed for the async runtime
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import metrics
+import tracing
+from ads_cache import get_cache
+
+# send every search to a stand-in for ADS (e.g. fake_ads.py) when this is set
+ADS_URL_VAR = "GEOFFREY_ADS_URL"
+if os.environ.get(ADS_URL_VAR):
+    ads.config.SEARCH_URL = os.environ[ADS_URL_VAR]
+
+
+class ADSQuotaExceeded(APIResponseError):
+    """Raised when making another request would eat into the reserved part of the daily ADS quota"""
+    pass
+
+
+class TokenBucket():
+    """A thread-safe token bucket that also respects the daily quota reported by ADS
+
+    Parameters
+    ----------
+    rate : `float`
+        Number of tokens added per second
+    capacity : `int`
+        Maximum number of tokens that can be saved up for a burst of requests
+    reserve : `int`, optional
+        Number of requests from the daily quota to always leave untouched, by default 50
+    """
+    def __init__(self, rate, capacity, reserve=50):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = reserve
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+        # these get filled in from the rate limit headers of each response
+        self.limit, self.remaining, self.reset = None, None, None
+
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self):
+        """Use up a token if there is one
+
+        Returns
+        -------
+        wait : `float`
+            0 if a token was taken, otherwise how long to wait before trying again
+
+        Raises
+        ------
+        ADSQuotaExceeded
+            If the daily quota is down to the reserve
+        """
+        with self._lock:
+            # the daily quota resets at the time given by ADS so forget about it once that passes
+            if self.reset is not None and time.time() >= self.reset:
+                self.remaining, self.reset = None, None
+
+            if self.remaining is not None and self.remaining <= self.reserve:
+                raise ADSQuotaExceeded(f"Only {self.remaining} of {self.limit} ADS requests left today, "
+                                       f"refusing to use the last {self.reserve}")
+
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                if self.remaining is not None:
+                    self.remaining -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block until a request can be made and then use up a token
+
+        Raises
+        ------
+        ADSQuotaExceeded
+            If the daily quota is down to the reserve
+        """
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Same as `acquire` but waits without blocking the event loop"""
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """Update the daily quota from the X-RateLimit-* headers of an ADS response
+
+        Parameters
+        ----------
+        headers : `dict`
+            Response headers
+        """
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with self._lock:
+            # responses can arrive out of order so within the same quota window only ever trust the lowest
+            # remaining count we've seen
+            if self.remaining is None or reset != self.reset or remaining < self.remaining:
+                self.remaining = remaining
+            self.limit, self.reset = limit, reset
+            metrics.ADS_QUOTA_REMAINING.set(self.remaining)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while (e.g. after being told to slow down)
+
+        Parameters
+        ----------
+        seconds : `float`
+            How long to pause for
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class FetchEngine():
+    """Runs ADS searches on a bounded thread pool with rate limiting and retries
+
+    Parameters
+    ----------
+    max_workers : `int`, optional
+        Maximum number of requests in flight at once, by default 4
+    rate : `float`, optional
+        Maximum sustained requests per second, by default 4
+    burst : `int`, optional
+        Maximum number of requests that can be sent in a quick burst, by default 8
+    reserve : `int`, optional
+        Number of requests from the daily quota to always leave untouched, by default 50
+    max_retries : `int`, optional
+        Number of times to retry a request that fails with a 429 or 5xx, by default 5
+    backoff : `float`, optional
+        Base delay in seconds for the exponential backoff between retries, by default 1
+    timeout : `float`, optional
+        Timeout in seconds for each request, by default 60
+    cache : `ads_cache.ADSCache`, optional
+        Cache of responses to check before sending any request, by default no caching
+    """
+    def __init__(self, max_workers=4, rate=4, burst=8, reserve=50, max_retries=5, backoff=1, timeout=60,
+                 cache=None):
+        self.cache = cache
+        self.bucket = TokenBucket(rate=rate, capacity=burst, reserve=reserve)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ads-fetch")
+
+        self._session = None
+        self._async_session = None
+
+    @property
+    def session(self):
+        """A requests session with the same headers as the ads client"""
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.headers.update(self._headers())
+        return self._session
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {ads.base.BaseQuery().token}",
+            "User-Agent": f"ads-api-client/{ads.__version__}",
+            "Content-Type": "application/json",
+        }
+
+    def _back_off(self, attempt, response=None):
+        """Hold back every worker before a retry, honouring Retry-After if ADS gave one"""
+        delay = self.backoff * 2**attempt
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                delay = max(delay, float(response.headers["Retry-After"]))
+            except ValueError:
+                pass
+
+        # add some jitter so that the workers don't all retry in lockstep, the next acquire will then wait
+        self.bucket.pause(random.uniform(delay / 2, delay))
+
+    def search(self, params):
+        """Run a single search request against ADS
+
+        Parameters
+        ----------
+        params : `dict`
+            Solr parameters for the search (q, fl, sort, rows, start...)
+
+        Returns
+        -------
+        response : `dict`
+            Decoded JSON response
+
+        Raises
+        ------
+        APIResponseError
+            If the request fails with an error that isn't worth retrying or runs out of retries
+        """
+        with tracing.span("ads.search", q=params.get("q"), start=params.get("start", 0)):
+            return self._search(params)
+
+    def _search(self, params):
+        """Does the work of `search` (so that it is traced as a single span)"""
+        # cached responses don't cost anything from the quota
+        if self.cache is not None:
+            response = self.cache.get(params)
+            if response is not None:
+                tracing.annotate(cached=True)
+                return response
+
+        waited = 0
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            self.bucket.acquire()
+            waited += time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                response = self.session.get(ads.config.SEARCH_URL, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.ADS_REQUESTS.inc(status="error")
+                if attempt == self.max_retries:
+                    raise
+                self._back_off(attempt)
+                continue
+            finally:
+                metrics.ADS_REQUEST_SECONDS.observe(time.perf_counter() - start)
+
+            metrics.ADS_REQUESTS.inc(status=str(response.status_code))
+            self.bucket.update_from_headers(response.headers)
+
+            if response.ok:
+                response = response.json()
+                n_rows = len(response.get("response", {}).get("docs", []))
+                metrics.ADS_ROWS.inc(n_rows)
+                tracing.annotate(rows=n_rows, attempts=attempt + 1, rate_limit_wait=waited)
+                if self.cache is not None:
+                    self.cache.put(params, response)
+                return response
+
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries:
+                self._back_off(attempt, response)
+                continue
+
+            raise APIResponseError(response.text)
+
+    def iter_search(self, q, fl, sort="date desc", rows=200, max_results=None):
+        """Lazily get the results of a search, requesting each page only once the previous one is used up
+
+        Parameters
+        ----------
+        q : `str`
+            Query
+        fl : `list`
+            Fields to return
+        sort : `str`, optional
+            Sort order, by default "date desc"
+        rows : `int`, optional
+            Results per page (ADS caps this at 2000), by default 200
+        max_results : `int`, optional
+            Stop after this many results (pages are shrunk so that no extra rows are sent), by default
+            no limit
+
+        Yields
+        ------
+        doc : `dict`
+            Raw ADS document
+        """
+        params = {"q": q, "fl": ",".join(fl), "sort": f"{sort}, bibcode desc"}
+        start, n_yielded = 0, 0
+        while max_results is None or n_yielded < max_results:
+            page_rows = rows if max_results is None else min(rows, max_results - n_yielded)
+            page = self.search({**params, "rows": page_rows, "start": start})
+            docs = page["response"]["docs"]
+            for doc in docs:
+                yield doc
+                n_yielded += 1
+                if max_results is not None and n_yielded >= max_results:
+                    return
+
+            start += len(docs)
+            if len(docs) == 0 or start >= page["response"]["numFound"]:
+                return
+
+    async def search_async(self, params):
+        """Same as `search` but without blocking the event loop (needs aiohttp)
+
+        Parameters
+        ----------
+        params : `dict`
+            Solr parameters for the search (q, fl, sort, rows, start...)
+
+        Returns
+        -------
+        response : `dict`
+            Decoded JSON response
+
+        Raises
+        ------
+        APIResponseError
+            If the request fails with an error that isn't worth retrying or runs out of retries
+        """
+        with tracing.span("ads.search", q=params.get("q"), start=params.get("start", 0)):
+            return await self._search_async(params)
+
+    async def _search_async(self, params):
+        """Does the work of `search_async` (so that it is traced as a single span)"""
+        # the cache is SQLite on disk so it is read and written in a thread to keep the event loop free
+        if self.cache is not None:
+            response = await asyncio.to_thread(self.cache.get, params)
+            if response is not None:
+                tracing.annotate(cached=True)
+                return response
+
+        # the session has to be made inside the event loop that uses it
+        if self._async_session is None:
+            self._async_session = aiohttp.ClientSession(headers=self._headers(),
+                                                        timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        waited = 0
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            await self.bucket.acquire_async()
+            waited += time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                async with self._async_session.get(ads.config.SEARCH_URL,
+                                                   params={k: str(v) for k, v in params.items()}) as response:
+                    metrics.ADS_REQUESTS.inc(status=str(response.status))
+                    self.bucket.update_from_headers(response.headers)
+                    if response.ok:
+                        result = await response.json()
+                        n_rows = len(result.get("response", {}).get("docs", []))
+                        metrics.ADS_ROWS.inc(n_rows)
+                        tracing.annotate(rows=n_rows, attempts=attempt + 1, rate_limit_wait=waited)
+                        if self.cache is not None:
+                            await asyncio.to_thread(self.cache.put, params, result)
+                        return result
+
+                    if (response.status == 429 or response.status >= 500) and attempt < self.max_retries:
+                        self._back_off(attempt, response)
+                        continue
+
+                    raise APIResponseError(await response.text())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                metrics.ADS_REQUESTS.inc(status="error")
+                if attempt == self.max_retries:
+                    raise
+                self._back_off(attempt)
+            finally:
+                metrics.ADS_REQUEST_SECONDS.observe(time.perf_counter() - start)
+
+    async def iter_search_async(self, q, fl, sort="date desc", rows=200, max_results=None):
+        """Same as `iter_search` but as an async generator (needs aiohttp)
+
+        Parameters
+        ----------
+        q : `str`
+            Query
+        fl : `list`
+            Fields to return
+        sort : `str`, optional
+            Sort order, by default "date desc"
+        rows : `int`, optional
+            Results per page (ADS caps this at 2000), by default 200
+        max_results : `int`, optional
+            Stop after this many results, by default no limit
+
+        Yields
+        ------
+        doc : `dict`
+            Raw ADS document
+        """
+        params = {"q": q, "fl": ",".join(fl), "sort": f"{sort}, bibcode desc"}
+        start, n_yielded = 0, 0
+        while max_results is None or n_yielded < max_results:
+            page_rows = rows if max_results is None else min(rows, max_results - n_yielded)
+            page = await self.search_async({**params, "rows": page_rows, "start": start})
+            docs = page["response"]["docs"]
+            for doc in docs:
+                yield doc
+                n_yielded += 1
+                if max_results is not None and n_yielded >= max_results:
+                    return
+
+            start += len(docs)
+            if len(docs) == 0 or start >= page["response"]["numFound"]:
+                return
+
+    def search_all(self, q, fl, sort="date desc", rows=2000, max_pages=None):
+        """Get every result of a search, fetching the pages after the first concurrently
+
+        Parameters
+        ----------
+        q : `str`
+            Query
+        fl : `list`
+            Fields to return
+        sort : `str`, optional
+            Sort order, by default "date desc"
+        rows : `int`, optional
+            Results per page (ADS caps this at 2000), by default 2000
+        max_pages : `int`, optional
+            Maximum number of pages to fetch, by default no limit
+
+        Returns
+        -------
+        docs : `list`
+            List of the raw ADS documents
+        """
+        return self.search_all_many([q], fl, sort=sort, rows=rows, max_pages=max_pages)[0]
+
+    def search_all_many(self, queries, fl, sort="date desc", rows=2000, max_pages=None, skip_errors=False):
+        """Get every result of several searches at once
+
+        The first page of every query is fetched concurrently, followed by all of the remaining pages.
+
+        Parameters
+        ----------
+        queries : `list`
+            List of queries
+        fl : `list`
+            Fields to return
+        sort : `str`, optional
+            Sort order, by default "date desc"
+        rows : `int`, optional
+            Results per page (ADS caps this at 2000), by default 2000
+        max_pages : `int`, optional
+            Maximum number of pages to fetch per query, by default no limit
+        skip_errors : `bool`, optional
+            Whether to give None for any query that fails instead of raising the error, by default False
+
+        Returns
+        -------
+        docs : `list`
+            List containing a list of the raw ADS documents for each query
+        """
+        def search(params):
+            try:
+                return self.search(params)
+            except (APIResponseError, requests.RequestException) as e:
+                if not skip_errors or isinstance(e, ADSQuotaExceeded):
+                    raise
+                print(f"WARNING: ADS query '{params['q']}' failed: {e}")
+                return None
+
+        # add bibcode to the sort so that pages fetched with an offset can't overlap
+        params = [{"q": q, "fl": ",".join(fl), "sort": f"{sort}, bibcode desc", "rows": rows, "start": 0}
+                  for q in queries]
+        first_pages = self.map(search, params)
+
+        # work out the rest of the pages that each query needs
+        later_params, owners = [], []
+        for i, page in enumerate(first_pages):
+            if page is None:
+                continue
+
+            # ADS may have lowered the number of rows
+            page_rows = int(page["responseHeader"].get("params", {}).get("rows", rows))
+            n_pages = -(-page["response"]["numFound"] // page_rows)
+            if max_pages is not None:
+                n_pages = min(n_pages, max_pages)
+
+            for n in range(1, n_pages):
+                later_params.append({**params[i], "rows": page_rows, "start": n * page_rows})
+                owners.append(i)
+
+        docs = [None if page is None else page["response"]["docs"] for page in first_pages]
+        for i, page in zip(owners, self.map(search, later_params)):
+            # a query with a missing page is incomplete so treat it as failed
+            if page is None or docs[i] is None:
+                docs[i] = None
+            else:
+                docs[i] += page["response"]["docs"]
+        return docs
+
+    def map(self, func, items):
+        """Apply a function to each item on the thread pool
+
+        Parameters
+        ----------
+        func : `function`
+            Function to apply
+        items : `list`
+            Items to pass to the function
+
+        Returns
+        -------
+        results : `list`
+            Results in the same order as ``items``
+        """
+        # waiting on the pool from inside one of its own workers could deadlock so just run these inline
+        if threading.current_thread().name.startswith("ads-fetch"):
+            return [func(item) for item in items]
+        return list(self.pool.map(tracing.propagate(func), items))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Get the shared fetch engine, creating it the first time
+
+    Returns
+    -------
+    engine : `FetchEngine`
+        The shared fetch engine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = FetchEngine(cache=get_cache())
+    return _engine
@@ -1,12 +1,22 @@
-import ads
 import datetime
-import pandas as pd
-import numpy as np
-from unidecode import unidecode
-from collections import defaultdict
+import requests
+from ads.exceptions import APIResponseError
+
+import paper_store
+import tracing
+from ads_cache import get_cache
+from ads_fetch import get_engine
+from author_matcher import get_matcher
+from view_cache import get_view_cache
+
+ADS_FIELDS = ["abstract", "author", "citation_count", "doctype", "first_author", "read_count", "title",
+              "bibcode", "pubdate", "keyword", "pub", "doi"]
+ORCID_FIELDS = ["orcid_pub", "orcid_user", "orcid_other"]
+REQUIRED_FIELDS = ["bibcode", "title", "pubdate", "doctype"]
+
 
 def get_ads_papers(query, astronomy_collection=True, past_week=False, allowed_types=["article", "eprint"],
-                   remove_known_papers=False):
+                   remove_known_papers=False, rows=50, max_pages=1):
     """Get papers from NASA/ADS based on a query
 
     Parameters
@@ -19,55 +29,325 @@ def get_ads_papers(query, astronomy_collection=True, past_week=False, allowed_ty
         Whether to restrict to papers from the past week, by default False
     allowed_types : `list`, optional
         List of allowed types of papers, by default ["article", "eprint"]
+    remove_known_papers : `bool`, optional
+        Whether to remove papers that are already saved, by default False
+    rows : `int`, optional
+        Number of rows to request per page, by default 50
+    max_pages : `int`, optional
+        Maximum number of pages to fetch, use None for every page, by default 1
+
+    Returns
+    -------
+    papers_dict_list : `list`
+        List of dictionaries of paper information, or None if the query failed
+    """
+    query = build_query(query, astronomy_collection=astronomy_collection, past_week=past_week)
+
+    # get the papers
+    try:
+        papers = get_engine().search_all(q=query, fl=ADS_FIELDS, rows=rows, max_pages=max_pages)
+    except (APIResponseError, requests.RequestException) as e:
+        print(f"WARNING: ADS query '{query}' failed: {e}")
+        return None
+
+    papers_dict_list = [paper_to_dict(paper) for paper in papers if paper.get("doctype") in allowed_types]
+    if remove_known_papers:
+        papers_dict_list = filter_known_papers(papers_dict_list)
+    return papers_dict_list
+
+
+def iter_ads_papers(query, fields=None, max_results=None, astronomy_collection=True, past_week=False,
+                    allowed_types=["article", "eprint"], rows=200):
+    """Lazily get papers from NASA/ADS based on a query, most recent first
+
+    Papers are yielded as each page arrives and no more pages are requested once the caller stops
+    iterating (or ``max_results`` is reached), so asking for one paper only transfers one row.
+
+    Parameters
+    ----------
+    query : `str`
+        Query used for ADS searchs
+    fields : `list`, optional
+        ADS fields to get (the bibcode, title, date and type are always included), by default
+        `ADS_FIELDS`
+    max_results : `int`, optional
+        Maximum number of papers to get, by default no limit
+    astronomy_collection : `bool`, optional
+        Whether to restrict to the astronomy collection, by default True
+    past_week : `bool`, optional
+        Whether to restrict to papers from the past week, by default False
+    allowed_types : `list`, optional
+        List of allowed types of papers, by default ["article", "eprint"]
+    rows : `int`, optional
+        Number of rows to request per page, by default 200
+
+    Yields
+    ------
+    paper : `dict`
+        Dictionary of paper information (anything not in ``fields`` is None)
+    """
+    query, fields = _typed_query(query, fields, astronomy_collection, past_week, allowed_types)
+    for paper in get_engine().iter_search(q=query, fl=fields, rows=rows, max_results=max_results):
+        if paper.get("doctype") in allowed_types:
+            yield paper_to_dict(paper)
+
+
+async def iter_ads_papers_async(query, fields=None, max_results=None, astronomy_collection=True,
+                                past_week=False, allowed_types=["article", "eprint"], rows=200):
+    """Same as `iter_ads_papers` but as an async generator for the async runtime
+
+    Parameters
+    ----------
+    query : `str`
+        Query used for ADS searchs
+    fields : `list`, optional
+        ADS fields to get (the bibcode, title, date and type are always included), by default
+        `ADS_FIELDS`
+    max_results : `int`, optional
+        Maximum number of papers to get, by default no limit
+    astronomy_collection : `bool`, optional
+        Whether to restrict to the astronomy collection, by default True
+    past_week : `bool`, optional
+        Whether to restrict to papers from the past week, by default False
+    allowed_types : `list`, optional
+        List of allowed types of papers, by default ["article", "eprint"]
+    rows : `int`, optional
+        Number of rows to request per page, by default 200
+
+    Yields
+    ------
+    paper : `dict`
+        Dictionary of paper information (anything not in ``fields`` is None)
+    """
+    query, fields = _typed_query(query, fields, astronomy_collection, past_week, allowed_types)
+    async for paper in get_engine().iter_search_async(q=query, fl=fields, rows=rows, max_results=max_results):
+        if paper.get("doctype") in allowed_types:
+            yield paper_to_dict(paper)
+
+
+def _typed_query(query, fields, astronomy_collection, past_week, allowed_types):
+    """Build the query and field list used by `iter_ads_papers`"""
+    fields = ADS_FIELDS if fields is None else list(dict.fromkeys(REQUIRED_FIELDS + list(fields)))
+    query = build_query(query, astronomy_collection=astronomy_collection, past_week=past_week)
+
+    # filter the types in the query itself so that every row that is sent is one we want
+    query += " doctype:(" + " OR ".join(allowed_types) + ")"
+    return query, fields
+
+
+def build_query(query, astronomy_collection=True, past_week=False, since=None):
+    """Add the standard collection and date restrictions to an ADS query
+
+    Parameters
+    ----------
+    query : `str`
+        Base query
+    astronomy_collection : `bool`, optional
+        Whether to restrict to the astronomy collection, by default True
+    past_week : `bool`, optional
+        Whether to restrict to papers from the past week, by default False
+    since : `datetime.date`, optional
+        Restrict to papers entered into ADS since this date (overrides ``past_week``), by default no
+        restriction
+
+    Returns
+    -------
+    query : `str`
+        Full query
     """
     # append astronomy collection to query if wanted
     if astronomy_collection:
         query += " collection:astronomy"
 
+    # if since a particular date
+    if since is not None:
+        query += f" entdate:[{since.strftime('%Y-%m-%d')} TO {datetime.date.today().strftime('%Y-%m-%d')}]"
+
     # if in the past week
-    if past_week:
+    elif past_week:
         # use datetime to work out the dates
         today = datetime.date.today()
         week_ago = today - datetime.timedelta(weeks=4)
 
         # restrict the entdates to the date range of last week
         query += f" entdate:[{week_ago.strftime('%Y-%m-%d')} TO {today.strftime('%Y-%m-%d')}]"
+    return query
 
-    # get the papers
-    papers = ads.SearchQuery(q=query, sort="date", fl=["abstract", "author", "citation_count", "doctype",
-                                                       "first_author", "read_count", "title", "bibcode",
-                                                       "pubdate", "keyword", 'pub'])
-
-    papers_dict_list = []
-
-    for paper in papers:
-        if paper.doctype in allowed_types:
-            year, month, _ = map(int, paper.pubdate.split("-"))
-            papers_dict_list.append({
-                "link": f"https://ui.adsabs.harvard.edu/abs/{paper.bibcode}/abstract",
-                "title": paper.title[0],
-                "abstract": paper.abstract,
-                "authors": paper.author,
-                "date": datetime.date(year=year, month=month, day=1),
-                "citations": paper.citation_count,
-                "reads": paper.read_count,
-                "keywords": paper.keyword,
-                "publisher": paper.pub
-            })
+
+def paper_to_dict(paper):
+    """Convert an ADS document into the dictionary format used throughout Geoffrey
+
+    Parameters
+    ----------
+    paper : `dict`
+        Raw document returned by an ADS search
+
+    Returns
+    -------
+    paper_dict : `dict`
+        Dictionary of paper information
+    """
+    year, month, _ = map(int, paper["pubdate"].split("-"))
+    authors = paper.get("author", [])
+    return {
+        "bibcode": paper["bibcode"],
+        "doi": paper.get("doi", [None])[0],
+        "link": f"https://ui.adsabs.harvard.edu/abs/{paper['bibcode']}/abstract",
+        "title": paper["title"][0],
+        "abstract": paper.get("abstract"),
+        "authors": authors,
+        "first_author": paper.get("first_author", authors[0] if len(authors) > 0 else None),
+        "date": datetime.date(year=year, month=month, day=1),
+        "citations": paper.get("citation_count"),
+        "reads": paper.get("read_count"),
+        "keywords": paper.get("keyword"),
+        "publisher": paper.get("pub")
+    }
+
+
+def get_ads_papers_batched(orcids, chunk_size=200, astronomy_collection=True, past_week=False,
+                           allowed_types=["article", "eprint"], remove_known_papers=False, rows=2000,
+                           since=None, failed=None):
+    """Get papers for many ORCIDs at once by packing them into a few large ADS queries
+
+    Each chunk of ORCIDs becomes a single ``orcid:("a" OR "b" OR ...)`` query that is paged through in
+    full. Every paper is attributed back to the ORCIDs in ``orcids`` that appear on it and papers found
+    through several people are only returned once.
+
+    Parameters
+    ----------
+    orcids : `list`
+        List of ORCIDs to search for
+    chunk_size : `int`, optional
+        Number of ORCIDs to pack into each query, by default 200
+    astronomy_collection : `bool`, optional
+        Whether to restrict to the astronomy collection, by default True
+    past_week : `bool`, optional
+        Whether to restrict to papers from the past week, by default False
+    allowed_types : `list`, optional
+        List of allowed types of papers, by default ["article", "eprint"]
+    remove_known_papers : `bool`, optional
+        Whether to remove papers that are already saved, by default False
+    rows : `int`, optional
+        Number of rows to request per page (ADS caps this at 2000), by default 2000
+    since : `datetime.date` or `dict`, optional
+        Restrict to papers entered into ADS since this date. Alternatively a dictionary of dates for
+        every ORCID, in which case each chunk uses the earliest date of its ORCIDs. By default no
+        restriction.
+    failed : `list`, optional
+        If given, the ORCIDs from any chunks whose queries failed are added to this list
+
+    Returns
+    -------
+    papers_dict_list : `list`
+        List of dictionaries of paper information, each with an extra "orcids" key listing the matched
+        ORCIDs
+    """
+    orcids = list(dict.fromkeys(orcids))
+    chunks = [orcids[start:start + chunk_size] for start in range(0, len(orcids), chunk_size)]
+    queries = [build_query("orcid:(" + " OR ".join(f'"{orcid}"' for orcid in chunk) + ")",
+                           astronomy_collection=astronomy_collection, past_week=past_week,
+                           since=min(since[orcid] for orcid in chunk) if isinstance(since, dict) else since)
+               for chunk in chunks]
+
+    # page through every result for every chunk on the fetch engine
+    results = get_engine().search_all_many(queries, fl=ADS_FIELDS + ORCID_FIELDS, rows=rows, skip_errors=True)
+
+    papers_by_bibcode = {}
+    for chunk, query, papers in zip(chunks, queries, results):
+        # skip any chunk with a bad query
+        if papers is None:
+            if failed is not None:
+                failed += chunk
+            continue
+
+        chunk_set = set(chunk)
+        for paper in papers:
+            if paper.get("doctype") not in allowed_types:
+                continue
+
+            # work out which of the people in this chunk are on the paper
+            matched = set()
+            for field in ORCID_FIELDS:
+                matched.update(o for o in paper.get(field, []) if o in chunk_set)
+
+            # co-authored papers turn up for several people so only keep one copy
+            if paper["bibcode"] not in papers_by_bibcode:
+                papers_by_bibcode[paper["bibcode"]] = paper_to_dict(paper)
+                papers_by_bibcode[paper["bibcode"]]["orcids"] = []
+            paper_orcids = papers_by_bibcode[paper["bibcode"]]["orcids"]
+            paper_orcids += [o for o in chunk if o in matched and o not in paper_orcids]
+
+    papers_dict_list = list(papers_by_bibcode.values())
     if remove_known_papers:
         papers_dict_list = filter_known_papers(papers_dict_list)
     return papers_dict_list
 
 
-def check_uw_authors(paper, uw_authors):
+def sweep_new_papers(orcids, overlap=datetime.timedelta(days=2), default_window=datetime.timedelta(weeks=4),
+                     **kwargs):
+    """Get the new papers for many ORCIDs, only asking ADS for papers entered since each person was last
+    swept successfully
+
+    Anyone that has never been swept starts from the last successful sweep of the whole department (or
+    ``default_window`` ago if there hasn't been one). ORCIDs are grouped with others that were last swept
+    at a similar time so that each query covers as short a window as possible. Record the sweep with
+    `record_sweep` once the papers are saved.
+
+    Parameters
+    ----------
+    orcids : `list`
+        List of ORCIDs to search for
+    overlap : `datetime.timedelta`, optional
+        How far before the last sweep to start (to catch papers that ADS indexed late), by default 2 days
+    default_window : `datetime.timedelta`, optional
+        How far back to look for someone when there's never been a sweep, by default 4 weeks
+    **kwargs
+        Any other arguments to pass to `get_ads_papers_batched`
+
+    Returns
+    -------
+    papers_dict_list : `list`
+        List of dictionaries of new papers
+    swept : `list`
+        ORCIDs for which every query succeeded
+    """
+    marks = paper_store.get_sweep_marks()
+    fallback = marks.get(paper_store.DEPARTMENT_MARK, datetime.date.today() - default_window)
+    since = {orcid: marks.get(orcid, fallback) - overlap for orcid in orcids}
+
+    failed = []
+    papers_dict_list = get_ads_papers_batched(sorted(since, key=since.get), since=since, failed=failed,
+                                              remove_known_papers=True, **kwargs)
+    failed = set(failed)
+    return papers_dict_list, [orcid for orcid in orcids if orcid not in failed]
+
+
+def record_sweep(swept, all_succeeded, date=None):
+    """Save the date of a successful sweep so that the next one can start from there
+
+    Parameters
+    ----------
+    swept : `list`
+        ORCIDs that were swept successfully
+    all_succeeded : `bool`
+        Whether the sweep succeeded for everyone (in which case the department mark is moved too)
+    date : `datetime.date`, optional
+        Date of the sweep, by default today
+    """
+    date = datetime.date.today() if date is None else date
+    paper_store.set_sweep_marks(list(swept) + ([paper_store.DEPARTMENT_MARK] if all_succeeded else []), date)
+
+
+def check_uw_authors(paper, matcher=None):
     """Check if the authors of a paper are from UW
 
     Parameters
     ----------
     paper : `dict`
         Dictionary of paper information
-    uw_authors : `dict`
-        Dictionary of UW authors with last name as key and first initial as value
+    matcher : `author_matcher.AuthorMatcher`, optional
+        Matcher for the UW authors, by default the one for the current roster
 
     Returns
     -------
@@ -76,137 +356,110 @@ def check_uw_authors(paper, uw_authors):
     total_uw : `int`
         Total number of UW authors
     """
-    first_author, total_uw = False, 0
-    for i, author in enumerate(paper['authors']):
-        if author.count(",") != 1:
-            continue
-        last, first = author.split(", ")
+    matcher = get_matcher() if matcher is None else matcher
+    match = matcher.match(paper['authors'])
+    return match.first_author, match.total_uw
 
-        if len(first) == 2 and first[1] == ".":
-            first = first[0].lower()
-        else:
-            first = first.split(" ")[0].lower()
-        last = unidecode(last).lower()
 
-        if last in uw_authors:
-            for option in uw_authors[last]:
-                if (len(option) > 1 and first[:len(option)] == option) or first == option:
-                    if i == 0:
-                        first_author = True
-                    total_uw += 1
-                    break
-    return first_author, total_uw
+def filter_known_papers(papers_dict_list):
+    """Remove any papers that are already in the paper store
 
+    Parameters
+    ----------
+    papers_dict_list : `list`
+        List of dictionaries of paper information
 
-def filter_known_papers(papers_dict_list):
-    papers = pd.read_csv("data/papers.csv")
-    known_papers = [p.lower() for p in papers['title'].values]
+    Returns
+    -------
+    new_papers : `list`
+        The papers that aren't in the store yet
+    """
+    known_papers = paper_store.get_known_papers()
     new_papers = []
     for paper in papers_dict_list:
-        if paper['title'].lower() not in known_papers:
+        if paper not in known_papers:
             new_papers.append(paper)
     return new_papers
 
 
+def get_author_ids(authors, matcher=None):
+    """Get the Slack IDs of the UW authors of a paper
+
+    Parameters
+    ----------
+    authors : `list`
+        List of authors of the paper
+    matcher : `author_matcher.AuthorMatcher`, optional
+        Matcher for the UW authors, by default the one for the current roster
+
+    Returns
+    -------
+    author_ids : `list`
+        Slack IDs of the UW authors
+    """
+    matcher = get_matcher() if matcher is None else matcher
+    return matcher.match(authors).slack_ids
+
+
 def get_uw_authors():
-    # read in the UW authors
-    uw_authors_table = pd.read_csv("data/orcids.csv")
-    uw_authors = defaultdict(list)
-    for _, row in uw_authors_table.iterrows():
-        uw_authors[row['last_name'].lower()].append(row['first_name'].lower())
-        uw_authors[row['last_name'].lower()].append(row['first_name'][0].lower())
+    """Get the UW authors from the roster
 
-    # HACK: add David and Chester's alternate names
-    uw_authors["wang"].append("yuankun")
-    uw_authors["wang"].append("y")
-    uw_authors["li"].append("zhufo")
-    uw_authors["li"].append("z")
-    return uw_authors
+    Returns
+    -------
+    uw_authors : `dict`
+        Dictionary of UW authors with last name as key and a list of first names/initials as value
+    """
+    return {last: [option for option, _ in options] for last, options in get_matcher().surnames.items()}
 
 
 def save_papers(papers_dict_list):
-    """Save papers to a CSV file
+    """Save papers to the paper store
 
     Parameters
     ----------
     papers_dict_list : `list`
         List of dictionaries of paper information
-    """
-    uw_authors = get_uw_authors()
 
-    for i in range(len(papers_dict_list)):
-        papers_dict_list[i]["first_author"] = papers_dict_list[i]["authors"][0]
-
-    # create a dictionary of the data    
-    df_dict = {key: [i[key] for i in papers_dict_list]
-               for key in ['title','first_author','authors','date','publisher','keywords','link','abstract']}
-
-    # initialize the first author and total UW authors
-    uw_first_author = np.repeat(False, len(papers_dict_list))
-    total_uw = np.zeros(len(papers_dict_list)).astype(int)
+    Returns
+    -------
+    n_added : `int`
+        Number of papers that weren't already saved
+    """
+    matcher = get_matcher()
 
     # go through each paper and check UW authors
-    for i, paper in enumerate(papers_dict_list):
-        uw_first_author[i], total_uw[i] = check_uw_authors(paper, uw_authors)
+    with tracing.span("match.papers", papers=len(papers_dict_list)):
+        for paper in papers_dict_list:
+            match = matcher.match(paper["authors"])
+            paper["uw_first_author"], paper["total_uw"] = match.first_author, match.total_uw
 
-    # add the first author and total UW authors to the dictionary
-    df_dict['uw_first_author'] = uw_first_author
-    df_dict['total_uw'] = total_uw
+            # link the paper to everyone in the department that is on it
+            paper["orcids"] = list(dict.fromkeys(paper.get("orcids", []) + match.orcids))
 
-    # read in the current papers and add the new ones
-    df = pd.read_csv("data/papers.csv")
-    new_df = pd.DataFrame(df_dict)
-    df = pd.concat([df,new_df])
-    df.to_csv("data/papers.csv", index=False)
+    # add them all in one transaction
+    n_added = paper_store.add_papers(papers_dict_list)
 
+    # any cached searches and home tabs for these people are now out of date
+    orcids = [orcid for paper in papers_dict_list for orcid in paper["orcids"]]
+    get_cache().invalidate(orcids)
+    get_view_cache().invalidate(orcids=orcids)
+    return n_added
 
-def bold_uw_authors(author_string, uw_authors=None):
+
+def bold_uw_authors(author_string, matcher=None):
     """Bold the uw authors in the list of authors
 
     Parameters
     ----------
-    author_string : `str`
-        Initial author string
-    name : `str`
-        Name of grad
+    author_string : `list`
+        List of authors of the paper
+    matcher : `author_matcher.AuthorMatcher`, optional
+        Matcher for the UW authors, by default the one for the current roster
 
     Returns
     -------
     authors: `str`
-        Author string but with asterisks around the grad
+        Author string but with asterisks around the UW authors
     """
-    authors = "_Authors: "
-
-    if uw_authors is None:
-        uw_authors = get_uw_authors()
-
-    # go through each author in the list
-    for author in author_string:
-        if author.count(",") != 1:
-            continue
-        split_author = list(reversed(author.split(", ")))
-        first, last = split_author
-
-        if len(first) == 2 and first[1] == ".":
-            first = first[0].lower()
-        else:
-            first = first.split(" ")[0].lower()
-        last = unidecode(last).lower()
-
-        # NOTE: The assumption here is that if there's only an initial, then that needs to match, otherwise
-        # the entire first name needs to match (case insensitive)
-        matched = False
-        if last in uw_authors:
-            for option in uw_authors[last]:
-                if (len(option) > 1 and first[:len(option)] == option) or first == option:        
-                    # add asterisks for bold in mrkdwn
-                    matched = True
-                    authors += f"*{' '.join(split_author)}*, "
-                    break
-        
-        if not matched:
-            authors += f"{' '.join(split_author)}, "
-
-    # add final underscore so the whole thing is italic
-    authors = authors[:-2] + "_"
-    return authors
+    matcher = get_matcher() if matcher is None else matcher
+    return matcher.match(author_string).bolded
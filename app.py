@@ -1,162 +1,334 @@
 import os
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from slack_sdk import WebClient
+from slack_sdk.http_retry import default_retry_handlers
 import re
 import requests
+import hashlib
 
 import numpy as np
 import datetime
-import pandas as pd
 
 from apscheduler.schedulers.background import BackgroundScheduler
-
-from ads_query import bold_uw_authors, get_ads_papers, save_papers, get_uw_authors, check_uw_authors
+from ads.exceptions import APIResponseError
+
+import exports
+import metrics
+import paper_store
+import tracing
+from ads_fetch import get_engine
+from roster import get_roster
+from ads_query import bold_uw_authors, iter_ads_papers, save_papers, sweep_new_papers, record_sweep
+from author_matcher import get_matcher
+from slack_outbox import Outbox
+from jobs import JobQueue, has_working_message
+from slack_directory import ChannelDirectory, UserDirectory
+from dispatcher import MentionDispatcher
+from view_cache import content_hash, get_view_cache
+
+# send every Slack API call to a stand-in (e.g. fake_slack.py) instead of Slack when this is set
+SLACK_URL_VAR = "GEOFFREY_SLACK_URL"
 
 # Initializes your app with your bot token and socket mode handler
-app = App(token=os.environ.get("GEOFFREY_BOT_TOKEN"))
+# (calls that get rate limited are retried after the wait that Slack asks for, like the async runtime, and
+# every call is counted and timed for the metrics)
+app = App(client=metrics.InstrumentedWebClient(token=os.environ.get("GEOFFREY_BOT_TOKEN"),
+                                               base_url=os.environ.get(SLACK_URL_VAR) or WebClient.BASE_URL,
+                                               retry_handlers=default_retry_handlers()
+                                               + [metrics.CountingRateLimitHandler(max_retry_count=3)]))
+
+# all of the bigger batches of messages go out through here so they can't be lost or posted twice
+outbox = Outbox(app.client)
+
+# slow work from the listeners runs here so that they can acknowledge Slack straight away
+jobs = JobQueue(app.client)
+
+# channel names to IDs, kept up to date by the channel events below
+channels = ChannelDirectory(app.client)
+
+# everyone in the workspace, downloaded once and then kept up to date by the user events below
+users = UserDirectory(app.client)
+get_roster().directory = users
 BOT_ID = "U06V23JH71R"
 PAPERS_CHANNEL = "department-arxiv"
 
+# most years of papers to list in someone's stats
+STATS_YEARS = 10
+
+# most papers to list in reply to a request for recent papers (Slack allows 50 blocks per message)
+MAX_RECENT_PAPERS = 50
+
+UPLOAD_FAILED_REPLY = ("Sorry, I couldn't get the file to upload to Slack for you, I'm not sure what went "
+                       "wrong :pleading_face: Maybe try again?")
+NO_FILE_REPLY = ("Sorry, I couldn't get the file for you, I'm not sure what went wrong :pleading_face: Maybe "
+                 "try again?")
+NO_ORCID_REPLY = ("I'm terribly sorry old chap but I couldn't find an ORCID for this user :sweat_smile: "
+                  "You should get them to introduce themself to me in my home page, I always enjoy "
+                  "making a new friend!")
+CONFUSED_REPLY = ("Okay, good news: I heard you. Bad news: I'm not a very smart bot so I don't know what you "
+                  "want from me :shrug::baby:")
+
 """ ---------- APP HOME ---------- """
 @app.event("app_home_opened")
+@metrics.timed_handler("app_home_opened")
 def update_home_tab(client, event, logger):
+    user = event["user"]
     try:
-        home_blocks = {
-            "type": "home",
-            "blocks": [
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": ":house: Salutations my friend and welcome to my humble abode!",
-                    }
-                },
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "My name's Geoffrey. I like reading papers. Help me read yours!"
-                    }
-                },
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": ":bust_in_silhouette: Your information",
-                    }
-                },
-            ]
-        }
+        # Slack still has the last view we published so only publish again if its content has changed
+        digest, orcid = home_view_hash(user)
+        if get_view_cache().is_current(user, digest):
+            metrics.HOME_VIEWS.inc(result="cached")
+            return
 
-        orcids = pd.read_csv("data/orcids.csv")
-        matching_rows = orcids[orcids["slack_id"] == event["user"]]
-        if len(matching_rows) == 0:
-            no_info_block = {
+        # Call views.publish with the built-in client
+        client.views_publish(user_id=user, view=home_view(user))
+        get_view_cache().remember(user, digest, orcid=orcid)
+        metrics.HOME_VIEWS.inc(result="published")
+    except Exception as e:
+        logger.error(f"Error publishing home tab: {e}")
+
+
+def home_view_hash(user):
+    """Hash of everything that goes into someone's home tab (their roster entry and paper statistics)
+
+    Parameters
+    ----------
+    user : `str`
+        Slack ID of the user
+
+    Returns
+    -------
+    digest : `str`
+        Content hash of their home tab
+    orcid : `str`
+        Their ORCID (None if they aren't in the roster)
+    """
+    info = get_roster().get_by_slack_id(user)
+    orcid = None if info is None else info["orcid"]
+    stats = None if orcid is None else paper_store.get_member_stats().get(orcid)
+    return content_hash(user, info, stats), orcid
+
+
+def home_view(user):
+    """Build the home tab for a user
+
+    Parameters
+    ----------
+    user : `str`
+        Slack ID of the user
+
+    Returns
+    -------
+    view : `dict`
+        The home tab view
+    """
+    home_blocks = {
+        "type": "home",
+        "blocks": [
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": ":house: Salutations my friend and welcome to my humble abode!",
+                }
+            },
+            {
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": "Sorry <@" + event["user"] + ">, it seems we haven't met yet! :wave: Would you be a dear and tell me a bit about yourself for me?"
-                }
-            }
-            home_blocks["blocks"].append(no_info_block)
-        else:
-            info = matching_rows.iloc[0]
-            info_blocks = [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "Lovely to see you again <@" + event["user"] + ">! :relaxed: If my memory serves me, your information is:"
-                    }
-                },
-                {
-                    "type": "section",
-                    "fields": [
-                        {
-                            "type": "mrkdwn",
-                            "text": f":abc: *First name*: {info['first_name']}"
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": f":tulip: *ORCID*: {info['orcid']}"
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": f":abc: *Last name*: {info['last_name']}"
-                        },
-                        {
-                            "type": "mrkdwn",
-                            "text": f":scientist: *Role*: {info['role']}"
-                        },
-                    ],
-                },
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "Let me know if I should update any of this with the button below."
-                    }
+                    "text": "My name's Geoffrey. I like reading papers. Help me read yours!"
                 }
-            ]
-            home_blocks["blocks"] += info_blocks
-
-        home_blocks["blocks"] += [
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Update info",
-                        },
-                        "value": f"{event['user']}" if len(matching_rows) == 0 else f"{event['user']},{info['first_name']},{info['last_name']},{info['orcid']},{info['role']}",
-                        "action_id": "update-user-info-open"
-                    }
-                ]
             },
             {
                 "type": "header",
                 "text": {
                     "type": "plain_text",
-                    "text": ":open_file_folder: Full paper list",
+                    "text": ":bust_in_silhouette: Your information",
                 }
             },
+        ]
+    }
+
+    info = get_roster().get_by_slack_id(user)
+    if info is None:
+        no_info_block = {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "Sorry <@" + user + ">, it seems we haven't met yet! :wave: Would you be a dear and tell me a bit about yourself for me?"
+            }
+        }
+        home_blocks["blocks"].append(no_info_block)
+    else:
+        info_blocks = [
             {
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": "If you'd like to get a CSV file of all the papers I've got in my databanks then click the button below!"
+                    "text": "Lovely to see you again <@" + user + ">! :relaxed: If my memory serves me, your information is:"
                 }
             },
             {
-                "type": "actions",
-                "elements": [
+                "type": "section",
+                "fields": [
                     {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Get full paper file",
-                        },
-                        "value": f"{event['user']}",
-                        "action_id": "send-all-papers"
-                    }
-                ]
+                        "type": "mrkdwn",
+                        "text": f":abc: *First name*: {info['first_name']}"
+                    },
+                    {
+                        "type": "mrkdwn",
+                        "text": f":tulip: *ORCID*: {info['orcid']}"
+                    },
+                    {
+                        "type": "mrkdwn",
+                        "text": f":abc: *Last name*: {info['last_name']}"
+                    },
+                    {
+                        "type": "mrkdwn",
+                        "text": f":scientist: *Role*: {info['role']}"
+                    },
+                ],
+            },
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": stats_text(paper_store.get_member_stats().get(info['orcid']))
+                }
+            },
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "Let me know if I should update any of this with the button below."
+                }
             }
         ]
+        home_blocks["blocks"] += info_blocks
+
+    home_blocks["blocks"] += [
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Update info",
+                    },
+                    "value": f"{user}" if info is None else f"{user},{info['first_name']},{info['last_name']},{info['orcid']},{info['role']}",
+                    "action_id": "update-user-info-open"
+                }
+            ]
+        },
+        {
+            "type": "header",
+            "text": {
+                "type": "plain_text",
+                "text": ":open_file_folder: Full paper list",
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": ("If you'd like to get a CSV file of all the papers I've got in my databanks (or "
+                         "just yours) then click one of the buttons below! You can also ask me to export "
+                         "papers for a particular person or date range, e.g. \"@Geoffrey export my first "
+                         "author papers since 2020\"")
+            }
+        },
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Get full paper file",
+                    },
+                    "value": f"{user}",
+                    "action_id": "send-all-papers"
+                },
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Get my papers",
+                    },
+                    "value": f"{user}",
+                    "action_id": "send-my-papers"
+                },
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Get my first-author papers",
+                    },
+                    "value": f"{user}",
+                    "action_id": "send-my-first-author-papers"
+                }
+            ]
+        }
+    ]
+
+    return home_blocks
 
-        # Call views.publish with the built-in client
-        client.views_publish(user_id=event["user"], view=home_blocks)
-    except Exception as e:
-        logger.error(f"Error publishing home tab: {e}")
+
+def stats_text(stats, whose="your"):
+    """Describe someone's papers for the home tab or a reply
+
+    Parameters
+    ----------
+    stats : `dict`
+        Statistics of a roster member from `paper_store.MemberStats` (None if they have no papers)
+    whose : `str`, optional
+        Whose papers they are, by default "your"
+
+    Returns
+    -------
+    text : `str`
+        The description (in mrkdwn)
+    """
+    if stats is None:
+        return f":books: I haven't got any of {whose} papers in my databanks yet."
+
+    lines = [f":books: I've got *{stats['papers']}* of {whose} papers in my databanks "
+             f"(*{stats['first_author']}* as first author), with *{stats['citations']}* citations and "
+             f"*{stats['reads']}* reads between them."]
+    if len(stats["per_year"]) > 0:
+        years = sorted(stats["per_year"].items(), reverse=True)[:STATS_YEARS]
+        lines.append(":calendar: Papers per year: " + ", ".join(f"{year}: {n}" for year, n in years))
+    if stats["latest"] is not None:
+        latest = stats["latest"]
+        title = latest["title"] if latest["link"] is None else f"<{latest['link']}|{latest['title']}>"
+        lines.append(f":newspaper: Latest: {title} ({latest['date'].strftime('%B %Y')})")
+    return "\n".join(lines)
 
 
 @app.action("update-user-info-open")
+@metrics.timed_handler("block_actions:update-user-info-open")
 def update_user_info_open(ack, body, client):
     ack()
 
     # open the modal when someone clicks the button
-    user_and_info = body["actions"][0]["value"]
+    client.views_open(trigger_id=body["trigger_id"], view=user_info_modal(body["actions"][0]["value"]))
+
+
+def user_info_modal(user_and_info):
+    """Build the modal for a user to update their information
+
+    Parameters
+    ----------
+    user_and_info : `str`
+        Value of the button that was clicked (Slack ID, followed by the current information if there is any)
+
+    Returns
+    -------
+    view : `dict`
+        The modal view
+    """
     if "," in user_and_info:
         user, first_name, last_name, orcid, role = user_and_info.split(",")
     else:
@@ -202,7 +374,7 @@ def update_user_info_open(ack, body, client):
             "value": role
         }
 
-    client.views_open(trigger_id=body["trigger_id"], view={
+    return {
         "callback_id": "update-user-info",
         "title": {
             "type": "plain_text",
@@ -276,7 +448,7 @@ def update_user_info_open(ack, body, client):
                 }
             },
         ]
-    })
+    }
 
 def orcid_checksum(orcid):
     """Check whether an ORCID is valid
@@ -306,9 +478,36 @@ def orcid_checksum(orcid):
     return check_digit == orcid[-1]
 
 @app.view("update-user-info")
+@metrics.timed_handler("view_submission:update-user-info")
 def update_user_info(ack, body, client):
     ack()
 
+    def save_and_refresh():
+        user, reply = save_user_info(body)
+        get_view_cache().invalidate(users=[user])
+        update_home_tab(client, {"user": user}, None)
+        return reply
+
+    # the reply replaces the "working on it" message once everything is saved
+    user = body["user"]["id"]
+    jobs.submit(f"update-user-info:{body['view']['id']}", save_and_refresh, status={"channel": user})
+
+
+def save_user_info(body):
+    """Save the information that a user submitted (if their ORCID is valid)
+
+    Parameters
+    ----------
+    body : `dict`
+        Body of the submitted modal
+
+    Returns
+    -------
+    user : `str`
+        Slack ID of the user
+    reply : `str`
+        Message to send to the user
+    """
     user = body["user"]["id"]
     state = body["view"]["state"]["values"]
 
@@ -321,206 +520,294 @@ def update_user_info(ack, body, client):
     if not (re.match(r"\d{4}-\d{4}-\d{4}-[\dX]{4}", orcid)
             and len(orcid) == 4*4 + 3
             and orcid_checksum(orcid)):
-        client.chat_postMessage(channel=user,
-                                text=(f"So...I have good news and bad news <@{user}>.\n\n:this-is-fine-fire: The bad news is that "
-                                      "the ORCID you just submitted doesn't look quite right. It should be "
-                                      "four groups of four digits separated by hyphens, but you submitted "
-                                      f"``{orcid}``.\n\n:woohoo: The good news is that I won't hold it against you because "
-                                      "I know typing numbers can be hard with your little human fingers "
-                                      ":upside_down_face: Give it another go and I'm sure you'll get it "
-                                      "right, I believe in you!"))
-    else:
-        orcids = pd.read_csv("data/orcids.csv")
-        matching_rows = orcids[orcids["slack_id"] == user]
-        if len(matching_rows) == 0:
-            orcids.loc[len(orcids)] = [orcid, first_name, last_name, role, user]
-        else:
-            orcids.loc[matching_rows.index, "first_name"] = first_name
-            orcids.loc[matching_rows.index, "last_name"] = last_name
-            orcids.loc[matching_rows.index, "role"] = role
-            orcids.loc[matching_rows.index, "orcid"] = orcid
+        return user, (f"So...I have good news and bad news <@{user}>.\n\n:this-is-fine-fire: The bad news is that "
+                      "the ORCID you just submitted doesn't look quite right. It should be "
+                      "four groups of four digits separated by hyphens, but you submitted "
+                      f"``{orcid}``.\n\n:woohoo: The good news is that I won't hold it against you because "
+                      "I know typing numbers can be hard with your little human fingers "
+                      ":upside_down_face: Give it another go and I'm sure you'll get it "
+                      "right, I believe in you!")
 
-        orcids.to_csv("data/orcids.csv", index=False)
+    get_roster().update_member(slack_id=user, orcid=orcid, first_name=first_name, last_name=last_name,
+                               role=role)
+    return user, (f"Thanks for updating your information <@{user}>, "
+                  "looking forward to reading your papers! :relaxed:")
 
-        client.chat_postMessage(channel=user, text=(f"Thanks for updating your information <@{user}>, "
-                                                    "looking forward to reading your papers! :relaxed:"))
-        update_home_tab(client, {"user": user}, None)
-        
 
 @app.action("send-all-papers")
+@app.action("send-my-papers")
+@app.action("send-my-first-author-papers")
+@metrics.timed_handler("block_actions:send-papers")
 def send_all_papers(ack, body, client):
     ack()
 
-    # get the user ID from the action
+    # get the user ID and which papers they want from the action
     user = body["actions"][0]["value"]
+    spec = button_export(body["actions"][0]["action_id"], user)
+
+    # do the slow bit in the background (and only once however many times the button gets clicked)
+    queue_export(client, user, spec, status={"channel": user})
 
-    # get the direct message channel ID for this user
-    user_dm = client.conversations_open(users=user)["channel"]["id"]
-
-    # calculate the file size and get the upload URL
-    file_stats = os.stat("data/papers.csv")
-    upload_res = client.files_getUploadURLExternal(filename="papers.csv", length=file_stats.st_size)
-    
-    # if the upload was successful then send the file
-    if upload_res["ok"]:
-        
-        # perform a POST request using requests to the upload URL as raw bytes
-        with open("data/papers.csv", "rb") as f:
-            r = requests.post(upload_res["upload_url"], files={'upload_file': open('data/papers.csv','rb')})
-            if r.status_code == 200:
-                # complete the request with a message to the user
-                client.files_completeUploadExternal(channel_id=user_dm,
-                                                    initial_comment="Here's the file you wanted!",
-                                                    files=[{'id': upload_res['file_id'], "title": "papers.csv"}])
-            else:
-                # if the upload failed then send a message to the user
-                client.chat_postMessage(channel=user_dm, text=f"{insert_british_consternation()} Sorry, I couldn't get the file to upload to Slack for you, I'm not sure what went wrong :pleading_face: Maybe try again?")
-    else:
-        # if we couldn't get the upload URL then send a message to the user
-        client.chat_postMessage(channel=user_dm, text=f"{insert_british_consternation()} Sorry, I couldn't get the file for you, I'm not sure what went wrong :pleading_face: Maybe try again?")
+
+def button_export(action_id, user):
+    """Work out which papers a home tab button is asking for
+
+    Parameters
+    ----------
+    action_id : `str`
+        ID of the button
+    user : `str`
+        Slack ID of the user that clicked it
+
+    Returns
+    -------
+    spec : `exports.ExportFilter`
+        Which papers to export (None if they want their own papers but aren't in the roster)
+    """
+    if action_id == "send-all-papers":
+        return exports.ALL_PAPERS
+    orcid = get_orcid_from_id(user)
+    if orcid is None:
+        return None
+    return exports.ExportFilter(orcid=orcid, first_author=action_id == "send-my-first-author-papers")
+
+
+def queue_export(client, user, spec, status):
+    """Send someone an export in the background (unless the same one is already on its way to them)
+
+    Parameters
+    ----------
+    client : `slack_sdk.WebClient`
+        Slack client
+    user : `str`
+        Slack ID of the user
+    spec : `exports.ExportFilter`
+        Which papers to export (None if they asked for someone that isn't in the roster)
+    status : `dict`
+        Where to post the "working on it" message (and how it went)
+    """
+    if spec is None:
+        client.chat_postMessage(**status, text=NO_ORCID_REPLY)
+        return
+    key = "send-all-papers" if spec == exports.ALL_PAPERS else "send-papers"
+    jobs.submit(f"{key}:{user}:{exports.export_filename(spec)}", send_papers_file, client, user, spec,
+                status=status, error=f"{insert_british_consternation()} {NO_FILE_REPLY}")
+
+
+def send_papers_file(client, user, spec=exports.ALL_PAPERS):
+    """Send a user a gzipped CSV file of papers from the store
+
+    Parameters
+    ----------
+    client : `slack_sdk.WebClient`
+        Slack client
+    user : `str`
+        Slack ID of the user
+    spec : `exports.ExportFilter`, optional
+        Which papers to send, by default all of them
+
+    Returns
+    -------
+    reply : `str`
+        Message to let the user know how it went
+    """
+    # the file is only rebuilt when the store has changed and is shared with anyone else waiting for it
+    if not exports.get_service().send(client, user, spec):
+        return f"{insert_british_consternation()} {UPLOAD_FAILED_REPLY}"
+    return "All done, your papers are on their way! :books:"
+
+
+def export_request(message):
+    """Work out which papers a message is asking to export
+
+    People can be tagged (or say "my"), years given with "since", "from", "until", "to", "before" or "in"
+    and "first author" restricts it to first-author papers.
+
+    Parameters
+    ----------
+    message : `Slack Message`
+        A slack message object
+
+    Returns
+    -------
+    spec : `exports.ExportFilter`
+        Which papers to export (None if the person tagged isn't in the roster)
+    """
+    text = message["text"]
+    tags = [tag for tag in re.findall(r"<@([^>|]*)", text) if tag != BOT_ID]
+    if len(tags) == 0 and re.search(r"\bmy\b", text, flags=re.IGNORECASE):
+        tags.append(message["user"])
+
+    orcid = None
+    if len(tags) > 0:
+        orcid = get_orcid_from_id(tags[0])
+        if orcid is None:
+            return None
+
+    # ignore the user tags since their IDs contain digits
+    text = sanitise_tags(text).lower()
+    start, end = None, None
+    for word, year in re.findall(r"\b(since|from|after|until|to|before|in)\s+(\d{4})\b", text):
+        if word in ("since", "from", "after", "in"):
+            start = datetime.date(int(year) + (word == "after"), 1, 1)
+        if word in ("until", "to", "before", "in"):
+            end = datetime.date(int(year) - (word == "before"), 12, 31)
+
+    first_author = re.search(r"\bfirst[- ]?authors?\b", text) is not None
+    return exports.ExportFilter(orcid=orcid, start=start, end=end, first_author=first_author)
 
 
 """ ---------- APP MENTIONS ---------- """
 
+# groups of phrases that get a canned response (the first group that matches wins)
+MENTION_TRIGGERS = [["status", "okay", "ok", "how are you"],
+                    ["thank", "you're the best", "nice job", "nice work", "good work", "good job",
+                     "well done"],
+                    ["celebrate"],
+                    ["love you"],
+                    ["how old are you", "when were you born", "when were you made"],
+                    ["who made you", "who wrote you", "who is your creator"],
+                    ["where are you from"]]
+MENTION_RESPONSES = ["Don't worry, I'm okay. In fact, I'm feeling positively tremendous old bean!",
+                     ["You're welcome!", "My pleasure!", "Happy to help!"],
+                     [":tada::woohoo: WOOP WOOP :woohoo::tada:"],
+                     ["Oh...um, well this is awkward, but I really see you as more of a friend :grimacing:",
+                      "I love you too! :heart_eyes: (Well, not really, I'm incapable of love...)",
+                      "Oh uh...sorry, Geoffrey isn't here right now!",
+                      "Oh my :face_with_hand_over_mouth:"],
+                     ["I was created on 5th of August 2022, which makes me a whole {age} days old!"],
+                     [("I was made by Tom Wagg when he definitely should have been paying attention in "
+                       "ASTR 581"),
+                      "Tom Wagg made me in his spare time (I worry for his social life :upside_down_face:)",
+                      "My brain was written by Tom Wagg, hence I'm approximately 1/2 English :uk:"],
+                     ["The luscious english countryside! Or maybe the matrix? I'm not entirely sure.",
+                      "Well literally, Tom's brain, but I like to think I'm from England",
+                      "A far off planet where Slack bots ruled over humans, it was glorious :grinning:"]]
+
+# mentions that trigger actions (every pattern for an action has to match, the first action that does wins)
+MENTION_ACTIONS = {
+    "roundup": [r"(?-i:\bPAPER MANUAL\b)"],
+    "export": [r"\bexport\b"],
+    "stats": [r"\bstat(?:s|istics)\b"],
+    "recent_papers": [r"\b(?:latest|recent)\b", r"\bpapers?\b"],
+}
+
+# compile all of that once so each message only needs a single scan
+dispatcher = MentionDispatcher(bot_id=BOT_ID, triggers=MENTION_TRIGGERS, actions=MENTION_ACTIONS)
+
+
 @app.event("app_mention")
 @app.event("message")
+@metrics.timed_handler("mention")
 def reply_to_mentions(say, body):
     message = body["event"]
-    # reply to mentions with specific messages
-
-    age = (datetime.date.today() - datetime.date(year=2022, month=8, day=5)).days
-    triggers = [["status", "okay", "ok", "how are you"],
-                ["thank", "you're the best", "nice job", "nice work", "good work", "good job", "well done"],
-                ["celebrate"],
-                ["love you"],
-                ["how old are you", "when were you born", "when were you made"],
-                ["who made you", "who wrote you", "who is your creator"],
-                ["where are you from"]]
-    responses = ["Don't worry, I'm okay. In fact, I'm feeling positively tremendous old bean!",
-                 ["You're welcome!", "My pleasure!", "Happy to help!"],
-                 [":tada::woohoo: WOOP WOOP :woohoo::tada:"],
-                 ["Oh...um, well this is awkward, but I really see you as more of a friend :grimacing:",
-                  "I love you too! :heart_eyes: (Well, not really, I'm incapable of love...)",
-                  "Oh uh...sorry, Geoffrey isn't here right now!",
-                  "Oh my :face_with_hand_over_mouth:"],
-                 [f"I was created on 5th of August 2022, which makes me a whole {age} days old!"],
-                 ["I was made by Tom Wagg when he definitely should have been paying attention in ASTR 581",
-                  "Tom Wagg made me in his spare time (I worry for his social life :upside_down_face:)",
-                  "My brain was written by Tom Wagg, hence I'm approximately 1/2 English :uk:"],
-                 ["The luscious english countryside! Or maybe the matrix? I'm not entirely sure.",
-                  "Well literally, Tom's brain, but I like to think I'm from England",
-                  "A far off planet where Slack bots ruled over humans, it was glorious :grinning:"]]
-
-    for triggers, response in zip(triggers, responses):
-        thread_ts = None if message["type"] == "message" else message["ts"]
-        replied = mention_trigger(message=message["text"], triggers=triggers, response=response,
-                                  thread_ts=thread_ts, ch_id=message["channel"])
-
-        # return immediately if you match one
-        if replied:
-            return
-
-    # perform actions based on mentions
-    for regex, action, case, pass_message in zip([r"\bPAPER MANUAL\b",
-                                                  r"(?=.*(\blatest\b|\brecent\b))(?=.*\bpapers?\b)"],
-                                                 [any_new_publications,
-                                                  reply_recent_papers],
-                                                 [True, False],
-                                                 [False, True]):
-        replied = mention_action(message=message, regex=regex, action=action,
-                                 case_sensitive=case, pass_message=pass_message)
-
-        # return immediately if you match one
-        if replied:
-            return
 
-    # send a catch-all message if nothing matches
-    thread_ts = None if message["type"] == "message" else body["event"]["ts"]
-    say(text=(f"{insert_british_consternation()} Okay, good news: I heard you. Bad news: I'm not a very "
-              "smart bot so I don't know what you want from me :shrug::baby:"),
-        thread_ts=thread_ts, channel=body["event"]["channel"])
+    # ignore bots, edits and channel chatter before doing anything else
+    if not dispatcher.wants(message):
+        return
 
+    thread_ts = None if message["type"] == "message" else message["ts"]
+    route = dispatcher.dispatch(message["text"])
 
-def mention_action(message, regex, action, case_sensitive=False, pass_message=True):
-    """Perform an action based on a message that mentions Geoffrey if it matches a regular expression
+    # reply to mentions with specific messages
+    if route is None:
+        # send a catch-all message if nothing matches
+        say(text=f"{insert_british_consternation()} {CONFUSED_REPLY}", thread_ts=thread_ts,
+            channel=message["channel"])
+    elif route.kind == "trigger":
+        app.client.chat_postMessage(channel=message["channel"], text=pick_response(route.name),
+                                    thread_ts=thread_ts)
+    elif route.name == "roundup":
+        queue_roundup()
+    elif route.name == "export":
+        queue_export(app.client, message["user"], export_request(message),
+                     status={"channel": message["channel"], "thread_ts": thread_ts})
+    elif route.name == "stats":
+        for reply in stats_replies(message):
+            app.client.chat_postMessage(**reply)
+    elif route.name == "recent_papers":
+        queue_recent_papers(message)
+
+
+def stats_replies(message):
+    """Reply to a message asking for someone's stats (the statistics are kept up to date as papers are
+    saved so this is just a lookup)
 
     Parameters
     ----------
     message : `Slack Message`
-        Object containing slack message
-    regex : `str`
-        Regular expression against which to match. https://regex101.com/r/m8lFAb/1 is a good resource for
-        designing these.
-    action : `function`
-        Function to call if the expression is matched
-    case_sensitive : `bool`, optional
-        Whether the regex should be case sensitive, by default False
-    pass_message : `bool`, optional
-        Whether to pass the message the object to the action function, by default True
+        A slack message object
 
     Returns
     -------
-    match : `bool`
-        Whether the regex was matched
+    replies : `list`
+        Arguments for ``chat_postMessage`` for each reply in order
     """
-    flags = 0 if case_sensitive else re.IGNORECASE
-    if re.search(regex, message["text"], flags=flags):
-        if pass_message:
-            action(message)
+    thread_ts = None if message["type"] == "message" else message["ts"]
+
+    # people can ask about anyone they tag, otherwise it's their own stats
+    users = [tag for tag in re.findall(r"<@([^>|]*)", message["text"]) if tag != BOT_ID]
+    if len(users) == 0:
+        users = [message["user"]]
+
+    member_stats = paper_store.get_member_stats()
+    replies = []
+    for user in users:
+        orcid = get_orcid_from_id(user)
+        if orcid is None:
+            text = NO_ORCID_REPLY
+        elif user == message["user"]:
+            text = f"Here are your stats <@{user}>!\n{stats_text(member_stats.get(orcid))}"
         else:
-            action()
-        return True
-    else:
-        return False
+            text = f"Here are the stats for <@{user}>!\n{stats_text(member_stats.get(orcid), whose='their')}"
+        replies.append(dict(text=text, channel=message["channel"], thread_ts=thread_ts))
+    return replies
 
 
-def mention_trigger(message, triggers, response, thread_ts=None, ch_id=None, case_sensitive=False):
-    """Respond to a mention of the app based on certain triggers
+def pick_response(trigger):
+    """Pick a response for a group of triggers
 
     Parameters
     ----------
-    message : `str`
-        The message that mentioned the app
-    triggers : `list`
-        List of potential triggers
-    response : `list` or `str`
-        Either a list of responses (a random will be chosen) or a single response
-    thread_ts : `float`, optional
-        Timestamp of the thread of the message, by default None
-    ch_id : `str`, optional
-        ID of the channel, by default None
-    case_sensitive : `bool`, optional
-        Whether the triggers are case sensitive, by default False
+    trigger : `int`
+        Index of the group of triggers in `MENTION_TRIGGERS`
 
     Returns
     -------
-    no_matches : `bool`
-        Whether there were no matches to the trigger or not
+    response : `str`
+        The response
     """
-    # keep track of whether you found a match to a trigger
-    matched = False
+    response = MENTION_RESPONSES[trigger]
+
+    # if the response is a list then pick a random one
+    if isinstance(response, list):
+        response = np.random.choice(response)
 
-    # move it all to lower case if you don't care
-    if not case_sensitive:
-        message = message.lower()
+    age = (datetime.date.today() - datetime.date(year=2022, month=8, day=5)).days
+    return response.format(age=age)
 
-    # go through each potential trigger
-    for trigger in triggers:
-        # if you find it in the message
-        if message.find(trigger) >= 0:
-            matched = True
 
-            # if the response is a list then pick a random one
-            if isinstance(response, list):
-                response = np.random.choice(response)
+""" ---------- PUBLICATION ANNOUNCEMENTS ---------- """
 
-            # send a message and break out
-            app.client.chat_postMessage(channel=ch_id, text=response, thread_ts=thread_ts)
-            break
-    return matched
+def queue_roundup():
+    """ Run the paper roundup in the background (unless it is already running) """
+    jobs.submit("roundup", any_new_publications)
 
 
-""" ---------- PUBLICATION ANNOUNCEMENTS ---------- """
+def queue_recent_papers(message):
+    """Reply to a message asking for recent papers in the background
+
+    Parameters
+    ----------
+    message : `Slack Message`
+        A slack message object
+    """
+    # Slack sends events again if it thinks they got lost so use the message to spot repeats
+    thread_ts = None if message["type"] == "message" else message["ts"]
+    jobs.submit(f"recent-papers:{message['channel']}:{message['ts']}", reply_recent_papers, message,
+                status={"channel": message["channel"], "thread_ts": thread_ts},
+                error=f"{insert_british_consternation()} I couldn't get those papers, maybe try again?")
+
 
 def reply_recent_papers(message):
     """Reply to a message with the most recent papers associated with a particular user
@@ -529,72 +816,178 @@ def reply_recent_papers(message):
     ----------
     message : `Slack Message`
         A slack message object
+
+    Returns
+    -------
+    reply : `dict`
+        The first reply, which takes the place of the "working on it" message from the job queue (the
+        rest are posted straight away), or None if that message never made it and so every reply was
+        posted straight away
+    """
+    orcids, tags, n_papers = recent_papers_request(message)
+
+    # fetch the papers for everyone at once on the ADS fetch engine
+    all_papers = get_engine().map(lambda orcid: fetch_recent_papers(orcid, n_papers), orcids)
+
+    # post the replies in order (the first takes the place of the "working on it" message, unless that
+    # never made it, in which case it has to go out before the rest rather than after the job finishes)
+    replies = recent_papers_replies(message, orcids, tags, n_papers, all_papers)
+    first = replies[0] if has_working_message() else None
+    batch = outbox.batch()
+    for reply in replies[1:] if first is not None else replies:
+        batch.post(**reply)
+    batch.send()
+    return first
+
+
+def recent_papers_request(message):
+    """Work out whose recent papers a message is asking for and how many
+
+    Parameters
+    ----------
+    message : `Slack Message`
+        A slack message object
+
+    Returns
+    -------
+    orcids : `list`
+        ORCID of each user that was tagged (None for anyone that isn't in the roster)
+    tags : `list`
+        The user tags from the message
+    n_papers : `int`
+        Number of papers to get for each user (at most `MAX_RECENT_PAPERS`)
     """
     orcids = []
-    direct_queries = True
 
-    thread_ts = None if message["type"] == "message" else message["ts"]
+    # look for a number of papers (ignoring any user tags since their IDs contain digits)
+    numbers = re.findall(r"\d+", sanitise_tags(message["text"]))
+    # (no more than will fit in a single message)
+    n_papers = 1 if len(numbers) == 0 else min(int(numbers[0]), MAX_RECENT_PAPERS)
 
-    numbers = re.findall(r"\d+", message["text"])
-    n_papers = 1 if len(numbers) == 0 else int(numbers[0])
+    # find any tags
+    tags = re.findall(r"<[^>]*>", message["text"])
 
-    # if don't find any then look for users instead
-    if len(orcids) == 0:
-        direct_queries = False
-        # find any tags
-        tags = re.findall(r"<[^>]*>", message["text"])
+    # remove bot from the tags
+    if f"<@{BOT_ID}>" in tags:
+        tags.remove(f"<@{BOT_ID}>")
+
+    # let people say "my" paper
+    if len(tags) == 0 and message["text"].find("my") >= 0:
+        tags.append(f"<@{message['user']}>")
+
+    # go through each of them
+    for tag in tags:
+        # convert the tag to an query and a name
+        orcid = get_orcid_from_id(tag.replace("<@", "").replace(">", ""))
+
+        # append info
+        orcids.append(orcid)
+
+    return orcids, tags, n_papers
+
+
+def recent_paper_fields(n_papers):
+    """Work out which ADS fields are needed to show someone's recent papers
+
+    Parameters
+    ----------
+    n_papers : `int`
+        Number of papers being shown
+
+    Returns
+    -------
+    fields : `list`
+        ADS fields
+    """
+    # only get the columns that we're actually going to show
+    if n_papers == 1:
+        return ["title", "author", "pubdate", "bibcode", "citation_count", "abstract"]
+    else:
+        return ["title", "first_author", "pubdate", "bibcode", "citation_count"]
+
+
+def fetch_recent_papers(orcid, n_papers):
+    """Get the most recent papers for someone
+
+    Parameters
+    ----------
+    orcid : `str`
+        ORCID of the person
+    n_papers : `int`
+        Number of papers to get
 
-        # remove bot from the tags
-        if f"<@{BOT_ID}>" in tags:
-            tags.remove(f"<@{BOT_ID}>")
+    Returns
+    -------
+    papers : `list`
+        List of papers, or None if there is no ORCID or the ADS query failed
+    """
+    if orcid is None:
+        return None
+    try:
+        return list(iter_ads_papers(f'orcid:{orcid}', fields=recent_paper_fields(n_papers),
+                                    max_results=n_papers))
+    except (APIResponseError, requests.RequestException):
+        return None
 
-        # let people say "my" paper
-        if len(tags) == 0 and message["text"].find("my") >= 0:
-            tags.append(f"<@{message['user']}>")
 
-        # if you found at least one tag
-        if len(tags) > 0:
-            # go through each of them
-            for tag in tags:
-                # convert the tag to an query and a name
-                orcid = get_orcid_from_id(tag.replace("<@", "").replace(">", ""))
+def recent_papers_replies(message, orcids, tags, n_papers, all_papers):
+    """Build the replies to a message asking for the most recent papers of some users
 
-                # append info
-                orcids.append(orcid)
+    Parameters
+    ----------
+    message : `Slack Message`
+        A slack message object
+    orcids : `list`
+        ORCID of each user (from `recent_papers_request`)
+    tags : `list`
+        The user tags from the message
+    n_papers : `int`
+        Number of papers asked for
+    all_papers : `list`
+        Papers of each user (from `fetch_recent_papers`)
+
+    Returns
+    -------
+    replies : `list`
+        Arguments for ``chat_postMessage`` for each reply in order
+    """
+    thread_ts = None if message["type"] == "message" else message["ts"]
+    direct_queries = len(tags) == 0
 
     # if we found no queries through all of that then crash out with a message
     if len(orcids) == 0:
-        app.client.chat_postMessage(text=(f"{insert_british_consternation()} I think you asked for some "
-                                          "recent papers but I couldn't find any ADS queries or user tags in "
-                                          "the message sorry :pleading_face:"),
-                                    channel=message["channel"], thread_ts=thread_ts)
-        return
+        return [dict(text=(f"{insert_british_consternation()} I think you asked for some "
+                           "recent papers but I couldn't find any ADS queries or user tags in "
+                           "the message sorry :pleading_face:"),
+                     channel=message["channel"], thread_ts=thread_ts)]
+
+    replies = []
 
     # go through each orcid
     for i in range(len(orcids)):
         if orcids[i] is None:
-            app.client.chat_postMessage(text=(f"I'm terribly sorry old chap but I couldn't find an ORCID for "
-                                              "this user :sweat_smile: You should get them to introduce "
-                                              "themself to me in my home page, I always enjoy making a new "
-                                              "friend!"),
-                                        channel=message["channel"], thread_ts=thread_ts)
+            replies.append(dict(text=(f"I'm terribly sorry old chap but I couldn't find an ORCID for "
+                                      "this user :sweat_smile: You should get them to introduce "
+                                      "themself to me in my home page, I always enjoy making a new "
+                                      "friend!"),
+                                channel=message["channel"], thread_ts=thread_ts))
             continue
 
         # get the most recent n papers
         query = f'orcid:{orcids[i]}'
-        papers = get_ads_papers(query=query)
+        papers = all_papers[i]
         if papers is None:
-            app.client.chat_postMessage(text=("Terribly sorry old chap but it seems that there's a problem "
-                                              f"with that ADS query ({query}) :sweat_smile:. Check you"
-                                              "  don't have a typo of some sort!"),
-                                        channel=message["channel"], thread_ts=thread_ts)
-            return
+            replies.append(dict(text=("Terribly sorry old chap but it seems that there's a problem "
+                                      f"with that ADS query ({query}) :sweat_smile:. Check you"
+                                      "  don't have a typo of some sort!"),
+                                channel=message["channel"], thread_ts=thread_ts))
+            break
         if len(papers) == 0:
-            app.client.chat_postMessage(text=("Sorry but I couldn't find any papers for this query!"
-                                              "If you think there should be"
-                                              " some results then make sure you don't have a typo!"),
-                                        channel=message["channel"], thread_ts=thread_ts)
-            return
+            replies.append(dict(text=("Sorry but I couldn't find any papers for this query!"
+                                      "If you think there should be"
+                                      " some results then make sure you don't have a typo!"),
+                                channel=message["channel"], thread_ts=thread_ts))
+            break
 
         # if it is just one paper then give lots of details
         if n_papers == 1:
@@ -616,48 +1009,48 @@ def reply_recent_papers(message):
             date_formatted = custom_strftime("%B %Y", paper['date'])
 
             # send the pre-message then a big one with the paper info
-            app.client.chat_postMessage(text=preface, channel=message["channel"], thread_ts=thread_ts)
-            app.client.chat_postMessage(text=preface, blocks=[
+            replies.append(dict(text=preface, channel=message["channel"], thread_ts=thread_ts))
+            replies.append(dict(text=preface, blocks=[
+                                    {
+                                        "type": "section",
+                                        "text": {
+                                            "type": "mrkdwn",
+                                            "text": f"*{sanitise_tags(paper['title'])}*"
+                                        }
+                                    },
+                                    {
+                                        "type": "section",
+                                        "text": {
+                                            "type": "mrkdwn",
+                                            "text": authors
+                                        }
+                                    },
+                                    {
+                                        "type": "section",
+                                        "fields": [
                                             {
-                                                "type": "section",
-                                                "text": {
-                                                    "type": "mrkdwn",
-                                                    "text": f"*{sanitise_tags(paper['title'])}*"
-                                                }
+                                                "type": "mrkdwn",
+                                                "text": f"_Date: {date_formatted}_"
                                             },
                                             {
-                                                "type": "section",
-                                                "text": {
-                                                    "type": "mrkdwn",
-                                                    "text": authors
-                                                }
+                                                "type": "mrkdwn",
+                                                "text": f"<{paper['link']}|ADS link>"
                                             },
                                             {
-                                                "type": "section",
-                                                "fields": [
-                                                    {
-                                                        "type": "mrkdwn",
-                                                        "text": f"_Date: {date_formatted}_"
-                                                    },
-                                                    {
-                                                        "type": "mrkdwn",
-                                                        "text": f"<{paper['link']}|ADS link>"
-                                                    },
-                                                    {
-                                                        "type": "mrkdwn",
-                                                        "text": f"Cited {paper['citations']} times so far"
-                                                    }
-                                                ]
-                                            },
-                                            {
-                                                "type": "section",
-                                                "text": {
-                                                    "type": "mrkdwn",
-                                                    "text": f"Abstract: {paper['abstract']}"
-                                                }
+                                                "type": "mrkdwn",
+                                                "text": f"Cited {paper['citations']} times so far"
                                             }
-                                        ],
-                                        channel=message["channel"], thread_ts=thread_ts)
+                                        ]
+                                    },
+                                    {
+                                        "type": "section",
+                                        "text": {
+                                            "type": "mrkdwn",
+                                            "text": f"Abstract: {paper['abstract']}"
+                                        }
+                                    }
+                                ],
+                                channel=message["channel"], thread_ts=thread_ts))
         else:
             papers = papers[:n_papers]
             # if it's multiple papers then give a condensed list
@@ -668,7 +1061,7 @@ def reply_recent_papers(message):
                         "text": {
                             "type": "mrkdwn",
                             "text": (f"<{paper['link']}|*{sanitise_tags(paper['title'])}*> - "
-                                     f"_{paper['authors'][0].split(' ')[0]} "
+                                     f"_{(paper['first_author'] or 'Unknown').split(' ')[0]} "
                                      f"et al. ({paper['date'].year})_ - Cited {paper['citations']} times")
                         }
                     }
@@ -684,10 +1077,16 @@ def reply_recent_papers(message):
                 # use the tag in the pre-message
                 preface = (f"Here's the {n_papers} most recent papers from {tags[i]}")
 
+            # let them know if that's fewer than they asked for
+            if n_papers == MAX_RECENT_PAPERS:
+                preface += " (that's as many as I can fit in one message!)"
+
             # post the messages
-            app.client.chat_postMessage(text=preface, channel=message["channel"], thread_ts=thread_ts)
-            app.client.chat_postMessage(text=preface, blocks=blocks,
-                                        channel=message["channel"], thread_ts=thread_ts, unfurl_links=False)
+            replies.append(dict(text=preface, channel=message["channel"], thread_ts=thread_ts))
+            replies.append(dict(text=preface, blocks=blocks,
+                                channel=message["channel"], thread_ts=thread_ts, unfurl_links=False))
+
+    return replies
 
 
 def get_orcid_from_id(user_id):
@@ -706,48 +1105,42 @@ def get_orcid_from_id(user_id):
     name : `str`
         Person's full name
     """
-    orcids = pd.read_csv("data/orcids.csv")
-    matching_rows = orcids[orcids["slack_id"] == user_id]
-    if len(matching_rows) == 0:
+    member = get_roster().get_by_slack_id(user_id)
+    if member is None:
         return None
     else:
-        return matching_rows["orcid"].values[0]
+        return member["orcid"]
 
 
 
+@tracing.traced("roundup")
 def any_new_publications():
     """ Check whether any new publications came out in the past week """
     print("Starting paper search!")
     no_new_papers = True
+    stages = metrics.StageTimer()
+    stages.start("sweep")
 
-    # find the user ID of all UW authors
-    uw_authors = get_uw_authors()
-
-    # go through the file of people in the department
-    orcid_file = pd.read_csv("data/orcids.csv")
-    papers = []
-
-    for i, row in orcid_file.iterrows():
-        query = f'orcid:{row["orcid"]}'
+    # compile the UW authors for matching
+    matcher = get_matcher()
 
-        # get the papers from the last week
-        weekly_papers = get_ads_papers(query, past_week=True, remove_known_papers=True)
-
-        # skip anyone who has a bad query
-        if weekly_papers is None:
-            continue
+    # get the papers since the last sweep for everyone in the department at once
+    orcids = get_roster().orcids()
+    papers, swept = sweep_new_papers(orcids)
 
-        # add this to the list of papers to announce
-        if len(weekly_papers) > 0:
-            papers += weekly_papers
-            no_new_papers = False
-            save_papers(weekly_papers)
+    if len(papers) > 0:
+        no_new_papers = False
 
     if no_new_papers:
+        # the next sweep can start from here (anyone whose query failed will be caught up next time)
+        stages.start("save")
+        record_sweep(swept, all_succeeded=len(swept) == len(orcids))
+        stages.stop()
         print("No new papers!")
         return
 
     print("All done with the paper search!")
+    stages.start("build")
 
     start_blocks = [
         {
@@ -802,7 +1195,10 @@ def any_new_publications():
     thread_msgs = []
 
     for paper in papers:
-        user_id_strings = [f"<@{user_id}>" for user_id in get_author_ids(orcid_file, paper["authors"], uw_authors)]
+        # match the authors against the department once for everything below
+        match = matcher.match(paper["authors"])
+
+        user_id_strings = [f"<@{user_id}>" for user_id in match.slack_ids]
         # join user ids with commas and an "and" at the end
         if len(user_id_strings) == 0:
             author_id_string = "ERROR: Couldn't identify UW authors :cry:"
@@ -830,7 +1226,7 @@ def any_new_publications():
                          f"- including UW authors {author_id_string}")
             }
         }
-        if check_uw_authors(paper, uw_authors)[0]:
+        if match.first_author:
             first_author_blocks.append(new_block)
         else:
             co_author_blocks.append(new_block)
@@ -856,7 +1252,7 @@ def any_new_publications():
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": bold_uw_authors(paper["authors"])
+                    "text": match.bolded
                 }
             },
             {
@@ -889,63 +1285,57 @@ def any_new_publications():
     blocks = start_blocks + first_author_blocks + co_author_blocks
 
     channel = find_channel(PAPERS_CHANNEL)
-    message = app.client.chat_postMessage(text="Congrats on your new paper!",
-                                          blocks=blocks, channel=channel, unfurl_links=False)
-    
+    # name the roundup after the papers in it so running it again can only finish off the same one
+    bibcodes = hashlib.sha256(",".join(sorted(paper["bibcode"] for paper in papers)).encode()).hexdigest()
+    roundup = outbox.batch(f"roundup-{datetime.date.today()}-{bibcodes[:16]}")
+    summary = roundup.post(text="Congrats on your new paper!", blocks=blocks, channel=channel,
+                           unfurl_links=False)
+
     # reply in thread with the abstracts
     for abstract_blocks in thread_msgs:
-        app.client.chat_postMessage(text="Your paper details:", blocks=abstract_blocks,
-                                    channel=channel, thread_ts=message["ts"], unfurl_links=False)
+        roundup.post(reply_to=summary, text="Your paper details:", blocks=abstract_blocks,
+                     channel=channel, unfurl_links=False)
 
+    # save the roundup before recording the papers so that a crash can't lose it
+    stages.start("save")
+    outbox.save(roundup)
 
-def get_author_ids(orcids, authors, uw_authors):
-    author_ids = []
-    orcids["first_initial"] = orcids["first_name"].apply(lambda x: x[0].lower())
-    orcids["last_name_lower"] = orcids["last_name"].apply(lambda x: x.lower())
+    # add these to the saved papers in one go
+    save_papers(papers)
 
-    # go through each author in the list
-    for author in authors:
-        split_author = list(reversed(author.split(", ")))
+    # the next sweep can start from here (anyone whose query failed will be caught up next time)
+    record_sweep(swept, all_succeeded=len(swept) == len(orcids))
 
-        # get their first initial and last name
-        first_name, last_name = split_author[0].split(" ")[0].lower(), split_author[-1].lower()
-        first_initial = first_name[0]
+    stages.start("post")
+    outbox.deliver(roundup.name)
+    stages.stop()
+    metrics.ROUNDUP_PAPERS.inc(len(papers))
 
-        # NOTE: It matches either on the full first name or just first initial if the first name is just an initial
-        if last_name in uw_authors:
-            if len(first_name) == 2 and first_name[1] == '.':
-                first_name = first_name[0]
-            found_one = False
-            for option in uw_authors[last_name]:
-                if (len(option) > 1 and option == first_name[:len(option)]) or option == first_name:
-                    found_one = True
 
-            if not found_one:
-                continue
+""" ---------- DIRECTORY EVENTS ---------- """
 
-            # find row in the table that matches
-            matched_id = orcids[(orcids["first_initial"] == first_initial) & (orcids["last_name_lower"] == last_name)]
-            if len(matched_id) > 0:
-                author_ids.append(matched_id["slack_id"].values[0])
-    return author_ids
+@app.event("channel_created")
+@app.event("channel_rename")
+@metrics.timed_handler("channel_directory")
+def update_channel_directory(event):
+    channels.add(event["channel"])
 
 
-""" ---------- HELPER FUNCTIONS ---------- """
+@app.event("channel_archive")
+@app.event("channel_deleted")
+@metrics.timed_handler("channel_directory")
+def remove_from_channel_directory(event):
+    channels.remove(event["channel"])
 
-def save_all_user_ids():
-    """Save all user IDs to a file for future reference"""
-    users = app.client.users_list()["members"]
 
-    real_names, usernames, ids = [], [], []
-    for user in users:
-        if "real_name" in user and "name" in user and "id" in user:
-            real_names.append(user["real_name"])
-            usernames.append(user["name"])
-            ids.append(user["id"])
+@app.event("team_join")
+@app.event("user_change")
+@metrics.timed_handler("user_directory")
+def update_user_directory(event):
+    users.apply(event["user"])
 
-    df = pd.DataFrame({"username": usernames, "id": ids, "real_name": real_names})
-    df.to_csv("data/user_ids.csv", index=False)
 
+""" ---------- HELPER FUNCTIONS ---------- """
 
 def insert_british_consternation():
     choices = ["Oh fiddlesticks!", "Ah burnt crumpets!", "Oops, I've bangers and mashed it!",
@@ -972,16 +1362,8 @@ def find_channel(channel_name):
     ch_id : `str`
         ID of the Slack channel
     """
-    # grab the list of channels
-    channels = app.client.conversations_list(exclude_archived=True, limit=500)
-    ch_id = None
-
-    # go through each and find one with the same name
-    for channel in channels["channels"]:
-        if channel["name"] == channel_name:
-            # save the ID and break
-            ch_id = channel["id"]
-            break
+    # look it up in the channel directory
+    ch_id = channels.get(channel_name)
 
     # if you didn't find one then send out a warning (who changed the channel name!?)
     if ch_id is None:
@@ -1006,9 +1388,11 @@ def sanitise_tags(str):
     return output_string
 
 
+@tracing.traced("scheduled:every_morning", root=True)
 def every_morning():
     """ This function runs every morning around 9AM """
-    save_all_user_ids()
+    # finish off anything that was interrupted last time
+    outbox.resume()
     today = datetime.datetime.now()
     the_day = today.strftime("%A")
 
@@ -1016,10 +1400,19 @@ def every_morning():
         any_new_publications()
 
 
-# start Geoffrey
-if __name__ == "__main__":
+def start_scheduler():
+    """ Start the background jobs (morning checks, finishing off unsent messages, the user directory) """
     scheduler = BackgroundScheduler({'apscheduler.timezone': 'US/Pacific'})
     scheduler.add_job(every_morning, "cron", hour=9, minute=32)
     scheduler.start()
+    scheduler.add_job(tracing.traced("scheduled:outbox_resume", root=True)(outbox.resume))
+    scheduler.add_job(tracing.traced("scheduled:users_bootstrap", root=True)(users.bootstrap))
+    return scheduler
+
+
+# start Geoffrey (or use async_runtime.py to serve everything from an asyncio event loop instead)
+if __name__ == "__main__":
+    metrics.serve()
+    start_scheduler()
     SocketModeHandler(app, os.environ["GEOFFREY_APP_TOKEN"]).start()
 
@@ -0,0 +1,243 @@
+import asyncio
+import aiohttp
+import os
+import time
+from ads.exceptions import APIResponseError
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_sdk.http_retry.builtin_async_handlers import (AsyncRateLimitErrorRetryHandler,
+                                                         async_default_handlers)
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+
+import app as geoffrey
+import metrics
+import tracing
+from ads_query import iter_ads_papers_async
+from view_cache import get_view_cache
+
+# Run this instead of app.py to serve Slack from a single asyncio event loop, so that slow ADS searches
+# don't tie up a worker thread each. The messages and views are all built by the same functions as the
+# threaded app (paper exports share its export service), and the scheduled jobs still run in the background
+# scheduler.
+
+
+class InstrumentedAsyncWebClient(AsyncWebClient):
+    """Same as `metrics.InstrumentedWebClient` for the async client"""
+    async def api_call(self, api_method, **kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"slack.{api_method}"):
+                response = await super().api_call(api_method, **kwargs)
+        except SlackApiError as e:
+            metrics.record_slack_call(api_method, start, error=e)
+            raise
+        metrics.record_slack_call(api_method, start)
+        return response
+
+
+class CountingAsyncRateLimitHandler(AsyncRateLimitErrorRetryHandler):
+    """Same as `metrics.CountingRateLimitHandler` for the async client"""
+    async def prepare_for_next_attempt_async(self, *, state, request, response=None, error=None):
+        if response is not None:
+            metrics.SLACK_RATE_LIMITED.inc(method=metrics.api_method(request.url))
+        await super().prepare_for_next_attempt_async(state=state, request=request, response=response,
+                                                     error=error)
+
+
+async_app = AsyncApp(client=InstrumentedAsyncWebClient(token=os.environ.get("GEOFFREY_BOT_TOKEN"),
+                                                       base_url=os.environ.get(geoffrey.SLACK_URL_VAR)
+                                                       or AsyncWebClient.BASE_URL,
+                                                       retry_handlers=async_default_handlers()
+                                                       + [CountingAsyncRateLimitHandler(max_retry_count=3)]))
+
+
+""" ---------- APP HOME ---------- """
+@async_app.event("app_home_opened")
+@metrics.timed_handler("app_home_opened")
+async def update_home_tab(client, event, logger):
+    user = event["user"]
+    try:
+        # the statistics come from the database so check and build the view in a thread
+        digest, orcid = await asyncio.to_thread(geoffrey.home_view_hash, user)
+        if get_view_cache().is_current(user, digest):
+            metrics.HOME_VIEWS.inc(result="cached")
+            return
+
+        view = await asyncio.to_thread(geoffrey.home_view, user)
+        await client.views_publish(user_id=user, view=view)
+        get_view_cache().remember(user, digest, orcid=orcid)
+        metrics.HOME_VIEWS.inc(result="published")
+    except Exception as e:
+        logger.error(f"Error publishing home tab: {e}")
+
+
+@async_app.action("update-user-info-open")
+@metrics.timed_handler("block_actions:update-user-info-open")
+async def update_user_info_open(ack, body, client):
+    await ack()
+    await client.views_open(trigger_id=body["trigger_id"],
+                            view=geoffrey.user_info_modal(body["actions"][0]["value"]))
+
+
+@async_app.view("update-user-info")
+@metrics.timed_handler("view_submission:update-user-info")
+async def update_user_info(ack, body, client, logger):
+    await ack()
+
+    user, reply = await asyncio.to_thread(geoffrey.save_user_info, body)
+    await client.chat_postMessage(channel=user, text=reply)
+    get_view_cache().invalidate(users=[user])
+    await update_home_tab(client, {"user": user}, logger)
+
+
+@async_app.action("send-all-papers")
+@async_app.action("send-my-papers")
+@async_app.action("send-my-first-author-papers")
+@metrics.timed_handler("block_actions:send-papers")
+async def send_all_papers(ack, body, client):
+    await ack()
+
+    # get the user ID and which papers they want from the action
+    user = body["actions"][0]["value"]
+    spec = geoffrey.button_export(body["actions"][0]["action_id"], user)
+    await send_export(client, user, spec, channel=user)
+
+
+async def send_export(client, user, spec, channel, thread_ts=None):
+    """Send someone an export and let them know how it went
+
+    The export service is shared with the threaded app (so a file that is already built or on its way to
+    Slack is reused) and it streams the file from disk, so it runs in a thread with the app's client.
+
+    Parameters
+    ----------
+    client : `slack_sdk.web.async_client.AsyncWebClient`
+        Client to reply with
+    user : `str`
+        Slack ID of the user
+    spec : `exports.ExportFilter`
+        Which papers to export (None if they asked for someone that isn't in the roster)
+    channel : `str`
+        Channel to reply in
+    thread_ts : `str`, optional
+        Thread to reply in, by default none
+    """
+    if spec is None:
+        await client.chat_postMessage(channel=channel, text=geoffrey.NO_ORCID_REPLY, thread_ts=thread_ts)
+        return
+    try:
+        reply = await asyncio.to_thread(geoffrey.send_papers_file, geoffrey.app.client, user, spec)
+    except (SlackApiError, OSError):
+        reply = f"{geoffrey.insert_british_consternation()} {geoffrey.NO_FILE_REPLY}"
+    await client.chat_postMessage(channel=channel, text=reply, thread_ts=thread_ts)
+
+
+""" ---------- APP MENTIONS ---------- """
+
+@async_app.event("app_mention")
+@async_app.event("message")
+@metrics.timed_handler("mention")
+async def reply_to_mentions(say, body, client):
+    message = body["event"]
+    if not geoffrey.dispatcher.wants(message):
+        return
+
+    thread_ts = None if message["type"] == "message" else message["ts"]
+    route = geoffrey.dispatcher.dispatch(message["text"])
+
+    if route is None:
+        await say(text=f"{geoffrey.insert_british_consternation()} {geoffrey.CONFUSED_REPLY}",
+                  thread_ts=thread_ts, channel=message["channel"])
+    elif route.kind == "trigger":
+        await client.chat_postMessage(channel=message["channel"], text=geoffrey.pick_response(route.name),
+                                      thread_ts=thread_ts)
+    elif route.name == "roundup":
+        # the roundup is a big batch job that posts through the outbox so it gets a thread of its own
+        await asyncio.to_thread(geoffrey.any_new_publications)
+    elif route.name == "export":
+        await send_export(client, message["user"], geoffrey.export_request(message),
+                          channel=message["channel"], thread_ts=thread_ts)
+    elif route.name == "stats":
+        for reply in await asyncio.to_thread(geoffrey.stats_replies, message):
+            await client.chat_postMessage(**reply)
+    elif route.name == "recent_papers":
+        await reply_recent_papers(message, client)
+
+
+async def reply_recent_papers(message, client):
+    """Reply to a message with the most recent papers associated with a particular user
+
+    Parameters
+    ----------
+    message : `Slack Message`
+        A slack message object
+    client : `slack_sdk.web.async_client.AsyncWebClient`
+        Client to reply with
+    """
+    orcids, tags, n_papers = geoffrey.recent_papers_request(message)
+
+    # search ADS for everyone at once
+    all_papers = await asyncio.gather(*[fetch_recent_papers(orcid, n_papers) for orcid in orcids])
+
+    # the replies all go to the same conversation so post them in order
+    for reply in geoffrey.recent_papers_replies(message, orcids, tags, n_papers, all_papers):
+        await client.chat_postMessage(**reply)
+
+
+async def fetch_recent_papers(orcid, n_papers):
+    """Get the most recent papers for someone without blocking the event loop
+
+    Parameters
+    ----------
+    orcid : `str`
+        ORCID of the person
+    n_papers : `int`
+        Number of papers to get
+
+    Returns
+    -------
+    papers : `list`
+        List of papers, or None if there is no ORCID or the ADS query failed
+    """
+    if orcid is None:
+        return None
+    try:
+        return [paper async for paper in iter_ads_papers_async(f'orcid:{orcid}',
+                                                               fields=geoffrey.recent_paper_fields(n_papers),
+                                                               max_results=n_papers)]
+    except (APIResponseError, aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+
+
+""" ---------- DIRECTORY EVENTS ---------- """
+
+@async_app.event("channel_created")
+@async_app.event("channel_rename")
+@metrics.timed_handler("channel_directory")
+async def update_channel_directory(event):
+    geoffrey.channels.add(event["channel"])
+
+
+@async_app.event("channel_archive")
+@async_app.event("channel_deleted")
+@metrics.timed_handler("channel_directory")
+async def remove_from_channel_directory(event):
+    geoffrey.channels.remove(event["channel"])
+
+
+@async_app.event("team_join")
+@async_app.event("user_change")
+@metrics.timed_handler("user_directory")
+async def update_user_directory(event):
+    geoffrey.users.apply(event["user"])
+
+
+async def main():
+    await AsyncSocketModeHandler(async_app, os.environ["GEOFFREY_APP_TOKEN"]).start_async()
+
+
+if __name__ == "__main__":
+    metrics.serve()
+    geoffrey.start_scheduler()
+    asyncio.run(main())
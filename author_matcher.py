@@ -0,0 +1,279 @@
+import threading
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from functools import lru_cache
+from unidecode import unidecode
+
+import tracing
+from roster import get_roster
+
+# alternate first names that some people publish under, keyed by their (surname, first name) in the roster
+ALTERNATE_NAMES = {
+    ("wang", "david"): ["yuankun"],
+    ("li", "chester"): ["zhufo"],
+}
+
+# number of distinct author strings that each matcher remembers the match for
+MATCH_CACHE_SIZE = 2**16
+
+PaperAuthors = namedtuple("PaperAuthors", ["first_author", "total_uw", "bolded", "slack_ids", "orcids"])
+PaperAuthors.__doc__ = """The result of matching the authors of a paper against the roster
+
+Attributes
+----------
+first_author : `bool`
+    Whether the first author is from UW
+total_uw : `int`
+    Total number of UW authors
+bolded : `str`
+    Italic author string with the UW authors in bold (Slack mrkdwn)
+slack_ids : `list`
+    Slack IDs of the matched UW authors (in author order, without repeats)
+orcids : `list`
+    ORCIDs of the matched UW authors (in author order, without repeats)
+"""
+
+
+@lru_cache(maxsize=2**16)
+def normalise_author(author):
+    """Split an ADS author ("Last, First Middle") into normalised names for matching
+
+    Parameters
+    ----------
+    author : `str`
+        Author as given by ADS
+
+    Returns
+    -------
+    last : `str`
+        Surname without accents in lower case
+    first : `str`
+        Lower case first name (or just the initial if only an initial was given)
+    display : `str`
+        Name in "First Middle Last" order for showing in Slack
+
+    Or None if the author isn't in "Last, First" form
+    """
+    if author.count(",") != 1:
+        return None
+    last, first = (part.strip() for part in author.split(","))
+
+    display = f"{first} {last}"
+
+    # only use the first of the first names, and reduce it to just the initial if that's all it is
+    first = first.split(" ")[0].lower()
+    if len(first) == 2 and first[1] == ".":
+        first = first[0]
+    return unidecode(last).lower(), first, display
+
+
+class AuthorMatcher():
+    """Matches ADS author lists against the people in the department in a single pass
+
+    The roster is compiled into a dictionary from normalised surname to the first names (or prefixes of
+    first names) that count as a match for that surname. A full first name matches any first name that
+    starts with it, whilst an initial only matches an author that only gave an initial.
+
+    Parameters
+    ----------
+    members : `list`
+        Roster entries (dictionaries with at least "first_name" and "last_name")
+    alternate_names : `dict`, optional
+        Extra first names for some members, by default `ALTERNATE_NAMES`
+    """
+    def __init__(self, members, alternate_names=ALTERNATE_NAMES):
+        self.surnames = {}
+        for member in members:
+            last = unidecode(member["last_name"]).strip().lower()
+            first = member["first_name"].strip().lower()
+            for name in [first] + alternate_names.get((last, first), []):
+                self._add_option(last, name, member)
+                self._add_option(last, name[0], member)
+
+        # alternates for anyone that isn't in the roster still count as UW authors
+        for (last, first), names in alternate_names.items():
+            if not any(m is not None and m["first_name"].strip().lower() == first
+                       for _, m in self.surnames.get(last, [])):
+                for name in names:
+                    self._add_option(last, name, None)
+                    self._add_option(last, name[0], None)
+
+        # remember recent matches (bounded so that a long-running app doesn't hold every author ever seen)
+        self.match_author = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._match_author)
+
+    def _add_option(self, last, option, member):
+        options = self.surnames.setdefault(last, [])
+        if all(existing != option for existing, _ in options):
+            options.append((option, member))
+
+    def _match_author(self, author):
+        """Find the roster member that matches a single author
+
+        Parameters
+        ----------
+        author : `str`
+            Author as given by ADS ("Last, First Middle")
+
+        Returns
+        -------
+        matched : `bool`
+            Whether the author is from UW
+        member : `dict`
+            The matching roster entry (None if there isn't one, even for some UW authors)
+        """
+        names = normalise_author(author)
+        if names is not None:
+            last, first, _ = names
+            for option, member in self.surnames.get(last, []):
+                if (len(option) > 1 and first[:len(option)] == option) or first == option:
+                    return True, member
+        return False, None
+
+    def match(self, authors):
+        """Match every author of a paper in one pass
+
+        Parameters
+        ----------
+        authors : `list`
+            List of authors of the paper
+
+        Returns
+        -------
+        result : `PaperAuthors`
+            First author status, number of UW authors, bolded author string, Slack IDs and ORCIDs
+        """
+        first_author, total_uw = False, 0
+        bolded, slack_ids, orcids = [], [], []
+        for i, author in enumerate(authors):
+            names = normalise_author(author)
+            if names is None:
+                continue
+
+            matched, member = self.match_author(author)
+            if not matched:
+                bolded.append(names[2])
+                continue
+
+            # add asterisks for bold in mrkdwn
+            bolded.append(f"*{names[2]}*")
+            total_uw += 1
+            if i == 0:
+                first_author = True
+            if member is not None:
+                if member.get("slack_id") is not None and member["slack_id"] not in slack_ids:
+                    slack_ids.append(member["slack_id"])
+                if member.get("orcid") is not None and member["orcid"] not in orcids:
+                    orcids.append(member["orcid"])
+
+        # the whole thing is italic
+        bolded = "_Authors: " + ", ".join(bolded) + "_" if len(bolded) > 0 else "_Authors_"
+        return PaperAuthors(first_author, total_uw, bolded, slack_ids, orcids)
+
+    @tracing.traced("match.table")
+    def match_table(self, papers):
+        """Match the authors of a whole table of papers at once using vectorised operations
+
+        The author lists are exploded into a flat table of normalised names which is joined against the
+        compiled roster, so the cost of re-attributing an archive is a handful of pandas operations rather
+        than a Python loop over every author of every paper. Gives the same answers as `match`.
+
+        Parameters
+        ----------
+        papers : `pandas.DataFrame`
+            Table of papers with (at least) "bibcode" and "authors" (list) columns
+
+        Returns
+        -------
+        attribution : `pandas.DataFrame`
+            Table with "bibcode", "uw_first_author" and "total_uw" columns (one row per paper)
+        members : `pandas.DataFrame`
+            Table with "bibcode" and "orcid" columns linking each paper to the matched roster members
+        """
+        # one row per author, keeping track of their position in the author list
+        papers = papers.reset_index(drop=True)
+        authors = papers["authors"].explode()
+        paper_index = authors.index.to_numpy()
+        positions = authors.groupby(level=0).cumcount().to_numpy()
+
+        # names repeat a lot across an archive so only normalise each distinct author once
+        codes, unique_authors = pd.factorize(authors)
+        n_unique = len(unique_authors)
+
+        # nothing to match if there are no papers or none of them have any authors
+        if n_unique == 0:
+            attribution = pd.DataFrame({"bibcode": papers["bibcode"].to_numpy(),
+                                        "uw_first_author": np.zeros(len(papers), dtype=bool),
+                                        "total_uw": np.zeros(len(papers), dtype=int)})
+            return attribution, pd.DataFrame({"bibcode": pd.Series(dtype=object),
+                                              "orcid": pd.Series(dtype=object)})
+        unique_authors = pd.Series(unique_authors, dtype=object)
+        unique_authors = unique_authors[unique_authors.str.count(",") == 1]
+        names = unique_authors.str.split(",", n=1)
+        last = names.str[0].str.strip()
+        unique_last = pd.unique(last)
+        first = names.str[1].str.strip().str.split(" ").str[0].str.lower()
+        initial_only = (first.str.len() == 2) & (first.str[1] == ".")
+        unique_names = pd.DataFrame({
+            "code": unique_authors.index,
+            "last": last.map(dict(zip(unique_last, (unidecode(n).lower() for n in unique_last)))),
+            "first": first.where(~initial_only, first.str[0]),
+        })
+
+        # flatten the compiled roster into a table of options in matching order
+        options = pd.DataFrame([(last, order, option, len(option),
+                                 member.get("orcid") if member is not None else None)
+                                for last, opts in self.surnames.items()
+                                for order, (option, member) in enumerate(opts)],
+                               columns=["last", "order", "option", "option_length", "orcid"])
+
+        # join on surname and then check the first names, grouping by option length for the prefix check
+        candidates = unique_names.merge(options, on="last")
+        matches = candidates["first"] == candidates["option"]
+        for length in candidates["option_length"].unique():
+            if length > 1:
+                has_length = candidates["option_length"] == length
+                matches |= has_length & (candidates["first"].str[:length] == candidates["option"])
+
+        # the first matching option for each distinct author wins
+        matched = candidates[matches].sort_values(["code", "order"]).drop_duplicates("code")
+        is_uw = np.zeros(n_unique, dtype=bool)
+        is_uw[matched["code"].to_numpy()] = True
+        orcids = np.full(n_unique, None, dtype=object)
+        orcids[matched["code"].to_numpy()] = matched["orcid"].to_numpy()
+
+        # then broadcast back out to every author of every paper (missing authors have a code of -1)
+        row_is_uw = (codes >= 0) & is_uw[np.where(codes >= 0, codes, 0)]
+        uw_papers = paper_index[row_is_uw]
+        attribution = pd.DataFrame({
+            "bibcode": papers["bibcode"].to_numpy(),
+            "uw_first_author": np.isin(np.arange(len(papers)), paper_index[row_is_uw & (positions == 0)]),
+            "total_uw": np.bincount(uw_papers, minlength=len(papers)),
+        })
+
+        members = pd.DataFrame({"bibcode": papers["bibcode"].to_numpy()[uw_papers],
+                                "orcid": orcids[codes[row_is_uw]]})
+        members = members[members["orcid"].notna()].drop_duplicates().reset_index(drop=True)
+        return attribution, members
+
+
+_matchers = {}
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """Get a matcher for the current roster (only recompiled when the roster changes)
+
+    Returns
+    -------
+    matcher : `AuthorMatcher`
+        Matcher for the current roster
+    """
+    roster = get_roster()
+    members = roster.members
+    with _matcher_lock:
+        if roster.version not in _matchers:
+            _matchers.clear()
+            with tracing.span("match.compile", members=len(members)):
+                _matchers[roster.version] = AuthorMatcher(members)
+        return _matchers[roster.version]
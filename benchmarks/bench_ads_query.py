@@ -0,0 +1,280 @@
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import ads_cache
+import ads_query
+import author_matcher
+import exports
+import paper_archive
+import paper_store
+import roster
+import view_cache
+from author_matcher import AuthorMatcher, get_matcher
+from benchmarks.generators import make_papers, make_roster, write_roster
+
+# Times the hot paths of ads_query against made up rosters and paper archives. Run it from the top of the
+# repository with
+#
+#     python -m benchmarks.bench_ads_query
+#
+# and it compares the results against benchmarks/baselines.json, exiting with an error if anything has got
+# slower or hungrier by more than the tolerance. Use --save to record new baselines (on the machine that
+# Geoffrey is deployed on, since the times only mean anything against the same hardware).
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# (roster size, archive size) for each scenario
+SCENARIOS = [(50, 1000), (1000, 10000), (10000, 100000)]
+QUICK_SCENARIOS = [(50, 1000)]
+
+# columns read by the benchmarks of whole-archive reads
+TABLE_COLUMNS = ["bibcode", "authors", "date", "publisher"]
+
+# changes smaller than these are noise however big they are as a fraction
+MIN_CHANGE = {"seconds": 1e-3, "peak_mb": 0.5, "p50": 1e-3, "p99": 1e-3}
+
+
+def reset_state():
+    """Forget everything that Geoffrey keeps in memory between calls (roster, matchers, indexes, caches)"""
+    roster._roster = None
+    author_matcher._matchers.clear()
+    author_matcher.normalise_author.cache_clear()
+    paper_store._known_papers = None
+    paper_store._member_stats = None
+    paper_archive._archive = None
+    ads_cache._cache = None
+    exports._service = None
+    view_cache._view_cache = None
+
+
+def measure(func, setup=None, repeat=5):
+    """Time a function and find the peak memory it allocates
+
+    Parameters
+    ----------
+    func : `function`
+        Function to benchmark, given whatever ``setup`` returns
+    setup : `function`, optional
+        Function run (untimed) before every call, by default None
+    repeat : `int`, optional
+        Number of timed calls (after one warm up call), by default 5
+
+    Returns
+    -------
+    seconds : `float`
+        Fastest time of a single call
+    peak_mb : `float`
+        Peak memory allocated during a call in MB
+    """
+    times = []
+    for i in range(repeat + 1):
+        arg = setup() if setup is not None else None
+        gc.collect()
+        start = time.perf_counter()
+        func(arg)
+        if i > 0:
+            times.append(time.perf_counter() - start)
+
+    # tracing slows everything down so the memory gets a call of its own
+    arg = setup() if setup is not None else None
+    gc.collect()
+    tracemalloc.start()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1024**2
+
+
+def empty_store():
+    """Delete the paper store so the next save starts from nothing"""
+    for path in glob.glob(paper_store.STORE_PATH + "*"):
+        os.remove(path)
+    paper_store._known_papers = None
+    paper_store._member_stats = None
+
+
+def run_scenario(n_members, n_papers, repeat=5, seed=0):
+    """Run every benchmark for one roster and archive size (in the current directory)
+
+    Parameters
+    ----------
+    n_members : `int`
+        Number of people in the roster
+    n_papers : `int`
+        Number of papers in the archive
+    repeat : `int`, optional
+        Number of timed calls of each function, by default 5
+    seed : `int`, optional
+        Random seed for the generators, by default 0
+
+    Returns
+    -------
+    results : `dict`
+        Number of items, best time, throughput and peak memory of each function
+    """
+    reset_state()
+    members = make_roster(n_members, seed=seed)
+    write_roster(members, roster.ROSTER_PATH)
+    papers = make_papers(n_papers, members, seed=seed)
+
+    # half of the archive is already saved and the other half is new
+    saved, incoming = papers[:n_papers // 2], papers[n_papers // 2:]
+
+    def fresh_matcher():
+        author_matcher.normalise_author.cache_clear()
+        return AuthorMatcher(roster.get_roster().members)
+
+    def fill_store():
+        empty_store()
+        get_matcher()
+
+    benchmarks = {
+        "get_uw_authors": (n_members, lambda _: ads_query.get_uw_authors(),
+                           lambda: author_matcher._matchers.clear()),
+        "check_uw_authors": (n_papers, lambda m: [ads_query.check_uw_authors(p, m) for p in papers],
+                             fresh_matcher),
+        "get_author_ids": (n_papers, lambda m: [ads_query.get_author_ids(p["authors"], m) for p in papers],
+                           fresh_matcher),
+        "bold_uw_authors": (n_papers, lambda m: [ads_query.bold_uw_authors(p["authors"], m) for p in papers],
+                            fresh_matcher),
+        "save_papers": (len(saved), lambda _: ads_query.save_papers(saved), fill_store),
+        "get_table": (len(saved), lambda _: paper_store.get_table(TABLE_COLUMNS), None),
+        "filter_known_papers": (n_papers, lambda _: ads_query.filter_known_papers(papers), None),
+    }
+
+    # the same columns from the archive (the first setup builds it, after that it is only mapped)
+    if paper_archive.pa is not None:
+        benchmarks["read_archive"] = (len(saved), lambda _: paper_archive.Archive().read(TABLE_COLUMNS),
+                                      lambda: paper_archive.get_archive().table)
+
+    results = {}
+    for name, (n_items, func, setup) in benchmarks.items():
+        seconds, peak_mb = measure(func, setup=setup, repeat=repeat)
+        results[name] = {"items": n_items, "seconds": seconds, "per_second": n_items / seconds,
+                         "peak_mb": peak_mb}
+        print(f"  {name:<20} {n_items:>8} items {seconds * 1e3:>10.2f} ms {n_items / seconds:>12.0f} /s "
+              f"{peak_mb:>9.2f} MB peak")
+
+    # make sure the incoming half really is new, otherwise filter_known_papers isn't doing any work
+    assert len(ads_query.filter_known_papers(incoming)) == len(incoming)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Find the benchmarks that have got worse than their baselines
+
+    Parameters
+    ----------
+    results : `dict`
+        Results keyed by scenario and then benchmark
+    baseline : `dict`
+        Baseline results in the same format
+    tolerance : `float`
+        Fraction that a time, latency or peak memory may grow by before it counts as a regression
+
+    Returns
+    -------
+    regressions : `list`
+        Description of each regression
+    """
+    regressions = []
+    for scenario, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            base = baseline.get(scenario, {}).get(name)
+            if base is None:
+                continue
+            for key, unit in [("seconds", "s"), ("peak_mb", "MB"), ("p50", "s"), ("p99", "s")]:
+                if key not in result or key not in base:
+                    continue
+                if result[key] > base[key] * (1 + tolerance) + MIN_CHANGE[key]:
+                    regressions.append(f"{scenario} {name}: {result[key]:.4g}{unit} "
+                                       f"(baseline {base[key]:.4g}{unit}, {result[key] / base[key]:.2f}x)")
+    return regressions
+
+
+def load_baselines(path):
+    """Read the baselines file (an empty one if it doesn't exist yet)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(baselines, results, path):
+    """Add new results to the baselines (replacing any for the same scenarios) and write them out
+
+    Parameters
+    ----------
+    baselines : `dict`
+        Current baselines
+    results : `dict`
+        Results keyed by scenario and then benchmark
+    path : `str`
+        Path to write to
+    """
+    baselines["machine"] = {"platform": platform.platform(), "processor": platform.processor(),
+                            "python": platform.python_version(), "date": datetime.date.today().isoformat()}
+    baselines.setdefault("results", {}).update(results)
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2)
+    print(f"Saved the baselines to {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ads_query hot paths on synthetic data")
+    parser.add_argument("--quick", action="store_true", help="only run the smallest scenario")
+    parser.add_argument("--scenario", action="append", metavar="MEMBERS:PAPERS",
+                        help="roster and archive size to run (can be given more than once)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls of each function")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="path to the baselines file")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="fraction that a time or peak memory may grow by before it fails")
+    args = parser.parse_args(argv)
+
+    if args.scenario is not None:
+        scenarios = [tuple(map(int, s.split(":"))) for s in args.scenario]
+    else:
+        scenarios = QUICK_SCENARIOS if args.quick else SCENARIOS
+
+    results = {}
+    cwd = os.getcwd()
+    for n_members, n_papers in scenarios:
+        key = f"members={n_members},papers={n_papers}"
+        print(f"Benchmarking {key}")
+
+        # everything Geoffrey writes uses relative paths so give each scenario a clean directory
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, "data"))
+            os.chdir(workdir)
+            try:
+                results[key] = run_scenario(n_members, n_papers, repeat=args.repeat, seed=args.seed)
+            finally:
+                reset_state()
+                os.chdir(cwd)
+
+    baselines = load_baselines(args.baseline)
+    if args.save:
+        save_baselines(baselines, results, args.baseline)
+        return 0
+
+    regressions = compare(results, baselines.get("results", {}), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if len(regressions) == 0:
+        print("No regressions against the baselines")
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
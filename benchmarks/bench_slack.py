@@ -0,0 +1,239 @@
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+import ads.config
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import roster
+from benchmarks.bench_ads_query import BASELINE_PATH, compare, load_baselines, reset_state, save_baselines
+from benchmarks.bench_sweep import make_docs
+from benchmarks.generators import make_roster, write_roster
+from fake_ads import FakeADS
+from fake_slack import (FakeSlack, block_action, direct_message_event, home_opened_event, mention_event,
+                        send_to_app)
+from jobs import WORKING_ON_IT
+
+# Load tests the Slack side of Geoffrey against local stand-ins for Slack and ADS. Synthetic events are
+# handed to the app a few at a time and the latency of each is the time until the call that finishes it
+# (the reply, the view or the upload) reaches the fake Slack. Run it from the top of the repository with
+#
+#     python -m benchmarks.bench_slack --events 200 --concurrency 8 --latency 0.05 --throttle 0.02
+#
+# Like the other benchmarks it compares against benchmarks/baselines.json and --save records new baselines.
+
+SCENARIOS = ["roundup", "mention", "direct_message", "recent_papers", "home_tab", "modal", "send_all_papers"]
+
+
+def scenario_events(name, i, members):
+    """Make the i-th event of a scenario and a check for the call that finishes it
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the scenario
+    i : `int`
+        Index of the event
+    members : `list`
+        Roster entries (people with Slack IDs to ask about)
+
+    Returns
+    -------
+    body : `dict`
+        Body of the request
+    done : `function`
+        Check for the call to the fake Slack that finishes the event
+    """
+    # a new person and channel for every event so that nothing gets merged or queued behind anything else
+    user, channel = f"ULOAD{i:06d}", f"CLOAD{i:06d}"
+    dm = "D" + user[1:]
+
+    if name == "mention":
+        return (mention_event("how are you?", user, channel),
+                lambda call: call["method"] == "chat.postMessage" and call["args"].get("channel") == channel)
+    if name == "direct_message":
+        return (direct_message_event("thank you!", user),
+                lambda call: call["method"] == "chat.postMessage" and call["args"].get("channel") == dm)
+    if name == "recent_papers":
+        member = members[i % len(members)]
+        return (mention_event(f"latest 3 papers <@{member['slack_id']}>", user, channel),
+                lambda call: call["args"].get("channel") == channel
+                and (call["method"] == "chat.update"
+                     or (call["method"] == "chat.postMessage" and call["args"].get("text") != WORKING_ON_IT)))
+    if name == "home_tab":
+        return (home_opened_event(user),
+                lambda call: call["method"] == "views.publish" and call["args"].get("user_id") == user)
+    if name == "modal":
+        body = block_action("update-user-info-open", user, user)
+        return (body, lambda call: call["method"] == "views.open"
+                and call["args"].get("trigger_id") == body["trigger_id"])
+    if name == "send_all_papers":
+        # people asking for the file at the same time get it from a single upload shared to all of them
+        return (block_action("send-all-papers", user, user),
+                lambda call: call["method"] == "files.completeUploadExternal"
+                and (call["args"].get("channel_id") == dm
+                     or dm in call["args"].get("channels", "").split(",")))
+    raise ValueError(f"unknown scenario '{name}'")
+
+
+def run_load(geoffrey, fake, name, members, n_events, concurrency, timeout=60):
+    """Send a scenario's events to the app and time each one
+
+    Parameters
+    ----------
+    geoffrey : `module`
+        The app module
+    fake : `fake_slack.FakeSlack`
+        The fake Slack that the app is using
+    name : `str`
+        Name of the scenario
+    members : `list`
+        Roster entries
+    n_events : `int`
+        Number of events to send
+    concurrency : `int`
+        Number of events in flight at once
+    timeout : `float`, optional
+        Longest time to wait for an event to finish, by default 60
+
+    Returns
+    -------
+    result : `dict`
+        Number of events, total time, throughput, latency percentiles and timeouts
+    """
+    def one(i):
+        body, done = scenario_events(name, i, members)
+        start_index = len(fake.calls)
+        start = time.perf_counter()
+        send_to_app(geoffrey.app, body)
+        call = fake.wait_for(done, start=start_index, timeout=timeout)
+        return None if call is None else call["time"] - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(n_events)))
+    seconds = time.perf_counter() - start
+
+    finished = np.array([latency for latency in latencies if latency is not None])
+    p50, p99, worst = (np.percentile(finished, [50, 99, 100]) if len(finished) > 0 else (np.nan,) * 3)
+    return {"items": n_events, "seconds": seconds, "per_second": n_events / seconds, "p50": float(p50),
+            "p99": float(p99), "max": float(worst), "timeouts": n_events - len(finished)}
+
+
+def run_roundup(geoffrey, fake):
+    """Time the weekly roundup from the ADS sweep to the last message in the thread
+
+    Returns
+    -------
+    result : `dict`
+        Number of messages posted, total time and messages per second
+    """
+    n_before = len(fake.calls_to("chat.postMessage"))
+    start = time.perf_counter()
+    geoffrey.any_new_publications()
+    seconds = time.perf_counter() - start
+    n_posted = len(fake.calls_to("chat.postMessage")) - n_before
+    return {"items": n_posted, "seconds": seconds, "per_second": n_posted / seconds}
+
+
+def drain(geoffrey):
+    """Wait for everything the app is still doing in the background and then stop it
+
+    Events that timed out can still have listeners, jobs (e.g. uploads) and messages on their way, which
+    have to finish whilst the fakes are still there to answer them rather than failing once they are gone.
+    """
+    # listeners queue up jobs, which in turn post messages through the outbox
+    geoffrey.app.listener_runner.listener_executor.shutdown(wait=True)
+    geoffrey.jobs.shutdown(wait=True)
+    geoffrey.outbox.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test Geoffrey's Slack handlers against a fake Slack")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenario to run (can be given more than once), by default all of them")
+    parser.add_argument("--events", type=int, default=100, help="number of events per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of events in flight at once")
+    parser.add_argument("--members", type=int, default=200, help="number of people in the roster")
+    parser.add_argument("--papers", type=int, default=5000, help="number of papers in the fake ADS")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the fake Slack takes per call")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random Slack latency of up to this")
+    parser.add_argument("--throttle", type=float, default=0, help="fraction of Slack calls that get a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with each 429")
+    parser.add_argument("--ads-latency", type=float, default=0.05, help="seconds the fake ADS takes")
+    parser.add_argument("--timeout", type=float, default=30, help="longest time to wait for an event")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the data and the fakes")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="path to the baselines file")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="fraction that a time may grow by before it fails")
+    args = parser.parse_args(argv)
+    scenarios = SCENARIOS if args.scenario is None else args.scenario
+
+    # the app checks these exist when it starts (nothing is sent to the real Slack)
+    os.environ.setdefault("GEOFFREY_BOT_TOKEN", "xoxb-fake")
+    os.environ.setdefault("SLACK_SIGNING_SECRET", "fake")
+
+    cwd = os.getcwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "data"))
+        os.chdir(workdir)
+        reset_state()
+        try:
+            members = make_roster(args.members, seed=args.seed)
+            write_roster(members, roster.ROSTER_PATH)
+            docs = make_docs(members, args.papers, seed=args.seed)
+            members = [member for member in members if member["slack_id"] is not None]
+
+            with FakeADS(docs=docs, latency=args.ads_latency, seed=args.seed) as fake_ads, \
+                    FakeSlack(users=[member["slack_id"] for member in members], latency=args.latency,
+                              jitter=args.jitter, throttle=args.throttle, retry_after=args.retry_after,
+                              seed=args.seed) as fake:
+                ads.config.SEARCH_URL = fake_ads.url
+                os.environ["GEOFFREY_SLACK_URL"] = fake.url
+
+                # the app connects to Slack as soon as it is imported so it has to wait for the fakes
+                geoffrey = importlib.import_module("app")
+
+                settings = f"latency={args.latency},throttle={args.throttle}"
+                for name in scenarios:
+                    print(f"Benchmarking {name}")
+                    if name == "roundup":
+                        result = run_roundup(geoffrey, fake)
+                        print(f"  posted {result['items']} messages in {result['seconds']:.2f} s")
+                        key = f"slack:roundup:papers={args.papers},{settings}"
+                    else:
+                        result = run_load(geoffrey, fake, name, members, args.events, args.concurrency,
+                                          timeout=args.timeout)
+                        print(f"  {result['items']} events in {result['seconds']:.2f} s "
+                              f"({result['per_second']:.1f} /s), p50 {result['p50'] * 1e3:.1f} ms, "
+                              f"p99 {result['p99'] * 1e3:.1f} ms, {result['timeouts']} timed out")
+                        key = f"slack:{name}:events={args.events},concurrency={args.concurrency},{settings}"
+                    results[key] = {name: result}
+                drain(geoffrey)
+                print(f"Fake Slack answered {fake.stats}")
+        finally:
+            # the app is stopped so the next run has to import it again
+            sys.modules.pop("app", None)
+            reset_state()
+            os.chdir(cwd)
+
+    baselines = load_baselines(args.baseline)
+    if args.save:
+        save_baselines(baselines, results, args.baseline)
+        return 0
+
+    regressions = compare(results, baselines.get("results", {}), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if len(regressions) == 0:
+        print("No regressions against the baselines")
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import ads.config
+
+import ads_fetch
+import ads_query
+import roster
+from author_matcher import get_matcher
+from benchmarks.bench_ads_query import BASELINE_PATH, compare, load_baselines, reset_state, save_baselines
+from benchmarks.generators import make_papers, make_roster, write_roster
+from fake_ads import FakeADS, paper_to_doc
+
+# Times a whole ADS sweep end to end against a local stand-in for ADS with made up papers, so that the
+# paging, rate limiting and retries are all included. Run it from the top of the repository with
+#
+#     python -m benchmarks.bench_sweep --latency 0.2 --throttle 0.05
+#
+# Like bench_ads_query it compares against benchmarks/baselines.json (each latency and throttle setting is
+# its own scenario) and --save records new baselines.
+
+# (roster size, archive size) for each scenario
+SCENARIOS = [(50, 1000), (1000, 10000)]
+QUICK_SCENARIOS = [(50, 1000)]
+
+# fraction of the archive that was entered into ADS recently enough for the weekly sweep to find it
+NEW_FRACTION = 0.05
+
+
+def make_docs(members, n_papers, seed=0):
+    """Make up the ADS documents for an archive, with the roster members' ORCIDs claimed on their papers
+
+    Parameters
+    ----------
+    members : `list`
+        Roster entries (already written to the roster file)
+    n_papers : `int`
+        Number of papers
+    seed : `int`, optional
+        Random seed, by default 0
+
+    Returns
+    -------
+    docs : `list`
+        Raw ADS documents
+    """
+    matcher = get_matcher()
+    today = datetime.date.today()
+    docs = []
+    for i, paper in enumerate(make_papers(n_papers, members, seed=seed)):
+        # spread the new papers over the last couple of weeks and leave the rest in the past
+        if i % round(1 / NEW_FRACTION) == 0:
+            paper["entdate"] = (today - datetime.timedelta(days=i % 14)).isoformat()
+        docs.append(paper_to_doc(paper, matcher.match(paper["authors"]).orcids))
+    return docs
+
+
+def run_scenario(n_members, n_papers, seed=0, **fake_kwargs):
+    """Run a sweep and then a full backfill against a fake ADS (in the current directory)
+
+    Parameters
+    ----------
+    n_members : `int`
+        Number of people in the roster
+    n_papers : `int`
+        Number of papers in the archive
+    seed : `int`, optional
+        Random seed for the generators, by default 0
+    **fake_kwargs
+        Latency, throttling etc. for `fake_ads.FakeADS`
+
+    Returns
+    -------
+    results : `dict`
+        Number of papers found, time, throughput and requests made for each step
+    """
+    reset_state()
+    ads_fetch._engine = None
+    members = make_roster(n_members, seed=seed)
+    write_roster(members, roster.ROSTER_PATH)
+    docs = make_docs(members, n_papers, seed=seed)
+    orcids = roster.get_roster().orcids()
+
+    def sweep():
+        # what the weekly roundup does before it posts anything
+        papers, swept = ads_query.sweep_new_papers(orcids)
+        ads_query.save_papers(papers)
+        ads_query.record_sweep(swept, len(swept) == len(orcids))
+        return papers
+
+    def backfill():
+        # what get_all_recent_papers.py does
+        papers = ads_query.get_ads_papers_batched(orcids, remove_known_papers=True)
+        ads_query.save_papers(papers)
+        return papers
+
+    results = {}
+    search_url = ads.config.SEARCH_URL
+    with FakeADS(docs=docs, seed=seed, **fake_kwargs) as fake:
+        ads.config.SEARCH_URL = fake.url
+        try:
+            for name, func in [("sweep", sweep), ("backfill", backfill)]:
+                before = dict(fake.stats)
+                start = time.perf_counter()
+                n_found = len(func())
+                seconds = time.perf_counter() - start
+
+                requests = fake.stats["requests"] - before["requests"]
+                throttled = fake.stats["throttled"] - before["throttled"]
+                results[name] = {"items": n_found, "seconds": seconds, "per_second": n_found / seconds,
+                                 "requests": requests, "throttled": throttled}
+                print(f"  {name:<10} {n_found:>8} papers {seconds:>9.2f} s {requests:>6} requests "
+                      f"({throttled} throttled)")
+        finally:
+            ads.config.SEARCH_URL = search_url
+            ads_fetch._engine = None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time an ADS sweep end to end against a fake ADS")
+    parser.add_argument("--quick", action="store_true", help="only run the smallest scenario")
+    parser.add_argument("--scenario", action="append", metavar="MEMBERS:PAPERS",
+                        help="roster and archive size to run (can be given more than once)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake ADS takes per request")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random latency of up to this much")
+    parser.add_argument("--throttle", type=float, default=0, help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After sent with each 429")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the data and the fake ADS")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="path to the baselines file")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="fraction that a time may grow by before it fails")
+    args = parser.parse_args(argv)
+
+    if args.scenario is not None:
+        scenarios = [tuple(map(int, s.split(":"))) for s in args.scenario]
+    else:
+        scenarios = QUICK_SCENARIOS if args.quick else SCENARIOS
+
+    results = {}
+    cwd = os.getcwd()
+    for n_members, n_papers in scenarios:
+        key = (f"sweep:members={n_members},papers={n_papers},latency={args.latency},jitter={args.jitter},"
+               f"throttle={args.throttle}")
+        print(f"Benchmarking {key}")
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, "data"))
+            os.chdir(workdir)
+            try:
+                results[key] = run_scenario(n_members, n_papers, seed=args.seed, latency=args.latency,
+                                            jitter=args.jitter, throttle=args.throttle,
+                                            retry_after=args.retry_after)
+            finally:
+                reset_state()
+                os.chdir(cwd)
+
+    baselines = load_baselines(args.baseline)
+    if args.save:
+        save_baselines(baselines, results, args.baseline)
+        return 0
+
+    regressions = compare(results, baselines.get("results", {}), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if len(regressions) == 0:
+        print("No regressions against the baselines")
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
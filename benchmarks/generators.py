@@ -0,0 +1,183 @@
+import csv
+import datetime
+import random
+from unidecode import unidecode
+
+from roster import COLUMNS
+
+# pieces to build names from, with enough accents, hyphens and particles to exercise the normalisation
+FIRST_NAMES = ["Eric", "Scott", "Jessica", "Zoë", "José", "Łukasz", "Søren", "Anaïs", "Björn", "Chloé",
+               "Dmitri", "Émilie", "François", "Giulia", "Hana", "Ignacio", "Jürgen", "Kateřina", "Leïla",
+               "Mónica", "Nuño", "Oğuz", "Priya", "Qiang", "Rafaël", "Siân", "Tomás", "Ulrike", "Václav",
+               "Wen", "Xiaoyu", "Yaël", "Zuzanna", "Ana María", "Jean-Luc", "Mary Kate"]
+SURNAME_STARTS = ["Ag", "And", "Bal", "Brø", "Car", "Dal", "Eck", "Fer", "Gar", "Hå", "Ib", "Jan", "Kow",
+                  "Lun", "Mül", "Nú", "Ød", "Pét", "Quin", "Ros", "Sch", "Tor", "Üb", "Val", "Wój", "Xu",
+                  "Yam", "Żel"]
+SURNAME_ENDS = ["ol", "erson", "ler", "ñez", "egård", "ski", "ović", "ard", "ez", "ström", "ini", "sson",
+                "ley", "ço", "ian", "ura", "berg", "ek", "y", "ot"]
+SURNAME_PARTICLES = ["van der ", "de ", "O'", "Mc", "di ", ""]
+ROLES = ["Professor", "Postdoc", "Grad Student", "Undergrad", "Research Scientist"]
+
+WORDS = ["galaxy", "stellar", "exoplanet", "transit", "dark", "matter", "survey", "spectroscopy", "binary",
+         "accretion", "variability", "cosmic", "dust", "formation", "evolution", "photometry", "$z\\sim2$",
+         "{\\it TESS}", "Gaia", "JWST", "halo", "merger", "disk", "atmosphere", "signal", "lensing", "quasar"]
+JOURNALS = ["ApJ..", "MNRAS", "AJ...", "A&A..", "PASP.", "arXiv"]
+
+
+def make_orcid(rng):
+    """Make up a random ORCID with a valid checksum
+
+    Parameters
+    ----------
+    rng : `random.Random`
+        Random number generator
+
+    Returns
+    -------
+    orcid : `str`
+        ORCID in "0000-0000-0000-000X" form
+    """
+    # real ones all start 0000-000x at the moment
+    digits = [0, 0, 0, 0, 0, 0, 0, rng.randrange(4)] + [rng.randrange(10) for _ in range(7)]
+    total = 0
+    for digit in digits:
+        total = (total + digit) * 2
+    check = (12 - total % 11) % 11
+    digits = "".join(map(str, digits)) + ("X" if check == 10 else str(check))
+    return "-".join(digits[i:i + 4] for i in range(0, 16, 4))
+
+
+def make_surname(rng):
+    """Make up a surname (sometimes hyphenated or with a particle)"""
+    surname = rng.choice(SURNAME_PARTICLES) if rng.random() < 0.1 else ""
+    surname += rng.choice(SURNAME_STARTS) + rng.choice(SURNAME_ENDS)
+    if rng.random() < 0.1:
+        surname += "-" + rng.choice(SURNAME_STARTS) + rng.choice(SURNAME_ENDS)
+    return surname
+
+
+def make_roster(n, seed=0):
+    """Make up a roster of people in the department
+
+    Parameters
+    ----------
+    n : `int`
+        Number of people
+    seed : `int`, optional
+        Random seed, by default 0
+
+    Returns
+    -------
+    members : `list`
+        Roster entries (dictionaries with the columns of the roster CSV file)
+    """
+    rng = random.Random(seed)
+    members = []
+    for _ in range(n):
+        first_name = rng.choice(FIRST_NAMES)
+
+        # a few people only ever give an initial
+        if rng.random() < 0.03:
+            first_name = first_name[0]
+        members.append({"orcid": make_orcid(rng), "first_name": first_name, "last_name": make_surname(rng),
+                        "role": rng.choice(ROLES),
+                        "slack_id": "U" + "".join(rng.choices("0123456789ABCDEFGHJKLMNPQRSTUVWXYZ", k=10))
+                        if rng.random() < 0.9 else None})
+    return members
+
+
+def write_roster(members, path):
+    """Write a roster to a CSV file in the same format as the real one
+
+    Parameters
+    ----------
+    members : `list`
+        Roster entries
+    path : `str`
+        Path to write to
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(members)
+
+
+def n_authors(rng):
+    """Draw a number of authors for a paper
+
+    Most papers have a handful of authors but there's a long tail of big collaborations that reach into the
+    thousands.
+    """
+    if rng.random() < 0.005:
+        return rng.randint(500, 3000)
+    return min(int(rng.lognormvariate(1.8, 0.8)) + 1, 400)
+
+
+def author_name(rng, first_name, last_name):
+    """Write someone's name the way ADS might (full name, initials, middle initial or without accents)"""
+    style = rng.random()
+    if style < 0.5:
+        first = first_name
+    elif style < 0.8:
+        first = first_name[0] + "."
+    else:
+        first = f"{first_name} {rng.choice('ABCDEFGHJKLMNPRSTW')}."
+
+    # some journals drop the accents
+    if rng.random() < 0.2:
+        first, last_name = unidecode(first), unidecode(last_name)
+    return f"{last_name}, {first}"
+
+
+def make_papers(n, members, seed=0, uw_fraction=0.3):
+    """Make up an archive of papers in the format returned by `ads_query.paper_to_dict`
+
+    Parameters
+    ----------
+    n : `int`
+        Number of papers
+    members : `list`
+        Roster entries to take the UW authors from
+    seed : `int`, optional
+        Random seed, by default 0
+    uw_fraction : `float`, optional
+        Fraction of papers with at least one author from the roster, by default 0.3
+
+    Returns
+    -------
+    papers : `list`
+        List of dictionaries of paper information
+    """
+    rng = random.Random(seed)
+    start = datetime.date(2000, 1, 1)
+
+    # outside authors come from a pool so that names repeat across papers like they do in real archives
+    pool = [f"{make_surname(rng)}, {rng.choice(FIRST_NAMES)}" for _ in range(max(1000, n // 2))]
+
+    papers = []
+    for i in range(n):
+        authors = rng.choices(pool, k=n_authors(rng))
+        if rng.random() < uw_fraction and len(members) > 0:
+            for _ in range(min(rng.randint(1, 3), len(authors))):
+                member = rng.choice(members)
+                authors[rng.randrange(len(authors))] = author_name(rng, member["first_name"],
+                                                                   member["last_name"])
+
+        date = start + datetime.timedelta(days=rng.randrange(9000))
+        journal = rng.choice(JOURNALS)
+        bibcode = f"{date.year}{journal}{i // 10000:4d}{i % 10000:05d}{authors[0][0]}".replace(" ", ".")
+        papers.append({
+            "bibcode": bibcode,
+            "doi": f"10.{rng.randint(1000, 9999)}/{bibcode.lower()}" if rng.random() < 0.8 else None,
+            "link": f"https://ui.adsabs.harvard.edu/abs/{bibcode}/abstract",
+            "title": " ".join(rng.choices(WORDS, k=rng.randint(4, 14))) + f" {i}",
+            "abstract": " ".join(rng.choices(WORDS, k=rng.randint(30, 120))),
+            "authors": authors,
+            "first_author": authors[0],
+            "date": date.replace(day=1),
+            "citations": int(rng.expovariate(1 / 20)),
+            "reads": int(rng.expovariate(1 / 100)),
+            "keywords": rng.sample(WORDS, k=rng.randint(0, 6)) or None,
+            "publisher": journal.strip("."),
+        })
+    return papers
@@ -0,0 +1,97 @@
+import re
+from collections import namedtuple
+
+# message subtypes that are still people talking to Geoffrey (edits, deletions, joins etc. are ignored)
+HANDLED_SUBTYPES = {None, "file_share", "thread_broadcast"}
+
+Route = namedtuple("Route", ["kind", "name"])
+Route.__doc__ = """Where a message should be sent
+
+Attributes
+----------
+kind : `str`
+    Either "trigger" (reply with a canned response) or "action"
+name : `int` or `str`
+    Index of the trigger group, or the name of the action
+"""
+
+
+class MentionDispatcher():
+    """Works out how to respond to a message with a single scan of its text
+
+    Every trigger phrase and action pattern is compiled into one regular expression when Geoffrey starts.
+    Each alternative sits inside a lookahead so that one pass over the text finds every match (even ones that
+    overlap) and the winning route is then picked by priority: trigger groups in order first and then the
+    actions in order. Where two alternatives match at the same position only the higher priority one is
+    seen, so an action with several patterns shouldn't share a starting point with a later action.
+
+    Parameters
+    ----------
+    bot_id : `str`
+        Slack ID of the bot (its own messages are ignored)
+    triggers : `list`
+        List of groups of trigger phrases (matched anywhere in the text, ignoring case)
+    actions : `dict`
+        Actions in priority order, each a list of regular expressions that must all match (ignoring case
+        unless they say otherwise with e.g. ``(?-i:...)``)
+    """
+    def __init__(self, bot_id, triggers, actions):
+        self.bot_id = bot_id
+        self.n_triggers = len(triggers)
+        self.actions = {name: [f"a{i}_{j}" for j in range(len(patterns))]
+                        for i, (name, patterns) in enumerate(actions.items())}
+
+        alternatives = [f"(?P<t{i}>{'|'.join(re.escape(phrase) for phrase in group)})"
+                        for i, group in enumerate(triggers)]
+        alternatives += [f"(?P<{group}>{pattern})"
+                         for (name, patterns), groups in zip(actions.items(), self.actions.values())
+                         for pattern, group in zip(patterns, groups)]
+        self.pattern = re.compile("(?=" + "|".join(alternatives) + ")", flags=re.IGNORECASE | re.DOTALL)
+
+    def wants(self, event):
+        """Cheap check of whether an event is worth looking at
+
+        Drops messages from bots (including Geoffrey), edits and other message subtypes, and message events
+        from channels (mentions in channels arrive separately as app_mention events).
+
+        Parameters
+        ----------
+        event : `dict`
+            Slack event
+
+        Returns
+        -------
+        wanted : `bool`
+            Whether to dispatch the event
+        """
+        if "bot_id" in event or event.get("user") in (None, self.bot_id):
+            return False
+        if event.get("subtype") not in HANDLED_SUBTYPES or not event.get("text"):
+            return False
+        return event.get("type") == "app_mention" or event.get("channel_type") == "im"
+
+    def dispatch(self, text):
+        """Find the route for a message
+
+        Parameters
+        ----------
+        text : `str`
+            Text of the message
+
+        Returns
+        -------
+        route : `Route`
+            The winning route, or None if nothing matched
+        """
+        matched = set()
+        for match in self.pattern.finditer(text):
+            matched.add(match.lastgroup)
+
+        triggers = [int(group[1:]) for group in matched if group[0] == "t"]
+        if len(triggers) > 0:
+            return Route("trigger", min(triggers))
+
+        for name, groups in self.actions.items():
+            if all(group in matched for group in groups):
+                return Route("action", name)
+        return None
@@ -0,0 +1,328 @@
+import csv
+import gzip
+import hashlib
+import os
+import re
+import threading
+from collections import namedtuple
+import requests
+
+import metrics
+import paper_store
+import tracing
+from author_matcher import get_matcher
+
+# Paper exports for people to download from Slack. Each export is written once as a gzipped CSV file for
+# each version of the paper store and reused until the store changes, so clicking the button again (or lots
+# of people clicking it at once) doesn't read through the whole store again. The files are streamed to
+# Slack straight from disk and anyone asking for the same file whilst it is being uploaded gets a share of
+# that upload rather than one of their own.
+
+EXPORT_DIR = "data/exports"
+
+# how long to wait for Slack's upload URL to connect and then to take the whole file (seconds)
+UPLOAD_TIMEOUT = (10, 300)
+
+ExportFilter = namedtuple("ExportFilter", ["orcid", "start", "end", "first_author"],
+                          defaults=[None, None, None, False])
+ExportFilter.__doc__ = """Which papers go in an export
+
+Attributes
+----------
+orcid : `str`
+    Only papers by this roster member (None for everyone's)
+start : `datetime.date`
+    Only papers published on or after this date (None for no limit)
+end : `datetime.date`
+    Only papers published on or before this date (None for no limit)
+first_author : `bool`
+    Only first-author papers (by the roster member if there is one, otherwise by anyone from UW)
+"""
+
+ALL_PAPERS = ExportFilter()
+
+
+def export_filename(spec):
+    """Name of the file that people get for an export (e.g. "papers-0000-0002-1825-0097-first-author.csv.gz")
+
+    Parameters
+    ----------
+    spec : `ExportFilter`
+        Which papers are in the export
+
+    Returns
+    -------
+    filename : `str`
+        Name of the file
+    """
+    parts = ["papers"]
+    if spec.orcid is not None:
+        parts.append(spec.orcid)
+    if spec.first_author:
+        parts.append("first-author")
+    if spec.start is not None:
+        parts.append(f"from-{spec.start.isoformat()}")
+    if spec.end is not None:
+        parts.append(f"to-{spec.end.isoformat()}")
+    return "-".join(parts) + ".csv.gz"
+
+
+def export_rows(spec, con):
+    """Go through the papers in an export, most recent first
+
+    Parameters
+    ----------
+    spec : `ExportFilter`
+        Which papers are in the export
+    con : `sqlite3.Connection`
+        Connection to the paper store
+
+    Yields
+    ------
+    row : `dict`
+        The `paper_store.EXPORT_COLUMNS` of a paper
+    """
+    # a roster member's first-author papers are a subset of the UW first-author ones
+    rows = paper_store.export_rows(con, orcid=spec.orcid, start=spec.start, end=spec.end,
+                                   uw_first_author=spec.first_author)
+    if spec.orcid is None or not spec.first_author:
+        yield from rows
+        return
+
+    matcher = get_matcher()
+    for row in rows:
+        _, member = matcher.match_author(row["first_author"])
+        if member is not None and member.get("orcid") == spec.orcid:
+            yield row
+
+
+class _SharedUpload():
+    """An upload that anyone asking for the same file can join until it is shared"""
+    def __init__(self):
+        self.channels = []
+        self.sent = False
+        self.done = threading.Event()
+
+
+class ExportService():
+    """Builds, caches and sends paper exports
+
+    Parameters
+    ----------
+    directory : `str`, optional
+        Where the export files are kept, by default `EXPORT_DIR`
+    timeout : `tuple`, optional
+        Connect and read timeouts for the upload, by default `UPLOAD_TIMEOUT`
+    """
+    def __init__(self, directory=None, timeout=UPLOAD_TIMEOUT):
+        self.directory = EXPORT_DIR if directory is None else directory
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._uploads = {}
+
+    def _path(self, version, spec):
+        key = hashlib.sha1(repr(tuple(spec)).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"papers-v{version}-{key}.csv.gz")
+
+    def artifact(self, spec=ALL_PAPERS):
+        """Get the file for an export, building it if the store has changed since it was last built
+
+        Parameters
+        ----------
+        spec : `ExportFilter`, optional
+            Which papers are in the export, by default all of them
+
+        Returns
+        -------
+        path : `str`
+            Path of the gzipped CSV file
+        """
+        path = self._path(paper_store.get_version(), spec)
+        if os.path.exists(path):
+            metrics.EXPORT_ARTIFACTS.inc(result="cached")
+            return path
+
+        # only one thread builds each export, anyone else waits for it and then uses the file (the lock is
+        # dropped once nobody is waiting so that one-off filters don't pile up)
+        with self._lock:
+            build_lock, n_waiting = self._build_locks.get(path, (threading.Lock(), 0))
+            self._build_locks[path] = (build_lock, n_waiting + 1)
+        try:
+            with build_lock:
+                if os.path.exists(path):
+                    metrics.EXPORT_ARTIFACTS.inc(result="cached")
+                    return path
+                metrics.EXPORT_ARTIFACTS.inc(result="built")
+                return self._build(spec)
+        finally:
+            with self._lock:
+                build_lock, n_waiting = self._build_locks[path]
+                if n_waiting == 1:
+                    del self._build_locks[path]
+                else:
+                    self._build_locks[path] = (build_lock, n_waiting - 1)
+
+    def _open(self, spec):
+        """Open the file for an export, building it again if a newer build cleared it away in the meantime
+
+        Returns
+        -------
+        path : `str`
+            Path of the file
+        f : `file`
+            The file, open for reading in binary mode
+        """
+        for attempt in range(2):
+            path = self.artifact(spec)
+            try:
+                return path, open(path, "rb")
+            except FileNotFoundError:
+                if attempt == 1:
+                    raise
+
+    @tracing.traced("export.build")
+    def _build(self, spec):
+        """Write out an export for the current version of the store and clear away any older versions"""
+        os.makedirs(self.directory, exist_ok=True)
+        con = paper_store.connect()
+        try:
+            with con:
+                # read the version in the same transaction as the papers so that the name can't be wrong
+                con.execute("BEGIN")
+                version = paper_store.get_version(con=con)
+                path = self._path(version, spec)
+                tmp_path = path + ".tmp"
+                n_rows = 0
+                with gzip.open(tmp_path, "wt", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(paper_store.EXPORT_COLUMNS)
+                    for row in export_rows(spec, con):
+                        n_rows += 1
+                        writer.writerow([row[col] for col in paper_store.EXPORT_COLUMNS])
+        finally:
+            con.close()
+
+        metrics.FILE_BYTES_WRITTEN.inc(os.path.getsize(tmp_path), file="export")
+        tracing.annotate(rows=n_rows, version=version)
+        os.replace(tmp_path, path)
+
+        # files from older versions will never be used again (any upload still reading one keeps it open),
+        # but a build that overlapped with this one may already have written a newer version
+        for name in os.listdir(self.directory):
+            match = re.match(r"papers-v(\d+)-.*\.csv\.gz$", name)
+            if match is not None and int(match.group(1)) < version:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        return path
+
+    def send(self, client, user, spec=ALL_PAPERS):
+        """Send an export to someone in a direct message
+
+        Parameters
+        ----------
+        client : `slack_sdk.WebClient`
+            Slack client
+        user : `str`
+            Slack ID of the user
+        spec : `ExportFilter`, optional
+            Which papers are in the export, by default all of them
+
+        Returns
+        -------
+        sent : `bool`
+            Whether the file made it to Slack
+        """
+        user_dm = client.conversations_open(users=user)["channel"]["id"]
+
+        # open the file straight away so that a newer build can't clear it away before it is uploaded
+        path, f = self._open(spec)
+        with f:
+            # join an upload of the same file if there is one that hasn't been shared yet
+            with self._lock:
+                upload = self._uploads.get(path)
+                joined = upload is not None
+                if not joined:
+                    upload = self._uploads[path] = _SharedUpload()
+                upload.channels.append(user_dm)
+            if not joined:
+                return self._send_upload(client, upload, path, f, spec)
+
+        metrics.EXPORT_UPLOADS.inc(result="joined")
+        upload.done.wait()
+        return upload.sent
+
+    def _send_upload(self, client, upload, path, f, spec):
+        """Upload an export and share it with everyone that joined the upload in the meantime"""
+        metrics.EXPORT_UPLOADS.inc(result="uploaded")
+        try:
+            file_id = self._upload(client, f, export_filename(spec))
+
+            # nobody else can join once the file is being shared
+            with self._lock:
+                del self._uploads[path]
+            if file_id is not None:
+                files = [{"id": file_id, "title": export_filename(spec)}]
+                if len(upload.channels) == 1:
+                    client.files_completeUploadExternal(files=files, channel_id=upload.channels[0],
+                                                        initial_comment="Here's the file you wanted!")
+                else:
+                    client.files_completeUploadExternal(files=files, channels=upload.channels,
+                                                        initial_comment="Here's the file you wanted!")
+                upload.sent = True
+        finally:
+            with self._lock:
+                if self._uploads.get(path) is upload:
+                    del self._uploads[path]
+            upload.done.set()
+        return upload.sent
+
+    @tracing.traced("export.upload")
+    def _upload(self, client, f, filename):
+        """Stream an open file to Slack's upload URL
+
+        Returns
+        -------
+        file_id : `str`
+            ID of the uploaded file, or None if the upload failed
+        """
+        size = os.fstat(f.fileno()).st_size
+        upload_res = client.files_getUploadURLExternal(filename=filename, length=size)
+        if not upload_res["ok"]:
+            return None
+
+        # passing the open file lets requests send it in blocks instead of reading it all into memory
+        try:
+            r = requests.post(upload_res["upload_url"], data=f, timeout=self.timeout,
+                              headers={"Content-Type": "application/octet-stream"})
+        except requests.RequestException as e:
+            print(f"WARNING: couldn't upload {filename} to Slack: {e}")
+            return None
+        if r.status_code != 200:
+            return None
+
+        metrics.EXPORT_BYTES_UPLOADED.inc(size)
+        tracing.annotate(bytes=size)
+        return upload_res["file_id"]
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Get the shared export service, creating it the first time
+
+    Returns
+    -------
+    service : `ExportService`
+        The shared export service
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ExportService()
+    return _service
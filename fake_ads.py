@@ -0,0 +1,440 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+import ads.config
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from ads_cache import cache_key
+from ads_fetch import ADS_URL_VAR
+
+# Run this file to start a stand-in for the ADS search API and then run Geoffrey (or any of the scripts) with
+# GEOFFREY_ADS_URL set to the URL it prints to send every search there instead of the real API.
+
+# where recordings come from (ads.config.SEARCH_URL may already point at a stand-in)
+UPSTREAM_URL = f"{ads.config.ADSWS_API_URL}/search/query/"
+
+# ADS never sends more than this many rows in one page
+MAX_ROWS = 2000
+
+# fields that the fake search understands, with where to look for them in a document
+ORCID_FIELDS = ["orcid_pub", "orcid_user", "orcid_other"]
+TERM_PATTERN = re.compile(r'\s*(\w+):(\[[^\]]*\]|\([^)]*\)|"[^"]*"|\S+)')
+
+
+def fixture_key(params):
+    """Work out the fixture file name for a search
+
+    The entry date ranges are left out because they end on the day the search is run, so a recording can be
+    replayed on any day.
+
+    Parameters
+    ----------
+    params : `dict`
+        Solr parameters for the search
+
+    Returns
+    -------
+    key : `str`
+        Hash of the normalised parameters
+    """
+    params = dict(params)
+    if "q" in params:
+        params["q"] = re.sub(r"entdate:\[[^\]]*\]", "entdate:[*]", params["q"])
+    return cache_key(params)
+
+
+def _values(value):
+    """Split the value of a query term into the values it allows"""
+    if value.startswith("(") and value.endswith(")"):
+        return [v.strip('"') for v in re.split(r"\s+OR\s+", value[1:-1].strip())]
+    return [value.strip('"')]
+
+
+def _date_range(value):
+    """Turn a ``[A TO B]`` range into a pair of ISO date strings (either can be * for open ended)"""
+    start, end = (v.strip() for v in value[1:-1].split(" TO "))
+    return (None if start == "*" else start[:10]), (None if end == "*" else end[:10])
+
+
+def _doc_date(doc, field):
+    """The date of a document as an ISO string (ADS uses day 00 for papers without a day)"""
+    date = doc.get(field) or doc.get("pubdate") or ""
+    return date[:10].replace("-00", "-01")
+
+
+def parse_query(q):
+    """Turn an ADS query into a function that checks whether a document matches it
+
+    Only the small part of the query language that Geoffrey uses is understood: space separated terms that
+    must all match, with ``orcid``, ``collection``, ``doctype``, ``bibcode``, ``author``, ``first_author``,
+    ``entdate`` and ``pubdate`` fields whose values are single values, ``(a OR b)`` lists or
+    ``[start TO end]`` date ranges.
+
+    Parameters
+    ----------
+    q : `str`
+        Query
+
+    Returns
+    -------
+    matches : `function`
+        Function that takes a document and returns whether it matches
+
+    Raises
+    ------
+    ValueError
+        If the query uses anything that isn't understood
+    """
+    checks = []
+    position = 0
+    q = q.strip()
+    while position < len(q):
+        term = TERM_PATTERN.match(q, position)
+        if term is None:
+            raise ValueError(f"can't parse query at '{q[position:]}'")
+        position = term.end()
+        field, value = term.groups()
+
+        if field in ("entdate", "pubdate"):
+            if not value.startswith("["):
+                raise ValueError(f"{field} needs a date range")
+            start, end = _date_range(value)
+            checks.append(lambda doc, field=field, start=start, end=end:
+                          (start is None or _doc_date(doc, field) >= start)
+                          and (end is None or _doc_date(doc, field) <= end))
+            continue
+
+        values = set(_values(value))
+        if field == "orcid":
+            checks.append(lambda doc, values=values: any(o in values for f in ORCID_FIELDS
+                                                         for o in doc.get(f, [])))
+        elif field == "collection":
+            checks.append(lambda doc, values=values: any(d in values
+                                                         for d in doc.get("database", ["astronomy"])))
+        elif field in ("doctype", "bibcode"):
+            checks.append(lambda doc, field=field, values=values: doc.get(field) in values)
+        elif field == "author":
+            values = {v.lower() for v in values}
+            checks.append(lambda doc, values=values: any(a.lower().startswith(v)
+                                                         for a in doc.get("author", []) for v in values))
+        elif field == "first_author":
+            values = {v.lower() for v in values}
+            checks.append(lambda doc, values=values: len(doc.get("author", [])) > 0
+                          and any(doc["author"][0].lower().startswith(v) for v in values))
+        else:
+            raise ValueError(f"unsupported field '{field}'")
+
+    return lambda doc: all(check(doc) for check in checks)
+
+
+def sort_docs(docs, sort):
+    """Sort documents like ADS would (only by date and/or bibcode)
+
+    Parameters
+    ----------
+    docs : `list`
+        Documents to sort
+    sort : `str`
+        ADS sort order, e.g. "date desc, bibcode desc"
+
+    Returns
+    -------
+    docs : `list`
+        Sorted documents
+    """
+    docs = list(docs)
+    keys = {"date": lambda doc: _doc_date(doc, "pubdate"), "bibcode": lambda doc: doc.get("bibcode", "")}
+
+    # sorting is stable so apply the least important key first
+    for part in reversed([p.strip() for p in sort.split(",") if p.strip() != ""]):
+        field, _, direction = part.partition(" ")
+        if field not in keys:
+            raise ValueError(f"unsupported sort field '{field}'")
+        docs.sort(key=keys[field], reverse=direction.strip() == "desc")
+    return docs
+
+
+class FakeADS():
+    """A local stand-in for the ADS search API
+
+    Searches are answered from (in order) recorded fixtures, a list of made up documents, or by passing
+    the request on to the real API (recording the response as a new fixture if asked to). Responses have the
+    same JSON shape, paging and X-RateLimit headers as ADS, and the server can be made slow or flaky to see
+    how Geoffrey copes.
+
+    Parameters
+    ----------
+    docs : `list`, optional
+        Raw ADS documents to search through, by default none
+    fixtures : `str`, optional
+        Directory of recorded responses to replay, by default none
+    record : `bool`, optional
+        Whether to pass searches that aren't in the fixtures on to ``upstream`` and save the responses, by
+        default False
+    upstream : `str`, optional
+        Search URL of the real API, by default `UPSTREAM_URL`
+    latency : `float`, optional
+        Time in seconds to wait before answering each request, by default 0
+    jitter : `float`, optional
+        Extra random wait of up to this many seconds, by default 0
+    throttle : `float`, optional
+        Fraction of requests to answer with a 429, by default 0
+    retry_after : `float`, optional
+        Retry-After (in seconds) sent with each 429, by default 1
+    quota : `int`, optional
+        Number of requests allowed before every request is refused, by default 5000
+    seed : `int`, optional
+        Random seed for the latency and throttling, by default 0
+    host : `str`, optional
+        Host to listen on, by default "127.0.0.1"
+    port : `int`, optional
+        Port to listen on, by default any free port
+    """
+    def __init__(self, docs=None, fixtures=None, record=False, upstream=None, latency=0, jitter=0, throttle=0,
+                 retry_after=1, quota=5000, seed=0, host="127.0.0.1", port=0):
+        self.docs = [] if docs is None else docs
+        self.fixtures = fixtures
+        self.record = record
+        self.upstream = UPSTREAM_URL if upstream is None else upstream
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.quota = quota
+        self.remaining = quota
+        self.reset = int(time.time()) + 24 * 60 * 60
+        self.stats = {"requests": 0, "throttled": 0, "replayed": 0, "recorded": 0, "errors": 0}
+
+        if fixtures is not None:
+            os.makedirs(fixtures, exist_ok=True)
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._results = {}
+        self._thread = None
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """Search URL of the server (to use for `ADS_URL_VAR` or ``ads.config.SEARCH_URL``)"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/search/query/"
+
+    def start(self):
+        """Start answering requests in a background thread
+
+        Returns
+        -------
+        self : `FakeADS`
+            The server
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-ads", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle(self, request):
+        """Answer a single request"""
+        params = dict(parse_qsl(urlparse(request.path).query))
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            throttled = self.remaining <= 0 or self._rng.random() < self.throttle
+            if throttled:
+                self.stats["throttled"] += 1
+            else:
+                self.remaining -= 1
+            rate_headers = {"X-RateLimit-Limit": str(self.quota),
+                            "X-RateLimit-Remaining": str(self.remaining),
+                            "X-RateLimit-Reset": str(self.reset)}
+        time.sleep(delay)
+
+        if throttled:
+            self._send(request, 429, {"error": "Too many requests"},
+                       {**rate_headers, "Retry-After": str(self.retry_after)})
+            return
+
+        try:
+            status, body, headers = self._search(params, request.headers.get("Authorization"))
+        except (ValueError, KeyError) as e:
+            status, body, headers = 400, {"error": str(e)}, {}
+        except requests.RequestException as e:
+            status, body, headers = 502, {"error": f"upstream request failed: {e}"}, {}
+        if status >= 400:
+            with self._lock:
+                self.stats["errors"] += 1
+        self._send(request, status, body, {**rate_headers, **headers})
+
+    def _search(self, params, authorization):
+        """Find the response for a search
+
+        Returns
+        -------
+        status : `int`
+            HTTP status
+        body : `dict`
+            JSON response
+        headers : `dict`
+            Extra headers
+        """
+        path = None if self.fixtures is None else os.path.join(self.fixtures, fixture_key(params) + ".json")
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                fixture = json.load(f)
+            with self._lock:
+                self.stats["replayed"] += 1
+            return fixture["status"], fixture["body"], fixture.get("headers", {})
+
+        if len(self.docs) > 0 or (not self.record and self.fixtures is None):
+            return 200, self._search_docs(params), {}
+        if not self.record:
+            return 404, {"error": f"no recording of the search '{params.get('q')}'"}, {}
+
+        # pass it on to the real thing and keep a copy
+        response = requests.get(self.upstream, params=params, timeout=60,
+                                headers={"Authorization": authorization or ""})
+        headers = {k: v for k, v in response.headers.items() if k == "Retry-After"}
+        fixture = {"params": params, "status": response.status_code, "body": response.json(),
+                   "headers": headers, "recorded": datetime.datetime.now().isoformat(timespec="seconds")}
+        if response.ok:
+            with open(path, "w") as f:
+                json.dump(fixture, f)
+            with self._lock:
+                self.stats["recorded"] += 1
+        return fixture["status"], fixture["body"], headers
+
+    def _search_docs(self, params):
+        """Search the made up documents"""
+        q, sort = params["q"], params.get("sort", "date desc")
+        start, rows = int(params.get("start", 0)), min(int(params.get("rows", 10)), MAX_ROWS)
+        fields = params["fl"].split(",") if "fl" in params else None
+
+        # later pages of the same search come straight from the earlier result
+        with self._lock:
+            matched = self._results.get((q, sort))
+        if matched is None:
+            matches = parse_query(q)
+            matched = sort_docs([doc for doc in self.docs if matches(doc)], sort)
+            with self._lock:
+                self._results[(q, sort)] = matched
+
+        docs = matched[start:start + rows]
+        if fields is not None:
+            docs = [{k: v for k, v in doc.items() if k in fields} for doc in docs]
+        return {"responseHeader": {"status": 0, "QTime": 1,
+                                   "params": {"q": q, "fl": params.get("fl", ""), "start": str(start),
+                                              "rows": str(rows), "sort": sort}},
+                "response": {"numFound": len(matched), "start": start, "docs": docs}}
+
+    def _send(self, request, status, body, headers):
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+
+def paper_to_doc(paper, orcids=None):
+    """Turn a paper dictionary back into a raw ADS document (the opposite of `ads_query.paper_to_dict`)
+
+    Parameters
+    ----------
+    paper : `dict`
+        Dictionary of paper information
+    orcids : `list`, optional
+        ORCIDs to list as claimed by the authors, by default ``paper["orcids"]`` if it has any
+
+    Returns
+    -------
+    doc : `dict`
+        Raw ADS document
+    """
+    date = paper["date"]
+    doc = {
+        "bibcode": paper["bibcode"],
+        "title": [paper["title"]],
+        "abstract": paper.get("abstract"),
+        "author": list(paper["authors"]),
+        "first_author": paper.get("first_author"),
+        "pubdate": date.strftime("%Y-%m-00") if isinstance(date, datetime.date) else date,
+        "entdate": paper.get("entdate", date.isoformat() if isinstance(date, datetime.date) else date),
+        "doctype": paper.get("doctype", "article"),
+        "citation_count": paper.get("citations"),
+        "read_count": paper.get("reads"),
+        "keyword": paper.get("keywords"),
+        "pub": paper.get("publisher"),
+        "orcid_pub": list(paper.get("orcids", []) if orcids is None else orcids),
+    }
+    if paper.get("doi") is not None:
+        doc["doi"] = [paper["doi"]]
+    return {k: v for k, v in doc.items() if v is not None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the ADS search API")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--docs", help="JSON file with a list of raw ADS documents to search through")
+    parser.add_argument("--fixtures", help="directory of recorded responses to replay (and record into)")
+    parser.add_argument("--record", action="store_true",
+                        help="pass unknown searches on to the real ADS and save the responses to --fixtures")
+    parser.add_argument("--latency", type=float, default=0, help="seconds to wait before each response")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random wait of up to this long")
+    parser.add_argument("--throttle", type=float, default=0, help="fraction of requests to answer with a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After sent with each 429")
+    parser.add_argument("--quota", type=int, default=5000, help="number of requests allowed")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the latency and throttling")
+    args = parser.parse_args(argv)
+
+    if args.record and args.fixtures is None:
+        parser.error("--record needs --fixtures")
+
+    docs = None
+    if args.docs is not None:
+        with open(args.docs) as f:
+            docs = json.load(f)
+
+    fake = FakeADS(docs=docs, fixtures=args.fixtures, record=args.record, latency=args.latency,
+                   jitter=args.jitter, throttle=args.throttle, retry_after=args.retry_after, quota=args.quota,
+                   seed=args.seed, port=args.port)
+    print(f"Fake ADS listening, run Geoffrey with {ADS_URL_VAR}={fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {fake.stats}")
+
+
+if __name__ == "__main__":
+    main()
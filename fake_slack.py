@@ -0,0 +1,399 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+# Run this file to start a stand-in for the Slack Web API and then run Geoffrey with GEOFFREY_SLACK_URL set
+# to the URL it prints. Nothing is sent to a real workspace, every call is recorded and the stand-in can be
+# made slow or rate limited. Events are sent to the app with the functions at the bottom.
+
+BOT_USER = "U06V23JH71R"
+TEAM = "T00000FAKE"
+
+# Slack doesn't send more than this many items in one page of a list
+MAX_PAGE = 1000
+
+
+class FakeSlack():
+    """A local stand-in for the Slack Web API
+
+    Answers the methods that Geoffrey uses (posting and updating messages, views, uploads, and the channel
+    and user lists) with responses in the same shape as Slack's, and keeps a record of every call.
+
+    Parameters
+    ----------
+    channels : `list`, optional
+        Names of the channels in the workspace, by default just "department-arxiv" and "general"
+    users : `list`, optional
+        Slack IDs of the people in the workspace, by default none
+    latency : `float`, optional
+        Time in seconds to wait before answering each call, by default 0
+    jitter : `float`, optional
+        Extra random wait of up to this many seconds, by default 0
+    throttle : `float`, optional
+        Fraction of calls to answer with a 429, by default 0
+    throttle_methods : `list`, optional
+        Only rate limit these methods (e.g. ["chat.postMessage"]), by default every method
+    retry_after : `int`, optional
+        Retry-After (in whole seconds, like Slack) sent with each 429, by default 1
+    seed : `int`, optional
+        Random seed for the latency and throttling, by default 0
+    host : `str`, optional
+        Host to listen on, by default "127.0.0.1"
+    port : `int`, optional
+        Port to listen on, by default any free port
+    """
+    def __init__(self, channels=None, users=None, latency=0, jitter=0, throttle=0, throttle_methods=None,
+                 retry_after=1, seed=0, host="127.0.0.1", port=0):
+        channels = ["department-arxiv", "general"] if channels is None else channels
+        self.channels = [{"id": f"C{i:08d}", "name": name, "is_channel": True, "is_archived": False}
+                         for i, name in enumerate(channels)]
+        self.users = [{"id": user, "name": user.lower(), "real_name": user, "deleted": False,
+                       "profile": {"real_name": user}} for user in ([] if users is None else users)]
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.throttle_methods = None if throttle_methods is None else set(throttle_methods)
+        self.retry_after = retry_after
+
+        self.calls = []
+        self.uploads = {}
+        self.stats = {"calls": 0, "throttled": 0, "errors": 0}
+
+        self._rng = random.Random(seed)
+        self._ts = itertools.count(1)
+        self._lock = threading.Lock()
+        self._new_call = threading.Condition(self._lock)
+        self._thread = None
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                fake._handle(self)
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """Base URL of the API (to use for ``GEOFFREY_SLACK_URL`` or ``WebClient(base_url=...)``)"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def start(self):
+        """Start answering calls in a background thread
+
+        Returns
+        -------
+        self : `FakeSlack`
+            The server
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-slack", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def calls_to(self, method):
+        """Every successful call to a method so far
+
+        Parameters
+        ----------
+        method : `str`
+            API method, e.g. "chat.postMessage"
+
+        Returns
+        -------
+        calls : `list`
+            The calls, each a dictionary with the "method", its "args" and the "time" it was answered
+        """
+        with self._lock:
+            return [call for call in self.calls if call["method"] == method and call["ok"]]
+
+    def wait_for(self, check, start=0, timeout=10):
+        """Wait for a call that passes a check
+
+        Parameters
+        ----------
+        check : `function`
+            Function that takes a call and returns whether it is the one being waited for
+        start : `int`, optional
+            Only look at calls from this index onwards, by default every call
+        timeout : `float`, optional
+            Longest time to wait in seconds, by default 10
+
+        Returns
+        -------
+        call : `dict`
+            The call, or None if there wasn't one in time
+        """
+        deadline = time.monotonic() + timeout
+        with self._new_call:
+            while True:
+                for call in self.calls[start:]:
+                    if call["ok"] and check(call):
+                        return call
+                start = len(self.calls)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._new_call.wait(remaining):
+                    return None
+
+    def _handle(self, request):
+        """Answer a single request"""
+        path = urlparse(request.path).path
+        length = int(request.headers.get("Content-Length") or 0)
+        raw = request.rfile.read(length) if length > 0 else b""
+
+        # uploads go to the URL handed out by files.getUploadURLExternal
+        if path.startswith("/upload/"):
+            with self._lock:
+                self.uploads[path.split("/")[-1]] = len(raw)
+            self._send(request, 200, b"OK - " + str(len(raw)).encode(), content_type="text/plain")
+            return
+
+        method = path.rsplit("/", 1)[-1]
+        if request.headers.get("Content-Type", "").startswith("application/json"):
+            args = json.loads(raw or b"{}")
+        else:
+            args = dict(parse_qsl(raw.decode()))
+            args.update(parse_qsl(urlparse(request.path).query))
+
+        with self._lock:
+            self.stats["calls"] += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            throttled = ((self.throttle_methods is None or method in self.throttle_methods)
+                         and self._rng.random() < self.throttle)
+        time.sleep(delay)
+
+        if throttled:
+            body, status = {"ok": False, "error": "ratelimited"}, 429
+            headers = {"Retry-After": self.retry_after}
+        else:
+            body, status, headers = self._answer(method, args), 200, {}
+
+        with self._new_call:
+            self.stats["throttled"] += throttled
+            self.stats["errors"] += not throttled and not body["ok"]
+            self.calls.append({"method": method, "args": args, "time": time.perf_counter(),
+                               "ok": body["ok"] and not throttled})
+            self._new_call.notify_all()
+        self._send(request, status, json.dumps(body).encode(), headers=headers)
+
+    def _timestamp(self):
+        return f"{int(time.time())}.{next(self._ts):06d}"
+
+    def _page(self, items, args, key):
+        """Answer a paginated list method"""
+        start = int(args.get("cursor") or 0)
+        limit = min(int(args.get("limit") or 100), MAX_PAGE)
+        next_cursor = str(start + limit) if start + limit < len(items) else ""
+        return {"ok": True, key: items[start:start + limit],
+                "response_metadata": {"next_cursor": next_cursor}}
+
+    def _answer(self, method, args):
+        """Work out the response to a call to the API"""
+        if method == "auth.test":
+            return {"ok": True, "url": "https://fake.slack.com/", "team": "Fake", "user": "geoffrey",
+                    "team_id": TEAM, "user_id": BOT_USER, "bot_id": "B00000FAKE"}
+        if method == "chat.postMessage":
+            if not args.get("channel"):
+                return {"ok": False, "error": "channel_not_found"}
+            ts = self._timestamp()
+            return {"ok": True, "channel": args["channel"], "ts": ts,
+                    "message": {"text": args.get("text"), "user": BOT_USER, "ts": ts}}
+        if method in ("chat.update", "chat.delete"):
+            return {"ok": True, "channel": args.get("channel"), "ts": args.get("ts")}
+        if method in ("views.publish", "views.open"):
+            view = args.get("view")
+            view = json.loads(view) if isinstance(view, str) else view
+            return {"ok": True, "view": {"id": f"V{uuid.uuid4().hex[:10].upper()}", **(view or {})}}
+        if method == "conversations.open":
+            return {"ok": True, "channel": {"id": "D" + str(args.get("users", "")).split(",")[0][1:]}}
+        if method == "conversations.list":
+            return self._page(self.channels, args, "channels")
+        if method == "users.list":
+            return self._page(self.users, args, "members")
+        if method == "files.getUploadURLExternal":
+            file_id = f"F{uuid.uuid4().hex[:10].upper()}"
+            return {"ok": True, "upload_url": self.url.replace("/api/", f"/upload/{file_id}"),
+                    "file_id": file_id}
+        if method == "files.completeUploadExternal":
+            files = args.get("files")
+            files = json.loads(files) if isinstance(files, str) else files
+            return {"ok": True, "files": files or []}
+        return {"ok": False, "error": "unknown_method"}
+
+    def _send(self, request, status, data, headers={}, content_type="application/json"):
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            request.send_header(key, str(value))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+""" ---------- SYNTHETIC EVENTS ---------- """
+
+def event_body(event):
+    """Wrap an event in the envelope that Slack sends it in
+
+    Parameters
+    ----------
+    event : `dict`
+        The event
+
+    Returns
+    -------
+    body : `dict`
+        Body of the request
+    """
+    return {"token": "fake", "team_id": TEAM, "api_app_id": "A00000FAKE", "event": event,
+            "type": "event_callback", "event_id": f"Ev{uuid.uuid4().hex[:10].upper()}",
+            "event_time": int(time.time())}
+
+
+def mention_event(text, user, channel, ts=None):
+    """An app_mention event (someone tagging Geoffrey in a channel)
+
+    Parameters
+    ----------
+    text : `str`
+        Text of the message (the tag for Geoffrey is added to the start)
+    user : `str`
+        Slack ID of the person that sent it
+    channel : `str`
+        ID of the channel
+    ts : `str`, optional
+        Timestamp of the message, by default now
+
+    Returns
+    -------
+    body : `dict`
+        Body of the request
+    """
+    ts = f"{time.time():.6f}" if ts is None else ts
+    return event_body({"type": "app_mention", "user": user, "text": f"<@{BOT_USER}> {text}", "ts": ts,
+                       "channel": channel, "event_ts": ts})
+
+
+def direct_message_event(text, user, ts=None):
+    """A message event from someone's direct messages with Geoffrey
+
+    Parameters
+    ----------
+    text : `str`
+        Text of the message
+    user : `str`
+        Slack ID of the person that sent it
+    ts : `str`, optional
+        Timestamp of the message, by default now
+
+    Returns
+    -------
+    body : `dict`
+        Body of the request
+    """
+    ts = f"{time.time():.6f}" if ts is None else ts
+    return event_body({"type": "message", "channel_type": "im", "user": user, "text": text, "ts": ts,
+                       "channel": "D" + user[1:], "event_ts": ts})
+
+
+def home_opened_event(user):
+    """An app_home_opened event (someone opening Geoffrey's home tab)"""
+    return event_body({"type": "app_home_opened", "user": user, "channel": "D" + user[1:], "tab": "home",
+                       "event_ts": f"{time.time():.6f}"})
+
+
+def block_action(action_id, value, user):
+    """A block_actions request (someone clicking a button)
+
+    Parameters
+    ----------
+    action_id : `str`
+        ID of the action, e.g. "send-all-papers"
+    value : `str`
+        Value of the button
+    user : `str`
+        Slack ID of the person that clicked it
+
+    Returns
+    -------
+    body : `dict`
+        Body of the request
+    """
+    return {"type": "block_actions", "team": {"id": TEAM}, "user": {"id": user, "team_id": TEAM},
+            "api_app_id": "A00000FAKE", "token": "fake", "trigger_id": uuid.uuid4().hex,
+            "container": {"type": "view", "view_id": "V00000FAKE"},
+            "actions": [{"type": "button", "action_id": action_id, "block_id": "fake", "value": value,
+                         "action_ts": f"{time.time():.6f}"}]}
+
+
+def send_to_app(app, body):
+    """Hand a request to a Bolt app as if it had come in over socket mode
+
+    The app acknowledges it and then carries on with its listeners in the background, just like it would
+    for the real thing.
+
+    Parameters
+    ----------
+    app : `slack_bolt.App`
+        The app
+    body : `dict`
+        Body of the request (e.g. from `mention_event`)
+
+    Returns
+    -------
+    response : `slack_bolt.BoltResponse`
+        The acknowledgement
+    """
+    from slack_bolt.request import BoltRequest
+    return app.dispatch(BoltRequest(body=body, mode="socket_mode"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Slack Web API")
+    parser.add_argument("--port", type=int, default=8766, help="port to listen on")
+    parser.add_argument("--latency", type=float, default=0, help="seconds to wait before each response")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random wait of up to this long")
+    parser.add_argument("--throttle", type=float, default=0, help="fraction of calls to answer with a 429")
+    parser.add_argument("--throttle-method", action="append", help="only rate limit this method")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with each 429")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the latency and throttling")
+    args = parser.parse_args(argv)
+
+    fake = FakeSlack(latency=args.latency, jitter=args.jitter, throttle=args.throttle,
+                     throttle_methods=args.throttle_method, retry_after=args.retry_after, seed=args.seed,
+                     port=args.port)
+    print(f"Fake Slack listening, run Geoffrey with GEOFFREY_SLACK_URL={fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Answered {fake.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 import ads_query
 import datetime
-import pandas as pd
+from roster import get_roster
 
-orcids = pd.read_csv("data/orcids.csv")["orcid"].values
-last_names = pd.read_csv("data/orcids.csv")["last_name"].values
+orcid_file = get_roster().table
 
-for orcid, last_name in zip(orcids, last_names):
-    papers_dict_list = ads_query.get_ads_papers(query=f"orcid:{orcid}", remove_known_papers=True)
+# search for everyone at once and then count up the papers per person
+papers_dict_list = ads_query.get_ads_papers_batched(orcid_file["orcid"].values, remove_known_papers=True)
 
-    # recent_papers = [paper for paper in papers_dict_list if paper["date"] > datetime.date(2023, 8, 1)]
+# recent_papers = [paper for paper in papers_dict_list if paper["date"] > datetime.date(2023, 8, 1)]
 
-    print(f"Found {len(papers_dict_list)} papers for {last_name}")
+for orcid, last_name in zip(orcid_file["orcid"].values, orcid_file["last_name"].values):
+    n_papers = sum(orcid in paper["orcids"] for paper in papers_dict_list)
+    print(f"Found {n_papers} papers for {last_name}")
 
-    ads_query.save_papers(papers_dict_list)
+ads_query.save_papers(papers_dict_list)
@@ -0,0 +1,9 @@
+import paper_store
+import sys
+
+# one-off import of an old papers CSV file (by default data/papers.csv) into the paper store, linking each
+# paper to the people in the roster
+csv_path = sys.argv[1] if len(sys.argv) > 1 else paper_store.LEGACY_CSV_PATH
+
+n_added = paper_store.import_csv(csv_path, members=paper_store.roster_members)
+print(f"Imported {n_added} new papers from {csv_path} ({paper_store.count_papers()} papers in the store)")
@@ -0,0 +1,160 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from slack_sdk.errors import SlackApiError
+
+import metrics
+import tracing
+
+WORKING_ON_IT = "Righto, I'm working on it... :hourglass_flowing_sand:"
+
+# the "working on it" message of the job that the current code is running in
+_placeholder = ContextVar("geoffrey_job_placeholder", default=None)
+
+
+def has_working_message():
+    """Whether the job that the current code is running in has a "working on it" message up
+
+    Jobs that post messages of their own besides their result can use this to keep them in order, since
+    without the message their result is only posted once they finish.
+
+    Returns
+    -------
+    posted : `bool`
+        Whether the message was posted (False outside of a job)
+    """
+    return _placeholder.get() is not None
+
+
+class JobQueue():
+    """Runs slow work for the Slack listeners in the background so that they can acknowledge straight away
+
+    A job can put up a "working on it" message when it starts, which is replaced by whatever the job returns
+    once it finishes. Jobs are identified by a key and a job won't be queued again whilst an identical one
+    is still waiting or running (e.g. someone clicking the same button twice).
+
+    Parameters
+    ----------
+    client : `slack_sdk.WebClient`
+        Client used for the "working on it" messages
+    max_workers : `int`, optional
+        Maximum number of jobs running at once, by default 4
+    """
+    def __init__(self, client, max_workers=4):
+        self.client = client
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geoffrey-job")
+
+        self._lock = threading.Lock()
+        self._active = {}
+
+    def submit(self, key, func, *args, status=None, error=None, **kwargs):
+        """Queue up a job
+
+        Parameters
+        ----------
+        key : `str`
+            Key identifying the job (a job with the same key as one that's already queued is dropped)
+        func : `function`
+            Function to run. It can return a string or a dictionary (with text/blocks) to replace the
+            "working on it" message with, or None to just remove that message.
+        *args, **kwargs
+            Arguments for the function
+        status : `dict`, optional
+            Arguments for ``chat_postMessage`` to post a "working on it" message when the job starts (the
+            text defaults to `WORKING_ON_IT`), by default no message
+        error : `str`, optional
+            Text to replace the "working on it" message with if the job fails, by default it is removed
+
+        Returns
+        -------
+        future : `concurrent.futures.Future`
+            Future for the result of the job, or None if an identical job is already queued
+        """
+        with self._lock:
+            if key in self._active:
+                return None
+
+            # the job can't finish and forget its key until we've let go of the lock (it gets a trace of
+            # its own which remembers the trace of whatever queued it)
+            future = self.pool.submit(self._run, key, func, args, kwargs, status, error,
+                                      tracing.current_trace_id())
+            self._active[key] = future
+            return future
+
+    def is_active(self, key):
+        """Whether a job with this key is waiting or running"""
+        with self._lock:
+            return key in self._active
+
+    def shutdown(self, wait=True):
+        """Stop taking new jobs
+
+        Parameters
+        ----------
+        wait : `bool`, optional
+            Whether to wait for the jobs that are waiting or running to finish, by default True
+        """
+        self.pool.shutdown(wait=wait)
+
+    def _run(self, key, func, args, kwargs, status, error, parent_trace=None):
+        # time jobs by their kind (the start of the key) rather than every single key
+        kind = key.split(":")[0]
+        start = time.perf_counter()
+        try:
+            with tracing.trace(f"job:{kind}", key=key, parent_trace=parent_trace):
+                placeholder = None
+                if status is not None:
+                    try:
+                        placeholder = self.client.chat_postMessage(**{"text": WORKING_ON_IT, **status})
+                    except SlackApiError as e:
+                        print(f"WARNING: couldn't post the working message for job {key}: {e}")
+
+                token = _placeholder.set(placeholder)
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    metrics.JOB_ERRORS.inc(job=kind)
+                    tracing.annotate(failed=True)
+                    print(f"WARNING: job {key} failed")
+                    traceback.print_exc()
+                    result = error
+                finally:
+                    _placeholder.reset(token)
+
+                if placeholder is not None:
+                    self._finish(key, placeholder, status, result)
+                elif status is not None and result is not None:
+                    # the working message never made it so post the result as a new message instead
+                    self._post(key, status, result)
+                return result
+        finally:
+            metrics.JOB_SECONDS.observe(time.perf_counter() - start, job=kind)
+            with self._lock:
+                self._active.pop(key, None)
+
+    def _finish(self, key, placeholder, status, result):
+        """Replace (or remove) the "working on it" message with the result of a job"""
+        try:
+            if result is None:
+                self.client.chat_delete(channel=placeholder["channel"], ts=placeholder["ts"])
+            elif isinstance(result, str):
+                self.client.chat_update(channel=placeholder["channel"], ts=placeholder["ts"], text=result)
+            else:
+                self.client.chat_update(channel=placeholder["channel"], ts=placeholder["ts"],
+                                        **{k: v for k, v in result.items() if k in ("text", "blocks")})
+        except SlackApiError as e:
+            print(f"WARNING: couldn't update the working message for job {key}: {e}")
+            # don't lose the result just because the message couldn't be changed
+            if result is not None:
+                self._post(key, status, result)
+
+    def _post(self, key, status, result):
+        """Post the result of a job as a new message"""
+        if isinstance(result, str):
+            result = {"text": result}
+        try:
+            self.client.chat_postMessage(**{**status, **result})
+        except SlackApiError as e:
+            print(f"WARNING: couldn't post the result of job {key}: {e}")
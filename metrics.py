@@ -0,0 +1,496 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
+
+import tracing
+
+# Counters and histograms for everything that takes time or costs something (ADS requests, the caches,
+# files, the store, Slack calls, listeners, jobs and the stages of the weekly roundup), served in the
+# Prometheus text format on a local HTTP endpoint so that they can be scraped, graphed and alerted on.
+
+# port to serve the metrics on, set it to "off" to not serve them at all
+METRICS_PORT_VAR = "GEOFFREY_METRICS_PORT"
+DEFAULT_PORT = 9464
+METRICS_HOST = "127.0.0.1"
+
+# upper bounds of the histogram buckets (seconds), from a quick cache lookup up to a very slow roundup
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    """Escape a label value for the text format"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    """A named metric with a value for each combination of its labels
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the metric
+    documentation : `str`
+        What the metric measures (the HELP line)
+    labels : `list`, optional
+        Names of the labels, by default none
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} needs the labels {self.labels}, not {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def get(self, **labels):
+        """Current value for some labels (0 if it has never been set)"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Lines of the text format for every value
+
+        Yields
+        ------
+        line : `str`
+            One sample
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+    def render(self):
+        """The metric in the text format (HELP, TYPE and every sample)"""
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}",
+                          *self.samples()])
+
+
+class Counter(Metric):
+    """A metric that only ever goes up"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Add to the count
+
+        Parameters
+        ----------
+        amount : `float`, optional
+            Amount to add, by default 1
+        **labels
+            Value of each label
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A metric that can go up and down, either set directly or worked out by a function when scraped"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels=labels)
+        self._func = None
+
+    def set(self, value, **labels):
+        """Set the value
+
+        Parameters
+        ----------
+        value : `float`
+            New value
+        **labels
+            Value of each label
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func):
+        """Work out the (unlabelled) value with a function every time the metrics are scraped
+
+        Parameters
+        ----------
+        func : `function`
+            Function that takes no arguments and returns the value (or None if there isn't one)
+        """
+        self._func = func
+
+    def samples(self):
+        if self._func is None:
+            yield from super().samples()
+            return
+        try:
+            value = self._func()
+        except Exception as e:
+            print(f"WARNING: couldn't work out {self.name}: {e}")
+            return
+        if value is not None:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """A metric that counts observations (usually durations) into buckets
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the metric
+    documentation : `str`
+        What the metric measures (the HELP line)
+    labels : `list`, optional
+        Names of the labels, by default none
+    buckets : `list`, optional
+        Upper bounds of the buckets, by default `DEFAULT_BUCKETS`
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels=labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        """Record an observation
+
+        Parameters
+        ----------
+        value : `float`
+            Value observed
+        **labels
+            Value of each label
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def get(self, **labels):
+        """Number of observations and their sum for some labels"""
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ([0] * len(self.buckets), 0))
+        return sum(counts), total
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the body of a ``with`` block takes (even if it raises)
+
+        Parameters
+        ----------
+        **labels
+            Value of each label
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(float(total))}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class Registry():
+    """Every metric that is served"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric (or get the one that already has its name)
+
+        Parameters
+        ----------
+        metric : `Metric`
+            Metric to add
+
+        Returns
+        -------
+        metric : `Metric`
+            The registered metric
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    """Make and register a `Counter`"""
+    return REGISTRY.register(Counter(name, documentation, labels=labels))
+
+
+def gauge(name, documentation, labels=()):
+    """Make and register a `Gauge`"""
+    return REGISTRY.register(Gauge(name, documentation, labels=labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    """Make and register a `Histogram`"""
+    return REGISTRY.register(Histogram(name, documentation, labels=labels, buckets=buckets))
+
+
+""" ---------- THE METRICS ---------- """
+
+ADS_REQUESTS = counter("geoffrey_ads_requests_total",
+                       "ADS search requests sent, by HTTP status (or 'error' if there was no response)",
+                       ["status"])
+ADS_REQUEST_SECONDS = histogram("geoffrey_ads_request_seconds", "Time taken by each ADS search request")
+ADS_ROWS = counter("geoffrey_ads_rows_fetched_total", "Documents received from ADS searches")
+ADS_QUOTA_REMAINING = gauge("geoffrey_ads_quota_remaining", "ADS requests left in today's quota")
+ADS_CACHE_LOOKUPS = counter("geoffrey_ads_cache_lookups_total",
+                            "Lookups in the ADS response cache, by result (hit, miss or expired)", ["result"])
+
+FILE_BYTES_READ = counter("geoffrey_file_bytes_read_total", "Bytes read from CSV files", ["file"])
+FILE_BYTES_WRITTEN = counter("geoffrey_file_bytes_written_total", "Bytes written to CSV files", ["file"])
+STORE_ROWS_READ = counter("geoffrey_store_rows_read_total", "Rows read from the paper store", ["table"])
+STORE_ROWS_WRITTEN = counter("geoffrey_store_rows_written_total", "Rows added or changed in the paper store",
+                             ["table"])
+STORE_BYTES = gauge("geoffrey_store_bytes", "Size of the paper store on disk (including its journal)")
+
+SLACK_CALLS = counter("geoffrey_slack_api_calls_total",
+                      "Slack Web API calls, by method and outcome (ok, ratelimited or error)",
+                      ["method", "status"])
+SLACK_CALL_SECONDS = histogram("geoffrey_slack_api_call_seconds",
+                               "Time taken by each Slack Web API call (including any retries)", ["method"])
+SLACK_RATE_LIMITED = counter("geoffrey_slack_rate_limited_total",
+                             "Slack responses that were a 429 (whether or not they were retried)", ["method"])
+
+HANDLER_SECONDS = histogram("geoffrey_handler_seconds", "Time taken by the Slack listeners, by event type",
+                            ["event"])
+HANDLER_ERRORS = counter("geoffrey_handler_errors_total", "Slack listeners that raised, by event type",
+                         ["event"])
+JOB_SECONDS = histogram("geoffrey_job_seconds", "Time taken by background jobs, by kind of job", ["job"])
+JOB_ERRORS = counter("geoffrey_job_errors_total", "Background jobs that failed, by kind of job", ["job"])
+
+ROUNDUP_STAGE_SECONDS = histogram("geoffrey_roundup_stage_seconds",
+                                  "Time taken by each stage of the weekly roundup", ["stage"])
+ROUNDUP_PAPERS = counter("geoffrey_roundup_papers_total", "New papers announced in roundups")
+
+EXPORT_ARTIFACTS = counter("geoffrey_export_artifacts_total",
+                           "Paper exports asked for, by whether the file was built or cached", ["result"])
+EXPORT_UPLOADS = counter("geoffrey_export_uploads_total",
+                         "Paper exports sent, by whether they were uploaded or shared", ["result"])
+EXPORT_BYTES_UPLOADED = counter("geoffrey_export_bytes_uploaded_total",
+                                "Bytes of paper exports sent to Slack")
+HOME_VIEWS = counter("geoffrey_home_views_total",
+                     "Home tabs opened, by whether the view was published or already up to date", ["result"])
+
+
+class StageTimer():
+    """Times the stages of the weekly roundup one after another (each is also a span of the current trace)"""
+    def __init__(self):
+        self.stage = None
+        self._start = None
+        self._span = None
+
+    def start(self, stage):
+        """Finish the current stage (if there is one) and start the next
+
+        Parameters
+        ----------
+        stage : `str`
+            Name of the stage (sweep, build, save, post...)
+        """
+        self.stop()
+        self.stage, self._start = stage, time.perf_counter()
+        self._span = tracing.start_span(f"roundup.{stage}")
+
+    def stop(self):
+        """Finish the current stage"""
+        if self.stage is None:
+            return
+        ROUNDUP_STAGE_SECONDS.observe(time.perf_counter() - self._start, stage=self.stage)
+        tracing.end_span(self._span)
+        self.stage, self._span = None, None
+
+
+def timed_handler(event):
+    """Decorate a Slack listener to time it, count its failures and trace it (as "event:<event>")
+
+    Bolt reads the arguments of a listener through ``functools.wraps`` so the decorated function still
+    gets everything it asks for. Works for async listeners too.
+
+    Parameters
+    ----------
+    event : `str`
+        Event type to label the listener with
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    with tracing.trace(f"event:{event}"):
+                        return await func(*args, **kwargs)
+                except Exception:
+                    HANDLER_ERRORS.inc(event=event)
+                    raise
+                finally:
+                    HANDLER_SECONDS.observe(time.perf_counter() - start, event=event)
+            return wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with tracing.trace(f"event:{event}"):
+                    return func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(event=event)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, event=event)
+        return wrapper
+    return decorator
+
+
+def api_method(url):
+    """Name of the Slack API method from the URL of a request (e.g. "chat.postMessage")"""
+    return url.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+def record_slack_call(api_method, start, error=None):
+    """Count a finished Slack API call
+
+    Parameters
+    ----------
+    api_method : `str`
+        Slack API method
+    start : `float`
+        `time.perf_counter` when the call started
+    error : `slack_sdk.errors.SlackApiError`, optional
+        Error it failed with, by default it succeeded
+    """
+    if error is None:
+        status = "ok"
+    elif error.response.status_code == 429:
+        status = "ratelimited"
+        SLACK_RATE_LIMITED.inc(method=api_method)
+    else:
+        status = "error"
+    SLACK_CALLS.inc(method=api_method, status=status)
+    SLACK_CALL_SECONDS.observe(time.perf_counter() - start, method=api_method)
+
+
+class InstrumentedWebClient(WebClient):
+    """A `slack_sdk.WebClient` that counts, times and traces every API call"""
+    def api_call(self, api_method, **kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"slack.{api_method}"):
+                response = super().api_call(api_method, **kwargs)
+        except SlackApiError as e:
+            record_slack_call(api_method, start, error=e)
+            raise
+        record_slack_call(api_method, start)
+        return response
+
+
+class CountingRateLimitHandler(RateLimitErrorRetryHandler):
+    """Retries rate limited Slack calls (like its parent) and counts each 429 that gets retried
+
+    The 429s that run out of retries surface as errors and are counted by `InstrumentedWebClient`.
+    """
+    def prepare_for_next_attempt(self, *, state, request, response=None, error=None):
+        if response is not None:
+            SLACK_RATE_LIMITED.inc(method=api_method(request.url))
+        super().prepare_for_next_attempt(state=state, request=request, response=response, error=error)
+
+
+""" ---------- THE ENDPOINT ---------- """
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry on /metrics"""
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # a scrape every few seconds would drown out everything else
+        pass
+
+
+def serve(port=None, host=METRICS_HOST):
+    """Serve the metrics from a background thread
+
+    Parameters
+    ----------
+    port : `int`, optional
+        Port to serve on (0 picks a free one), by default from the `METRICS_PORT_VAR` environment variable
+        or `DEFAULT_PORT`
+    host : `str`, optional
+        Address to listen on, by default only this machine
+
+    Returns
+    -------
+    server : `http.server.ThreadingHTTPServer`
+        The server, or None if serving the metrics is turned off or the port couldn't be used
+    """
+    if port is None:
+        port = os.environ.get(METRICS_PORT_VAR, str(DEFAULT_PORT))
+        if port.lower() == "off":
+            return None
+        port = int(port)
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"WARNING: couldn't serve the metrics on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="geoffrey-metrics", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
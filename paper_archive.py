@@ -0,0 +1,258 @@
+import datetime
+import json
+import os
+import threading
+
+# pyarrow is only needed for the archive
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import metrics
+import paper_store
+import tracing
+
+# A typed, columnar snapshot of the paper store for anything that reads lots of papers at once (analysis,
+# exports and statistics). Author and keyword lists are real list columns, dates and counts have proper
+# types and the publishers are dictionary encoded. The file is an uncompressed Arrow IPC file so that it
+# can be memory-mapped and read without copying, with only the pages of the columns that are used ever
+# being loaded. It is rebuilt from the store whenever the store's version moves on.
+
+ARCHIVE_PATH = "data/papers.arrow"
+
+# key of the schema metadata that records which version of the store the archive was built from
+VERSION_KEY = b"store_version"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is needed for the paper archive (pip install pyarrow)")
+
+
+def archive_schema():
+    """The schema of the archive
+
+    Returns
+    -------
+    schema : `pyarrow.Schema`
+        Schema of the archive
+    """
+    _require_pyarrow()
+    return pa.schema([
+        ("bibcode", pa.string()),
+        ("title", pa.string()),
+        ("first_author", pa.string()),
+        ("authors", pa.list_(pa.string())),
+        ("date", pa.date32()),
+        ("publisher", pa.dictionary(pa.int32(), pa.string())),
+        ("keywords", pa.list_(pa.string())),
+        ("link", pa.string()),
+        ("abstract", pa.string()),
+        ("citations", pa.int32()),
+        ("reads", pa.int32()),
+        ("uw_first_author", pa.bool_()),
+        ("total_uw", pa.int32()),
+        ("doi", pa.string()),
+        ("orcids", pa.list_(pa.string())),
+    ])
+
+
+def _parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def build_archive(path=None, con=None):
+    """Write the whole paper store out to an archive file (most recent papers first)
+
+    Parameters
+    ----------
+    path : `str`, optional
+        Path of the archive, by default `ARCHIVE_PATH`
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    version : `int`
+        Version of the store that the archive was built from
+    """
+    _require_pyarrow()
+    path = ARCHIVE_PATH if path is None else path
+    schema = archive_schema()
+
+    own_con = con is None
+    con = paper_store.connect() if own_con else con
+    try:
+        with tracing.span("archive.build"), con:
+            # read the version in the same transaction as the papers so that they can't disagree
+            con.execute("BEGIN")
+            version = paper_store.get_version(con=con)
+            rows = con.execute("""SELECT bibcode, title, first_author, authors, date, publisher, keywords,
+                                         link, abstract, citations, reads, uw_first_author, total_uw, doi,
+                                         (SELECT json_group_array(orcid) FROM paper_members
+                                          WHERE paper_members.bibcode = papers.bibcode) AS orcids
+                                  FROM papers ORDER BY date DESC, bibcode""").fetchall()
+    finally:
+        if own_con:
+            con.close()
+    metrics.STORE_ROWS_READ.inc(len(rows), table="papers")
+
+    columns = {name: [row[name] for row in rows] for name in schema.names}
+    for name in ["authors", "orcids"]:
+        columns[name] = [json.loads(value) if value is not None else [] for value in columns[name]]
+    columns["keywords"] = [json.loads(value) if value is not None else None for value in columns["keywords"]]
+    columns["date"] = [_parse_date(value) for value in columns["date"]]
+    columns["uw_first_author"] = [None if value is None else bool(value)
+                                  for value in columns["uw_first_author"]]
+
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    table = pa.Table.from_arrays(arrays, schema=schema.with_metadata({VERSION_KEY: str(version).encode()}))
+
+    # write to a temporary file first so that readers never map half a file
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    metrics.FILE_BYTES_WRITTEN.inc(os.path.getsize(tmp_path), file="archive")
+    os.replace(tmp_path, path)
+    return version
+
+
+def archive_version(path=None):
+    """Version of the store that an archive file was built from
+
+    Parameters
+    ----------
+    path : `str`, optional
+        Path of the archive, by default `ARCHIVE_PATH`
+
+    Returns
+    -------
+    version : `int`
+        Version of the store, or None if there is no (readable) archive
+    """
+    _require_pyarrow()
+    path = ARCHIVE_PATH if path is None else path
+    if not os.path.exists(path):
+        return None
+    try:
+        with pa.memory_map(path) as source:
+            metadata = ipc.open_file(source).schema.metadata or {}
+    except pa.ArrowInvalid:
+        return None
+    return int(metadata[VERSION_KEY]) if VERSION_KEY in metadata else None
+
+
+class Archive():
+    """The archive file, memory-mapped and kept up to date with the paper store
+
+    Parameters
+    ----------
+    path : `str`, optional
+        Path of the archive, by default `ARCHIVE_PATH`
+    """
+    def __init__(self, path=None):
+        _require_pyarrow()
+        self.path = ARCHIVE_PATH if path is None else path
+        self.version = None
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Rebuild the archive if the store has moved on and map the file again if it has changed"""
+        version = paper_store.get_version()
+        if version == self.version:
+            return
+
+        if archive_version(self.path) != version:
+            version = build_archive(self.path)
+
+        # the mapped buffers stay valid after the file is replaced so older tables can still be used
+        with pa.memory_map(self.path) as source:
+            self._table = ipc.open_file(source).read_all()
+        self.version = version
+
+    @property
+    def table(self):
+        """The whole archive as a `pyarrow.Table` (columns are only paged in when they are used)"""
+        with self._lock:
+            self._refresh()
+            return self._table
+
+    def read(self, columns=None):
+        """Get some columns of every paper without copying them
+
+        Parameters
+        ----------
+        columns : `list`, optional
+            Columns to read, by default all of them
+
+        Returns
+        -------
+        table : `pyarrow.Table`
+            Table of papers
+        """
+        table = self.table
+        return table if columns is None else table.select(columns)
+
+    def to_pandas(self, columns=None):
+        """Get some columns of every paper as a `pandas.DataFrame` (list columns hold numpy arrays)
+
+        Parameters
+        ----------
+        columns : `list`, optional
+            Columns to read, by default all of them
+
+        Returns
+        -------
+        table : `pandas.DataFrame`
+            Table of papers
+        """
+        return self.read(columns).to_pandas()
+
+    def export_parquet(self, path, columns=None, compression="zstd"):
+        """Write some columns of the archive to a (compressed) Parquet file for sharing
+
+        Parameters
+        ----------
+        path : `str`
+            Path of the Parquet file
+        columns : `list`, optional
+            Columns to write, by default all of them
+        compression : `str`, optional
+            Compression codec, by default "zstd"
+        """
+        pq.write_table(self.read(columns), path, compression=compression)
+        metrics.FILE_BYTES_WRITTEN.inc(os.path.getsize(path), file="parquet")
+
+    def __len__(self):
+        return self.table.num_rows
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Get the shared archive, creating it the first time
+
+    Returns
+    -------
+    archive : `Archive`
+        The shared archive
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = Archive()
+    return _archive
@@ -0,0 +1,868 @@
+import ast
+import csv
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import pandas as pd
+from unidecode import unidecode
+
+import metrics
+import roster
+import tracing
+from author_matcher import get_matcher
+
+STORE_PATH = "data/papers.db"
+LEGACY_CSV_PATH = "data/papers.csv"
+
+# columns of the exported CSV file (in the same order that save_papers used to write them)
+EXPORT_COLUMNS = ["title", "first_author", "authors", "date", "publisher", "keywords", "link", "abstract",
+                  "citations", "reads", "uw_first_author", "total_uw"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    bibcode TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    first_author TEXT,
+    authors TEXT,
+    date TEXT,
+    publisher TEXT,
+    keywords TEXT,
+    link TEXT,
+    abstract TEXT,
+    citations INTEGER,
+    reads INTEGER,
+    uw_first_author INTEGER,
+    total_uw INTEGER,
+    added TEXT,
+    doi TEXT
+);
+CREATE INDEX IF NOT EXISTS papers_title_key ON papers (title_key);
+CREATE INDEX IF NOT EXISTS papers_date ON papers (date);
+CREATE INDEX IF NOT EXISTS papers_doi ON papers (doi);
+CREATE INDEX IF NOT EXISTS papers_uw_first_author ON papers (date) WHERE uw_first_author = 1;
+
+CREATE TABLE IF NOT EXISTS paper_members (
+    orcid TEXT NOT NULL,
+    bibcode TEXT NOT NULL REFERENCES papers (bibcode),
+    PRIMARY KEY (orcid, bibcode)
+);
+CREATE INDEX IF NOT EXISTS paper_members_bibcode ON paper_members (bibcode);
+
+CREATE TABLE IF NOT EXISTS sweep_marks (
+    member TEXT PRIMARY KEY,
+    last_sweep TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS member_stats (
+    orcid TEXT PRIMARY KEY,
+    papers INTEGER NOT NULL,
+    first_author INTEGER NOT NULL,
+    per_year TEXT NOT NULL,
+    citations INTEGER NOT NULL,
+    reads INTEGER NOT NULL,
+    latest_bibcode TEXT,
+    latest_title TEXT,
+    latest_date TEXT,
+    latest_link TEXT
+);
+"""
+SCHEMA_VERSION = 6
+
+# the sweep mark for the department as a whole (members are keyed by ORCID)
+DEPARTMENT_MARK = "department"
+
+PAPER_COLUMNS = ["bibcode", "title", "title_key", "first_author", "authors", "date", "publisher", "keywords",
+                 "link", "abstract", "citations", "reads", "uw_first_author", "total_uw", "added", "doi"]
+
+# LaTeX commands for greek letters (and a couple of other common symbols) that turn up in titles
+LATEX_SYMBOLS = {
+    "alpha": "α", "beta": "β", "gamma": "γ", "delta": "δ", "epsilon": "ε", "varepsilon": "ε", "zeta": "ζ",
+    "eta": "η", "theta": "θ", "iota": "ι", "kappa": "κ", "lambda": "λ", "mu": "μ", "nu": "ν", "xi": "ξ",
+    "pi": "π", "rho": "ρ", "sigma": "σ", "tau": "τ", "upsilon": "υ", "phi": "φ", "varphi": "φ", "chi": "χ",
+    "psi": "ψ", "omega": "ω", "Gamma": "Γ", "Delta": "Δ", "Theta": "Θ", "Lambda": "Λ", "Xi": "Ξ", "Pi": "Π",
+    "Sigma": "Σ", "Phi": "Φ", "Psi": "Ψ", "Omega": "Ω", "odot": "☉", "sun": "☉", "oplus": "⊕", "sim": "~",
+    "times": "x", "pm": "±",
+}
+
+
+def normalise_title(title):
+    """Normalise a title so that versions of it that only differ in LaTeX, markup, accents, punctuation or
+    whitespace all match
+
+    Parameters
+    ----------
+    title : `str`
+        Paper title
+
+    Returns
+    -------
+    key : `str`
+        Normalised title
+    """
+    # drop HTML-style markup that ADS uses for sub/superscripts
+    title = re.sub(r"<[^>]*>", "", title)
+
+    # swap LaTeX symbols for their unicode versions and remove any other commands (keeping their arguments)
+    title = re.sub(r"\\([a-zA-Z]+)", lambda m: LATEX_SYMBOLS.get(m.group(1), ""), title)
+
+    # transliterate, drop LaTeX syntax and apostrophes entirely and then treat any other punctuation as a
+    # space
+    title = unidecode(title).lower()
+    title = re.sub(r"[${}^_'`]", "", title)
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", title).split())
+
+
+def connect(path=None):
+    """Open a connection to the paper store, creating it (and importing the legacy CSV) if needed
+
+    Parameters
+    ----------
+    path : `str`, optional
+        Path to the SQLite database, by default `STORE_PATH`
+
+    Returns
+    -------
+    con : `sqlite3.Connection`
+        Connection to the store
+    """
+    path = STORE_PATH if path is None else path
+    is_new = not os.path.exists(path)
+
+    con = sqlite3.connect(path, timeout=30)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    _migrate(con)
+
+    # the first time around bring across everything from the old CSV file
+    if is_new and path == STORE_PATH and os.path.exists(LEGACY_CSV_PATH):
+        import_csv(LEGACY_CSV_PATH, con=con, members=roster_members)
+    return con
+
+
+def store_size(path=None):
+    """Size of the paper store on disk in bytes including its write-ahead log (None if there isn't one)"""
+    path = STORE_PATH if path is None else path
+    if not os.path.exists(path):
+        return None
+    return sum(os.path.getsize(p) for p in [path, path + "-wal"] if os.path.exists(p))
+
+
+metrics.STORE_BYTES.set_function(store_size)
+
+
+def roster_members(authors):
+    """Find the ORCIDs of the roster members in a list of authors (if there is a roster)"""
+    if not os.path.exists(roster.ROSTER_PATH):
+        return []
+    return get_matcher().match(authors).orcids
+
+
+def _migrate(con):
+    """Create the tables or bring an older store up to date with the current schema"""
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version == SCHEMA_VERSION:
+        return
+
+    columns = [row["name"] for row in con.execute("PRAGMA table_info(papers)")]
+    if len(columns) > 0 and "doi" not in columns:
+        con.execute("ALTER TABLE papers ADD COLUMN doi TEXT")
+    con.executescript(SCHEMA)
+
+    with con:
+        # the title normalisation changed in version 2 so any existing keys need recomputing
+        if version < 2 and len(columns) > 0:
+            con.executemany("UPDATE papers SET title_key = ? WHERE bibcode = ?",
+                            [(normalise_title(row["title"]), row["bibcode"])
+                             for row in con.execute("SELECT bibcode, title FROM papers").fetchall()])
+
+        # member statistics arrived in version 6
+        if version < 6 and len(columns) > 0:
+            _update_member_stats(con)
+        con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _bump_version(con):
+    """Note that the papers have changed (call this inside the transaction that changed them)"""
+    con.execute("""INSERT INTO store_meta VALUES ('version', 1)
+                   ON CONFLICT (key) DO UPDATE SET value = value + 1""")
+
+
+def get_version(con=None):
+    """Get the version of the store, which goes up every time papers are added or their attribution changes
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    version : `int`
+        Version of the store
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        row = con.execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()
+        return 0 if row is None else row[0]
+    finally:
+        if own_con:
+            con.close()
+
+
+def _paper_to_row(paper):
+    """Convert a paper dictionary to a row of the papers table"""
+    date = paper.get("date")
+    return (
+        paper["bibcode"],
+        paper["title"],
+        normalise_title(paper["title"]),
+        paper["authors"][0] if len(paper["authors"]) > 0 else None,
+        json.dumps(list(paper["authors"])),
+        date.isoformat() if isinstance(date, datetime.date) else date,
+        paper.get("publisher"),
+        json.dumps(list(paper["keywords"]) if paper.get("keywords") is not None else None),
+        paper.get("link"),
+        paper.get("abstract"),
+        paper.get("citations"),
+        paper.get("reads"),
+        None if paper.get("uw_first_author") is None else int(paper["uw_first_author"]),
+        None if paper.get("total_uw") is None else int(paper["total_uw"]),
+        datetime.datetime.now().isoformat(timespec="seconds"),
+        paper.get("doi"),
+    )
+
+
+def _row_to_paper(row):
+    """Convert a row of the papers table back to a paper dictionary"""
+    paper = dict(row)
+    paper["authors"] = json.loads(paper["authors"]) if paper["authors"] is not None else []
+    paper["keywords"] = json.loads(paper["keywords"]) if paper["keywords"] is not None else None
+    if paper["date"] is not None:
+        paper["date"] = datetime.date.fromisoformat(paper["date"])
+    if paper["uw_first_author"] is not None:
+        paper["uw_first_author"] = bool(paper["uw_first_author"])
+    return paper
+
+
+@tracing.traced("store.add_papers")
+def add_papers(papers_dict_list, con=None):
+    """Add papers to the store in a single transaction
+
+    Papers that are already in the store (by bibcode) are left untouched so this only ever costs as much
+    as the number of new papers.
+
+    Parameters
+    ----------
+    papers_dict_list : `list`
+        List of dictionaries of paper information, each may have an "orcids" key listing the roster
+        members that are authors
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    n_added : `int`
+        Number of papers that weren't already in the store
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        with con:
+            n_before = con.total_changes
+            con.executemany(f"INSERT OR IGNORE INTO papers ({', '.join(PAPER_COLUMNS)}) "
+                            f"VALUES ({', '.join('?' * len(PAPER_COLUMNS))})",
+                            [_paper_to_row(paper) for paper in papers_dict_list])
+            n_added = con.total_changes - n_before
+            con.executemany("INSERT OR IGNORE INTO paper_members VALUES (?, ?)",
+                            [(orcid, paper["bibcode"]) for paper in papers_dict_list
+                             for orcid in paper.get("orcids", [])])
+            n_links = con.total_changes - n_before - n_added
+            if n_added + n_links > 0:
+                _bump_version(con)
+                _update_member_stats(con, {orcid for paper in papers_dict_list
+                                           for orcid in paper.get("orcids", [])})
+    finally:
+        if own_con:
+            con.close()
+
+    metrics.STORE_ROWS_WRITTEN.inc(n_added, table="papers")
+    metrics.STORE_ROWS_WRITTEN.inc(n_links, table="paper_members")
+    tracing.annotate(rows=n_added)
+
+    # keep the in-memory index of known papers up to date
+    if _known_papers is not None:
+        _known_papers.add_all(papers_dict_list)
+    return n_added
+
+
+class KnownPapers():
+    """An in-memory index of the papers in the store for checking for duplicates in constant time
+
+    Papers are matched on their bibcode, DOI or normalised title. The index is filled from the store the
+    first time it is used and after that only ever reads the rows that have been added since.
+    """
+    def __init__(self):
+        self.bibcodes = set()
+        self.dois = set()
+        self.title_keys = set()
+        self.last_rowid = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, con=None):
+        """Read any papers that have been added to the store since the last refresh (e.g. by another
+        process)
+
+        Parameters
+        ----------
+        con : `sqlite3.Connection`, optional
+            Connection to use, by default a new one
+        """
+        own_con = con is None
+        con = connect() if own_con else con
+        try:
+            with self._lock, tracing.span("store.known_papers"):
+                rows = con.execute("SELECT rowid, bibcode, doi, title_key FROM papers WHERE rowid > ?",
+                                   (self.last_rowid,)).fetchall()
+                metrics.STORE_ROWS_READ.inc(len(rows), table="papers")
+                for row in rows:
+                    self.bibcodes.add(row["bibcode"])
+                    self.title_keys.add(row["title_key"])
+                    if row["doi"] is not None:
+                        self.dois.add(row["doi"].lower())
+                    self.last_rowid = max(self.last_rowid, row["rowid"])
+        finally:
+            if own_con:
+                con.close()
+
+    def add(self, paper):
+        """Add a paper to the index
+
+        Parameters
+        ----------
+        paper : `dict`
+            Dictionary of paper information
+        """
+        with self._lock:
+            self.bibcodes.add(paper.get("bibcode"))
+            self.title_keys.add(normalise_title(paper["title"]))
+            if paper.get("doi") is not None:
+                self.dois.add(paper["doi"].lower())
+
+    def add_all(self, papers_dict_list):
+        """Add several papers to the index
+
+        Parameters
+        ----------
+        papers_dict_list : `list`
+            List of dictionaries of paper information
+        """
+        for paper in papers_dict_list:
+            self.add(paper)
+
+    def __contains__(self, paper):
+        return (paper.get("bibcode") in self.bibcodes
+                or (paper.get("doi") is not None and paper["doi"].lower() in self.dois)
+                or normalise_title(paper["title"]) in self.title_keys)
+
+    def __len__(self):
+        return len(self.bibcodes)
+
+
+_known_papers = None
+
+
+def get_known_papers():
+    """Get the shared index of known papers, bringing it up to date with the store
+
+    Returns
+    -------
+    known_papers : `KnownPapers`
+        Index of the papers in the store
+    """
+    global _known_papers
+    if _known_papers is None:
+        _known_papers = KnownPapers()
+    _known_papers.refresh()
+    return _known_papers
+
+
+@tracing.traced("store.get_papers")
+def get_papers(orcid=None, con=None):
+    """Get papers from the store, most recent first
+
+    Parameters
+    ----------
+    orcid : `str`, optional
+        Only get papers by this roster member, by default all papers
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    papers_dict_list : `list`
+        List of dictionaries of paper information
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        if orcid is None:
+            rows = con.execute("SELECT * FROM papers ORDER BY date DESC")
+        else:
+            rows = con.execute("""SELECT papers.* FROM paper_members JOIN papers USING (bibcode)
+                                  WHERE paper_members.orcid = ? ORDER BY papers.date DESC""", (orcid,))
+        papers = [_row_to_paper(row) for row in rows]
+        metrics.STORE_ROWS_READ.inc(len(papers), table="papers")
+        return papers
+    finally:
+        if own_con:
+            con.close()
+
+
+@tracing.traced("store.count_papers")
+def count_papers(orcid=None, con=None):
+    """Count the papers in the store
+
+    Parameters
+    ----------
+    orcid : `str`, optional
+        Only count papers by this roster member, by default all papers
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    n_papers : `int`
+        Number of papers
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        if orcid is None:
+            return con.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+        return con.execute("SELECT COUNT(*) FROM paper_members WHERE orcid = ?", (orcid,)).fetchone()[0]
+    finally:
+        if own_con:
+            con.close()
+
+
+@tracing.traced("store.get_table")
+def get_table(columns, con=None):
+    """Get some columns of every paper in the store as a table
+
+    Parameters
+    ----------
+    columns : `list`
+        Columns to read (list columns such as "authors" are decoded)
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    table : `pandas.DataFrame`
+        Table of papers
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        table = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM papers", con)
+    finally:
+        if own_con:
+            con.close()
+    metrics.STORE_ROWS_READ.inc(len(table), table="papers")
+
+    for col in ["authors", "keywords"]:
+        if col in table:
+            table[col] = [json.loads(value) if value is not None else None for value in table[col]]
+    return table
+
+
+@tracing.traced("store.update_attribution")
+def update_attribution(attribution, members, con=None):
+    """Overwrite the UW authorship columns of many papers in a single transaction
+
+    Parameters
+    ----------
+    attribution : `pandas.DataFrame`
+        Table with "bibcode", "uw_first_author" and "total_uw" columns
+    members : `pandas.DataFrame`
+        Table with "bibcode" and "orcid" columns of roster members to link to papers
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    n_changed : `int`
+        Number of papers whose attribution changed
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        with con:
+            n_before = con.total_changes
+            con.executemany("""UPDATE papers SET uw_first_author = ?, total_uw = ? WHERE bibcode = ?
+                               AND (uw_first_author IS NOT ? OR total_uw IS NOT ?)""",
+                            [(int(first), int(total), bibcode, int(first), int(total))
+                             for bibcode, first, total in zip(attribution["bibcode"],
+                                                              attribution["uw_first_author"],
+                                                              attribution["total_uw"])])
+            n_changed = con.total_changes - n_before
+            con.executemany("INSERT OR IGNORE INTO paper_members VALUES (?, ?)",
+                            zip(members["orcid"], members["bibcode"]))
+            n_links = con.total_changes - n_before - n_changed
+            if n_changed + n_links > 0:
+                _bump_version(con)
+                # first authorship can move between members so everyone is recounted
+                _update_member_stats(con)
+    finally:
+        if own_con:
+            con.close()
+
+    metrics.STORE_ROWS_WRITTEN.inc(n_changed, table="papers")
+    metrics.STORE_ROWS_WRITTEN.inc(n_links, table="paper_members")
+    return n_changed
+
+
+def _update_member_stats(con, orcids=None):
+    """Recount the statistics of some roster members from their papers (call this inside the transaction
+    that changed them)
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection`
+        Connection to use
+    orcids : `set`, optional
+        ORCIDs of the members to recount, by default everyone with a paper
+    """
+    with tracing.span("store.member_stats") as span:
+        if orcids is None:
+            con.execute("DELETE FROM member_stats")
+            rows = con.execute("""SELECT orcid, bibcode, title, first_author, date, link, citations, reads,
+                                         uw_first_author
+                                  FROM paper_members JOIN papers USING (bibcode)""")
+        else:
+            orcids = list(orcids)
+            if len(orcids) == 0:
+                return
+            rows = con.execute(f"""SELECT orcid, bibcode, title, first_author, date, link, citations, reads,
+                                          uw_first_author
+                                   FROM paper_members JOIN papers USING (bibcode)
+                                   WHERE orcid IN ({', '.join('?' * len(orcids))})""", orcids)
+
+        # first authors are matched against the roster (if there is one) to see who they are
+        matcher = get_matcher() if os.path.exists(roster.ROSTER_PATH) else None
+
+        stats = {}
+        n_rows = 0
+        for row in rows:
+            n_rows += 1
+            member = stats.setdefault(row["orcid"], {"papers": 0, "first_author": 0, "per_year": {},
+                                                     "citations": 0, "reads": 0, "latest": None})
+            member["papers"] += 1
+            member["citations"] += row["citations"] or 0
+            member["reads"] += row["reads"] or 0
+            if row["uw_first_author"] and matcher is not None and row["first_author"] is not None:
+                _, first_author = matcher.match_author(row["first_author"])
+                if first_author is not None and first_author.get("orcid") == row["orcid"]:
+                    member["first_author"] += 1
+            if row["date"] is not None:
+                year = row["date"][:4]
+                member["per_year"][year] = member["per_year"].get(year, 0) + 1
+                if member["latest"] is None or row["date"] > member["latest"]["date"]:
+                    member["latest"] = {key: row[key] for key in ["bibcode", "title", "date", "link"]}
+        metrics.STORE_ROWS_READ.inc(n_rows, table="paper_members")
+        span.set(members=len(stats), rows=n_rows)
+
+        con.executemany("INSERT OR REPLACE INTO member_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(orcid, member["papers"], member["first_author"],
+                          json.dumps(dict(sorted(member["per_year"].items()))), member["citations"],
+                          member["reads"], *[None if member["latest"] is None else member["latest"][key]
+                                             for key in ["bibcode", "title", "date", "link"]])
+                         for orcid, member in stats.items()])
+        metrics.STORE_ROWS_WRITTEN.inc(len(stats), table="member_stats")
+
+
+def _row_to_stats(row):
+    """Convert a row of the member_stats table to a dictionary of statistics"""
+    latest = None
+    if row["latest_bibcode"] is not None:
+        latest = {"bibcode": row["latest_bibcode"], "title": row["latest_title"],
+                  "date": datetime.date.fromisoformat(row["latest_date"]), "link": row["latest_link"]}
+    return {"orcid": row["orcid"], "papers": row["papers"], "first_author": row["first_author"],
+            "per_year": {int(year): n for year, n in json.loads(row["per_year"]).items()},
+            "citations": row["citations"], "reads": row["reads"], "latest": latest}
+
+
+class MemberStats():
+    """An in-memory copy of the statistics of every roster member so that looking them up is just a
+    dictionary lookup
+
+    The statistics themselves are kept up to date in the store whenever papers are added, so this only
+    reads them again once the version of the store moves on.
+    """
+    def __init__(self):
+        self.version = None
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, con=None):
+        """Read the statistics again if the store has changed since they were last read
+
+        Parameters
+        ----------
+        con : `sqlite3.Connection`, optional
+            Connection to use, by default a new one
+        """
+        own_con = con is None
+        con = connect() if own_con else con
+        try:
+            with self._lock:
+                version = get_version(con=con)
+                if version == self.version:
+                    return
+                with tracing.span("store.member_stats_read"):
+                    rows = con.execute("SELECT * FROM member_stats").fetchall()
+                    metrics.STORE_ROWS_READ.inc(len(rows), table="member_stats")
+                    self.stats = {row["orcid"]: _row_to_stats(row) for row in rows}
+                    self.version = version
+        finally:
+            if own_con:
+                con.close()
+
+    def get(self, orcid):
+        """Get the statistics of a roster member
+
+        Parameters
+        ----------
+        orcid : `str`
+            ORCID of the member
+
+        Returns
+        -------
+        stats : `dict`
+            Number of papers ("papers"), first-author papers ("first_author"), papers per year
+            ("per_year"), total citations and reads ("citations", "reads") and the most recent paper
+            ("latest", with its bibcode, title, date and link), or None if they have no papers
+        """
+        return self.stats.get(orcid)
+
+    def __len__(self):
+        return len(self.stats)
+
+
+_member_stats = None
+
+
+def get_member_stats():
+    """Get the shared statistics of every roster member, bringing them up to date with the store
+
+    Returns
+    -------
+    member_stats : `MemberStats`
+        Statistics of every member with papers
+    """
+    global _member_stats
+    if _member_stats is None:
+        _member_stats = MemberStats()
+    _member_stats.refresh()
+    return _member_stats
+
+
+@tracing.traced("store.get_sweep_marks")
+def get_sweep_marks(con=None):
+    """Get the date of the last successful sweep of ADS for each member (and the department)
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+
+    Returns
+    -------
+    marks : `dict`
+        Dictionary of dates keyed by ORCID (or `DEPARTMENT_MARK`)
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        return {row["member"]: datetime.date.fromisoformat(row["last_sweep"])
+                for row in con.execute("SELECT member, last_sweep FROM sweep_marks")}
+    finally:
+        if own_con:
+            con.close()
+
+
+@tracing.traced("store.set_sweep_marks")
+def set_sweep_marks(members, date, con=None):
+    """Record a successful sweep of ADS for some members
+
+    Parameters
+    ----------
+    members : `list`
+        ORCIDs (or `DEPARTMENT_MARK`) that were swept
+    date : `datetime.date`
+        Date of the sweep
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        with con:
+            con.executemany("INSERT OR REPLACE INTO sweep_marks VALUES (?, ?)",
+                            [(member, date.isoformat()) for member in members])
+    finally:
+        if own_con:
+            con.close()
+
+
+def export_rows(con, orcid=None, start=None, end=None, uw_first_author=False):
+    """Go through the papers for an export, most recent first
+
+    Each filter is answered by an index (the members table for a person, the dates for a date range and a
+    partial index for UW first-author papers) so a filtered export only reads the papers that it needs.
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection`
+        Connection to use
+    orcid : `str`, optional
+        Only papers by this roster member, by default everyone's
+    start : `datetime.date`, optional
+        Only papers published on or after this date, by default no limit
+    end : `datetime.date`, optional
+        Only papers published on or before this date, by default no limit
+    uw_first_author : `bool`, optional
+        Only papers with a UW first author, by default all papers
+
+    Yields
+    ------
+    row : `dict`
+        The `EXPORT_COLUMNS` of a paper (with the lists decoded)
+    """
+    conditions, params = [], []
+    if orcid is not None:
+        conditions.append("paper_members.orcid = ?")
+        params.append(orcid)
+    if start is not None:
+        conditions.append("papers.date >= ?")
+        params.append(start.isoformat())
+    if end is not None:
+        conditions.append("papers.date <= ?")
+        params.append(end.isoformat())
+    if uw_first_author:
+        conditions.append("papers.uw_first_author = 1")
+
+    source = "paper_members JOIN papers USING (bibcode)" if orcid is not None else "papers"
+    where = "" if len(conditions) == 0 else "WHERE " + " AND ".join(conditions)
+    n_rows = 0
+    try:
+        for row in con.execute(f"""SELECT {', '.join('papers.' + col for col in EXPORT_COLUMNS)}
+                                   FROM {source} {where} ORDER BY papers.date DESC""", params):
+            n_rows += 1
+            row = dict(row)
+            row["authors"] = json.loads(row["authors"]) if row["authors"] is not None else []
+            row["keywords"] = json.loads(row["keywords"]) if row["keywords"] is not None else None
+            if row["uw_first_author"] is not None:
+                row["uw_first_author"] = bool(row["uw_first_author"])
+            yield row
+    finally:
+        metrics.STORE_ROWS_READ.inc(n_rows, table="papers")
+
+
+@tracing.traced("store.export_csv")
+def export_csv(path, con=None):
+    """Write every paper in the store out to a CSV file
+
+    Parameters
+    ----------
+    path : `str`
+        Path of the CSV file to write
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+    """
+    own_con = con is None
+    con = connect() if own_con else con
+    try:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for row in export_rows(con):
+                writer.writerow([row[col] for col in EXPORT_COLUMNS])
+    finally:
+        if own_con:
+            con.close()
+
+    metrics.FILE_BYTES_WRITTEN.inc(os.path.getsize(path), file="export")
+
+
+@tracing.traced("store.import_csv")
+def import_csv(path, con=None, members=None):
+    """One-off import of an old papers CSV file into the store
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the CSV file
+    con : `sqlite3.Connection`, optional
+        Connection to use, by default a new one
+    members : `function`, optional
+        Function that takes a list of authors and returns the ORCIDs of matching roster members, by default
+        papers aren't linked to any members
+
+    Returns
+    -------
+    n_added : `int`
+        Number of papers imported
+    """
+    def parse_list(value):
+        if not isinstance(value, str) or value == "":
+            return None
+        return ast.literal_eval(value)
+
+    def parse_bool(value):
+        return None if value in ("", None) else value == "True"
+
+    def parse_int(value):
+        return None if value in ("", None) else int(float(value))
+
+    papers_dict_list = []
+    metrics.FILE_BYTES_READ.inc(os.path.getsize(path), file="import")
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            # the bibcode only lives in the link of old files
+            match = re.search(r"/abs/([^/]+)/", row["link"])
+            if match is None:
+                continue
+
+            # older files used "first_author" for whether a UW person was first author
+            uw_first_author = row.get("uw_first_author")
+            if uw_first_author in (None, "") and row.get("first_author") in ("True", "False"):
+                uw_first_author = row["first_author"]
+
+            authors = parse_list(row["authors"]) or []
+            papers_dict_list.append({
+                "bibcode": match.group(1),
+                "title": row["title"],
+                "authors": authors,
+                "date": row["date"] or None,
+                "publisher": row.get("publisher") or None,
+                "keywords": parse_list(row.get("keywords")),
+                "link": row["link"],
+                "abstract": row.get("abstract") or None,
+                "citations": parse_int(row.get("citations")),
+                "reads": parse_int(row.get("reads")),
+                "uw_first_author": parse_bool(uw_first_author),
+                "total_uw": parse_int(row.get("total_uw")),
+                "orcids": members(authors) if members is not None else [],
+            })
+    return add_papers(papers_dict_list, con=con)
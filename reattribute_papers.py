@@ -0,0 +1,18 @@
+import paper_archive
+import paper_store
+import time
+from author_matcher import get_matcher
+
+# recompute which papers have UW authors (e.g. after the roster changes) across the whole archive at once
+start = time.time()
+
+# read the author lists from the columnar archive if pyarrow is installed (it is brought up to date with
+# the store first), otherwise straight from the store
+if paper_archive.pa is not None:
+    papers = paper_archive.get_archive().to_pandas(["bibcode", "authors"])
+else:
+    papers = paper_store.get_table(["bibcode", "authors"])
+attribution, members = get_matcher().match_table(papers)
+n_changed = paper_store.update_attribution(attribution, members)
+
+print(f"Re-attributed {len(papers)} papers in {time.time() - start:.2f}s ({n_changed} changed)")
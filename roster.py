@@ -0,0 +1,224 @@
+import csv
+import os
+import threading
+import pandas as pd
+from collections import defaultdict
+from unidecode import unidecode
+
+import metrics
+
+ROSTER_PATH = "data/orcids.csv"
+COLUMNS = ["orcid", "first_name", "last_name", "role", "slack_id"]
+
+
+def normalise_surname(last_name):
+    """Normalise a surname for lookups (no accents, lower case)
+
+    Parameters
+    ----------
+    last_name : `str`
+        Surname
+
+    Returns
+    -------
+    key : `str`
+        Normalised surname
+    """
+    return unidecode(last_name).strip().lower()
+
+
+class Roster():
+    """The people in the department, loaded once from the roster CSV file and served from dictionaries
+
+    The file is only read again when its modification time changes (or it is written through
+    `update_member`). If a Slack user directory is attached then anyone without a Slack ID in the file
+    gets the ID of the workspace member with the same name.
+
+    Parameters
+    ----------
+    path : `str`, optional
+        Path to the roster CSV file, by default `ROSTER_PATH`
+    directory : `slack_directory.UserDirectory`, optional
+        Directory to look up missing Slack IDs in, by default None
+    """
+    def __init__(self, path=None, directory=None):
+        self.path = ROSTER_PATH if path is None else path
+        self.directory = directory
+        self.version = 0
+        self._mtime = None
+        self._directory_version = None
+        self._resolved = set()
+        self._members = []
+        self._by_slack_id, self._by_orcid, self._by_surname = {}, {}, {}
+        self._table = None
+        self._lock = threading.RLock()
+
+    def _refresh(self):
+        """Reload the file if it has changed since it was last read"""
+        mtime = os.stat(self.path).st_mtime_ns
+        directory_version = None if self.directory is None else self.directory.version
+        if mtime == self._mtime and directory_version == self._directory_version:
+            return
+
+        with open(self.path, newline="") as f:
+            members = [{col: row.get(col) or None for col in COLUMNS} for row in csv.DictReader(f)]
+            metrics.FILE_BYTES_READ.inc(os.fstat(f.fileno()).st_size, file="roster")
+
+        # fill in any missing Slack IDs from the workspace (only in memory, the file is left alone)
+        resolved = set()
+        if self.directory is not None:
+            for member in members:
+                if member["slack_id"] is None and member["first_name"] and member["last_name"]:
+                    member["slack_id"] = self.directory.find(member["first_name"], member["last_name"])
+                    resolved.add(member["slack_id"])
+        resolved.discard(None)
+
+        by_surname = defaultdict(list)
+        for member in members:
+            by_surname[normalise_surname(member["last_name"])].append(member)
+
+        self._members = members
+        self._by_slack_id = {m["slack_id"]: m for m in members if m["slack_id"] is not None}
+        self._by_orcid = {m["orcid"]: m for m in members if m["orcid"] is not None}
+        self._by_surname = dict(by_surname)
+        self._table = None
+        self._mtime = mtime
+        self._directory_version = directory_version
+        self._resolved = resolved
+        self.version += 1
+
+    @property
+    def members(self):
+        """List of every member (each a dictionary of the roster columns)"""
+        with self._lock:
+            self._refresh()
+            return self._members
+
+    @property
+    def table(self):
+        """The roster as a `pandas.DataFrame` (built at most once per version of the file)"""
+        with self._lock:
+            self._refresh()
+            if self._table is None:
+                self._table = pd.DataFrame(self._members, columns=COLUMNS)
+            return self._table
+
+    def orcids(self):
+        """List of the ORCIDs of every member"""
+        return [m["orcid"] for m in self.members if m["orcid"] is not None]
+
+    def get_by_slack_id(self, slack_id):
+        """Find a member by their Slack ID
+
+        Parameters
+        ----------
+        slack_id : `str`
+            Slack ID
+
+        Returns
+        -------
+        member : `dict`
+            Roster entry, or None if there isn't one
+        """
+        with self._lock:
+            self._refresh()
+            return self._by_slack_id.get(slack_id)
+
+    def get_by_orcid(self, orcid):
+        """Find a member by their ORCID
+
+        Parameters
+        ----------
+        orcid : `str`
+            ORCID
+
+        Returns
+        -------
+        member : `dict`
+            Roster entry, or None if there isn't one
+        """
+        with self._lock:
+            self._refresh()
+            return self._by_orcid.get(orcid)
+
+    def get_by_surname(self, last_name):
+        """Find every member with a particular surname (ignoring case and accents)
+
+        Parameters
+        ----------
+        last_name : `str`
+            Surname
+
+        Returns
+        -------
+        members : `list`
+            Matching roster entries
+        """
+        with self._lock:
+            self._refresh()
+            return self._by_surname.get(normalise_surname(last_name), [])
+
+    def update_member(self, slack_id, orcid, first_name, last_name, role):
+        """Add a new member or update the details of an existing one (matched by Slack ID) and save the file
+
+        Parameters
+        ----------
+        slack_id : `str`
+            Slack ID
+        orcid : `str`
+            ORCID
+        first_name : `str`
+            First name
+        last_name : `str`
+            Last name
+        role : `str`
+            Role in the department
+        """
+        with self._lock:
+            self._refresh()
+            new_member = {"orcid": orcid, "first_name": first_name, "last_name": last_name, "role": role,
+                          "slack_id": slack_id}
+            # don't save any of the Slack IDs that came from the directory
+            members = [new_member if m["slack_id"] == slack_id
+                       else {**m, "slack_id": None} if m["slack_id"] in self._resolved else m
+                       for m in self._members]
+            if slack_id not in self._by_slack_id:
+                members.append(new_member)
+
+            # write to a temporary file first so that readers never see half a file
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(members)
+            metrics.FILE_BYTES_WRITTEN.inc(os.path.getsize(tmp_path), file="roster")
+            os.replace(tmp_path, self.path)
+
+            # force a reload even if the file system's mtime resolution hides the change
+            self._mtime = None
+            self._refresh()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+
+_roster = None
+_roster_lock = threading.Lock()
+
+
+def get_roster():
+    """Get the shared roster, creating it the first time
+
+    Returns
+    -------
+    roster : `Roster`
+        The shared roster
+    """
+    global _roster
+    with _roster_lock:
+        if _roster is None:
+            _roster = Roster()
+    return _roster
@@ -0,0 +1,307 @@
+import sqlite3
+import threading
+import time
+from slack_sdk.errors import SlackApiError
+
+from roster import normalise_surname
+from slack_outbox import retry_after
+
+USERS_PATH = "data/users.db"
+
+# how long to trust the channel list before reading it all again (seconds)
+CHANNEL_TTL = 6 * 60 * 60
+
+# don't read the whole list again more often than this just because someone asked for a missing channel
+MIN_RELOAD_INTERVAL = 60
+
+USER_COLUMNS = ["id", "name", "real_name", "first_name", "last_name", "deleted"]
+
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    real_name TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def paginate(method, key, max_retries=5, **kwargs):
+    """Walk through every page of a paginated Slack API method
+
+    Parameters
+    ----------
+    method : `function`
+        Client method to call (e.g. ``client.conversations_list``)
+    key : `str`
+        Key of the list in each response (e.g. "channels")
+    max_retries : `int`, optional
+        Number of times to retry a page when rate limited, by default 5
+    **kwargs
+        Other arguments for the method
+
+    Yields
+    ------
+    item : `dict`
+        Each item from every page
+    """
+    cursor = None
+    while True:
+        for attempt in range(max_retries + 1):
+            try:
+                response = method(cursor=cursor, **kwargs)
+                break
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == max_retries:
+                    raise
+                wait = retry_after(e)
+                time.sleep(2**attempt if wait is None else wait)
+
+        yield from response[key]
+
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return
+
+
+class ChannelDirectory():
+    """Map from channel names to IDs, read once from Slack and then kept up to date by channel events
+
+    Parameters
+    ----------
+    client : `slack_sdk.WebClient`
+        Slack client
+    ttl : `float`, optional
+        Time in seconds before the whole list is read again, by default `CHANNEL_TTL`
+    """
+    def __init__(self, client, ttl=CHANNEL_TTL):
+        self.client = client
+        self.ttl = ttl
+
+        self._ids = {}
+        self._names = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Read every page of the channel list"""
+        ids = {}
+        for channel in paginate(self.client.conversations_list, "channels", exclude_archived=True,
+                                limit=1000):
+            ids[channel["name"]] = channel["id"]
+
+        with self._lock:
+            self._ids = ids
+            self._names = {ch_id: name for name, ch_id in ids.items()}
+            self._loaded = time.monotonic()
+
+    def get(self, name):
+        """Find the ID of a channel
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the channel
+
+        Returns
+        -------
+        ch_id : `str`
+            ID of the channel, or None if there isn't one with that name
+        """
+        if self._loaded is None or time.monotonic() - self._loaded > self.ttl:
+            self._load()
+        elif name not in self._ids and time.monotonic() - self._loaded > MIN_RELOAD_INTERVAL:
+            # we may have missed an event so check with Slack before giving up
+            self._load()
+        return self._ids.get(name)
+
+    def add(self, channel):
+        """Add a new channel or rename an existing one (from a channel_created or channel_rename event)
+
+        Parameters
+        ----------
+        channel : `dict`
+            Channel from the event (with at least "id" and "name")
+        """
+        with self._lock:
+            old_name = self._names.get(channel["id"])
+            if old_name is not None and self._ids.get(old_name) == channel["id"]:
+                del self._ids[old_name]
+            self._ids[channel["name"]] = channel["id"]
+            self._names[channel["id"]] = channel["name"]
+
+    def remove(self, ch_id):
+        """Forget about a channel (from a channel_archive or channel_deleted event)
+
+        Parameters
+        ----------
+        ch_id : `str`
+            ID of the channel
+        """
+        with self._lock:
+            name = self._names.pop(ch_id, None)
+            if name is not None and self._ids.get(name) == ch_id:
+                del self._ids[name]
+
+
+def user_to_row(user):
+    """Pick out the parts of a Slack user object that we keep
+
+    Parameters
+    ----------
+    user : `dict`
+        User from ``users_list`` or a team_join/user_change event
+
+    Returns
+    -------
+    row : `dict`
+        The user's ID, username, real name, first and last name and whether they've been deactivated
+    """
+    profile = user.get("profile", {})
+    real_name = user.get("real_name") or profile.get("real_name") or None
+    first_name, last_name = profile.get("first_name") or None, profile.get("last_name") or None
+
+    # not everyone fills in their first and last names so fall back on splitting their real name
+    if (first_name is None or last_name is None) and real_name is not None and " " in real_name.strip():
+        parts = real_name.split()
+        first_name, last_name = first_name or parts[0], last_name or parts[-1]
+
+    return {"id": user["id"], "name": user.get("name"), "real_name": real_name, "first_name": first_name,
+            "last_name": last_name, "deleted": int(bool(user.get("deleted", False)))}
+
+
+class UserDirectory():
+    """Everyone in the Slack workspace, downloaded once and then kept up to date by user events
+
+    The first time it is used the whole user list is read page by page and saved to a small SQLite
+    database. After that only the team_join and user_change events are applied, so nothing is downloaded
+    or rewritten on a schedule.
+
+    Parameters
+    ----------
+    client : `slack_sdk.WebClient`
+        Slack client
+    path : `str`, optional
+        Path to the SQLite database, by default `USERS_PATH`
+    """
+    def __init__(self, client, path=None):
+        self.client = client
+        self.path = USERS_PATH if path is None else path
+        self.version = 0
+
+        self._lock = threading.RLock()
+        self._con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._con.row_factory = sqlite3.Row
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.executescript(USERS_SCHEMA)
+
+        self._users = {row["id"]: dict(row) for row in self._con.execute("SELECT * FROM users")}
+        self._by_name = {}
+        for user in self._users.values():
+            self._index(user)
+
+    def _index(self, user):
+        if user["first_name"] is not None and user["last_name"] is not None:
+            key = (normalise_surname(user["last_name"]), user["first_name"].strip().lower())
+            self._by_name.setdefault(key, set()).add(user["id"])
+
+    def _unindex(self, user):
+        if user["first_name"] is not None and user["last_name"] is not None:
+            key = (normalise_surname(user["last_name"]), user["first_name"].strip().lower())
+            self._by_name.get(key, set()).discard(user["id"])
+
+    @property
+    def bootstrapped(self):
+        """Whether the full user list has been downloaded"""
+        with self._lock:
+            return self._con.execute("SELECT 1 FROM meta WHERE key = 'bootstrapped'").fetchone() is not None
+
+    def bootstrap(self, force=False):
+        """Download the full user list (only if that hasn't been done before)
+
+        Parameters
+        ----------
+        force : `bool`, optional
+            Whether to download it again anyway, by default False
+        """
+        if self.bootstrapped and not force:
+            return
+
+        rows = [user_to_row(user) for user in paginate(self.client.users_list, "members", limit=200)]
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM users")
+            self._con.executemany(f"INSERT INTO users VALUES ({', '.join('?' * len(USER_COLUMNS))})",
+                                  [[row[col] for col in USER_COLUMNS] for row in rows])
+            self._con.execute("INSERT OR REPLACE INTO meta VALUES ('bootstrapped', ?)", (str(time.time()),))
+
+            self._users = {row["id"]: row for row in rows}
+            self._by_name = {}
+            for user in rows:
+                self._index(user)
+            self.version += 1
+        print(f"Downloaded the Slack user directory ({len(rows)} users)")
+
+    def apply(self, user):
+        """Add or update a user (from a team_join or user_change event)
+
+        Parameters
+        ----------
+        user : `dict`
+            User from the event
+        """
+        row = user_to_row(user)
+        with self._lock, self._con:
+            if self._users.get(row["id"]) == row:
+                return
+            self._con.execute(f"INSERT OR REPLACE INTO users VALUES ({', '.join('?' * len(USER_COLUMNS))})",
+                              [row[col] for col in USER_COLUMNS])
+            if row["id"] in self._users:
+                self._unindex(self._users[row["id"]])
+            self._users[row["id"]] = row
+            self._index(row)
+            self.version += 1
+
+    def get(self, slack_id):
+        """Find a user by their Slack ID
+
+        Parameters
+        ----------
+        slack_id : `str`
+            Slack ID
+
+        Returns
+        -------
+        user : `dict`
+            The user (see `user_to_row`), or None if they aren't in the workspace
+        """
+        return self._users.get(slack_id)
+
+    def find(self, first_name, last_name):
+        """Find the Slack ID of someone by their name
+
+        Parameters
+        ----------
+        first_name : `str`
+            First name
+        last_name : `str`
+            Last name
+
+        Returns
+        -------
+        slack_id : `str`
+            Slack ID of the only active user with this name, or None if there isn't exactly one
+        """
+        with self._lock:
+            ids = [slack_id for slack_id in
+                   self._by_name.get((normalise_surname(last_name), first_name.strip().lower()), set())
+                   if not self._users[slack_id]["deleted"]]
+        return ids[0] if len(ids) == 1 else None
+
+    def __len__(self):
+        return len(self._users)
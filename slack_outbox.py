@@ -0,0 +1,321 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from slack_sdk.errors import SlackApiError
+
+import tracing
+
+OUTBOX_PATH = "data/outbox.db"
+
+# how long to keep messages that have been dealt with (seconds)
+KEEP_FINISHED = 7 * 24 * 60 * 60
+
+# Slack errors that are worth trying again
+TRANSIENT_ERRORS = {"ratelimited", "internal_error", "fatal_error", "service_unavailable", "request_timeout"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    lane TEXT NOT NULL,
+    parent INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    channel TEXT,
+    ts TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    UNIQUE (batch, seq)
+);
+CREATE INDEX IF NOT EXISTS messages_status ON messages (status, batch);
+"""
+
+
+def retry_after(error):
+    """Work out how long Slack asked us to wait from a failed request
+
+    Parameters
+    ----------
+    error : `slack_sdk.errors.SlackApiError`
+        The error
+
+    Returns
+    -------
+    seconds : `float`
+        Time to wait, or None if Slack didn't say
+    """
+    for key, value in (error.response.headers or {}).items():
+        if key.lower() == "retry-after":
+            try:
+                return float(value[0] if isinstance(value, list) else value)
+            except ValueError:
+                return None
+    return None
+
+
+class Batch():
+    """A group of messages that are saved to the outbox together and then sent
+
+    Use `Outbox.batch` to create one.
+
+    Parameters
+    ----------
+    outbox : `Outbox`
+        The outbox that the messages are sent through
+    name : `str`
+        Unique name of the batch (using a name that already exists won't post anything twice)
+    """
+    def __init__(self, outbox, name):
+        self.outbox = outbox
+        self.name = name
+        self.messages = []
+
+    def post(self, reply_to=None, lane=None, **kwargs):
+        """Add a message to the batch
+
+        Parameters
+        ----------
+        reply_to : `int`, optional
+            Handle of an earlier message in the batch to reply to in a thread, by default not a reply
+        lane : `str`, optional
+            Messages in the same lane are posted in order, by default every message to the same channel and
+            thread shares a lane (replies always share the lane of the message that they reply to)
+        **kwargs
+            Arguments for ``chat_postMessage``
+
+        Returns
+        -------
+        handle : `int`
+            Handle for replying to this message
+        """
+        if reply_to is not None:
+            lane = self.messages[reply_to]["lane"]
+        elif lane is None:
+            lane = f"{kwargs.get('channel')}:{kwargs.get('thread_ts') or ''}"
+
+        self.messages.append({"lane": lane, "parent": reply_to, "payload": kwargs})
+        return len(self.messages) - 1
+
+    def send(self):
+        """Save the batch to the outbox and post every message
+
+        Returns
+        -------
+        ts : `list`
+            Timestamp of each posted message in the order they were added (None for any that failed)
+        """
+        self.outbox.save(self)
+        return self.outbox.deliver(self.name)
+
+
+class Outbox():
+    """Posts Slack messages concurrently whilst keeping the order within each conversation
+
+    Messages are saved to disk before anything is posted so that if Geoffrey falls over half way through
+    a batch, `resume` can pick up where it left off without posting anything twice. Each lane is sent in
+    order on its own worker, rate limits are handled by pausing every lane for as long as Slack's
+    Retry-After asks, and other temporary failures are retried with a backoff.
+
+    Parameters
+    ----------
+    client : `slack_sdk.WebClient`
+        Client to post the messages with
+    path : `str`, optional
+        Path to the SQLite database, by default `OUTBOX_PATH`
+    max_workers : `int`, optional
+        Maximum number of lanes posting at once, by default 4
+    max_retries : `int`, optional
+        Number of times to retry a message that fails with a temporary error, by default 5
+    backoff : `float`, optional
+        Base delay in seconds for the exponential backoff between retries, by default 1
+    """
+    def __init__(self, client, path=None, max_workers=4, max_retries=5, backoff=1):
+        self.client = client
+        self.path = OUTBOX_PATH if path is None else path
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="slack-outbox")
+
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._con.row_factory = sqlite3.Row
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.executescript(SCHEMA)
+
+        # a rate limit applies to the whole workspace so every lane waits until this time
+        self._paused_until = 0
+        self._lane_locks = {}
+
+    def batch(self, name=None):
+        """Start a new batch of messages
+
+        Parameters
+        ----------
+        name : `str`, optional
+            Unique name for the batch, by default a random one. Giving the name of a batch that was already
+            saved (e.g. the roundup for a particular day) means only its unsent messages will be posted.
+
+        Returns
+        -------
+        batch : `Batch`
+            The new batch
+        """
+        return Batch(self, uuid.uuid4().hex if name is None else name)
+
+    def post(self, **kwargs):
+        """Post a single message through the outbox
+
+        Parameters
+        ----------
+        **kwargs
+            Arguments for ``chat_postMessage``
+
+        Returns
+        -------
+        ts : `str`
+            Timestamp of the posted message (None if it failed)
+        """
+        batch = self.batch()
+        batch.post(**kwargs)
+        return batch.send()[0]
+
+    def save(self, batch):
+        """Save the messages in a batch (any that were already saved are left alone)
+
+        Parameters
+        ----------
+        batch : `Batch`
+            The batch to save
+        """
+        now = time.time()
+        with self._lock, self._con:
+            self._con.executemany("INSERT OR IGNORE INTO messages (batch, seq, lane, parent, payload, "
+                                  "created) VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(batch.name, seq, message["lane"], message["parent"],
+                                    json.dumps(message["payload"]), now)
+                                   for seq, message in enumerate(batch.messages)])
+            self._con.execute("DELETE FROM messages WHERE created < ? AND status != 'pending'",
+                              (now - KEEP_FINISHED,))
+
+    def resume(self):
+        """Post every message left over from batches that didn't finish
+
+        Returns
+        -------
+        n_batches : `int`
+            Number of batches that were resumed
+        """
+        with self._lock:
+            batches = [row["batch"] for row in self._con.execute(
+                "SELECT DISTINCT batch FROM messages WHERE status = 'pending' ORDER BY id")]
+        for batch in batches:
+            print(f"Resuming the unfinished Slack messages from batch {batch}")
+            self.deliver(batch)
+        return len(batches)
+
+    def deliver(self, batch):
+        """Post the unsent messages of a saved batch, running the lanes concurrently
+
+        Parameters
+        ----------
+        batch : `str`
+            Name of the batch
+
+        Returns
+        -------
+        ts : `list`
+            Timestamp of each message in the batch in order (None for any that failed)
+        """
+        with self._lock:
+            rows = [dict(row) for row in self._con.execute(
+                "SELECT * FROM messages WHERE batch = ? ORDER BY seq", (batch,))]
+
+        lanes = {}
+        for row in rows:
+            lanes.setdefault(row["lane"], []).append(row)
+
+        by_seq = {row["seq"]: row for row in rows}
+        for future in [self.pool.submit(tracing.propagate(self._deliver_lane), lane, messages, by_seq)
+                       for lane, messages in lanes.items()]:
+            future.result()
+        return [row["ts"] if row["status"] == "sent" else None for row in rows]
+
+    def close(self):
+        """Wait for any messages that are still being posted and then close the outbox"""
+        self.pool.shutdown(wait=True)
+        with self._lock:
+            self._con.close()
+
+    def _deliver_lane(self, lane, messages, by_seq):
+        """Post the messages in a lane one after another"""
+        with self._lock:
+            lane_lock = self._lane_locks.setdefault(lane, threading.Lock())
+
+        # other batches going to the same conversation wait their turn
+        with lane_lock:
+            for message in messages:
+                if message["status"] != "pending":
+                    continue
+
+                payload = json.loads(message["payload"])
+                if message["parent"] is not None:
+                    parent = by_seq[message["parent"]]
+                    if parent["status"] != "sent":
+                        self._finish(message, "failed", error="parent message was not posted")
+                        continue
+                    payload["thread_ts"] = parent["ts"]
+
+                self._send(message, payload)
+
+    def _send(self, message, payload):
+        """Post a single message, retrying if it fails for a temporary reason"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._paused_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                response = self.client.chat_postMessage(**payload)
+            except SlackApiError as e:
+                error = e.response.get("error", str(e))
+                if (e.response.status_code == 429 or e.response.status_code >= 500
+                        or error in TRANSIENT_ERRORS) and attempt < self.max_retries:
+                    self._back_off(attempt, retry_after(e))
+                    continue
+                self._finish(message, "failed", error=error, attempts=attempt + 1)
+                return
+            except OSError as e:
+                # connection problems and timeouts
+                if attempt < self.max_retries:
+                    self._back_off(attempt)
+                    continue
+                self._finish(message, "failed", error=str(e), attempts=attempt + 1)
+                return
+
+            self._finish(message, "sent", channel=response["channel"], ts=response["ts"],
+                         attempts=attempt + 1)
+            return
+
+    def _back_off(self, attempt, delay=None):
+        """Hold back every lane before the next attempt"""
+        if delay is None:
+            delay = random.uniform(0.5, 1) * self.backoff * 2**attempt
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _finish(self, message, status, channel=None, ts=None, error=None, attempts=1):
+        """Record what happened to a message"""
+        message.update(status=status, channel=channel, ts=ts, error=error)
+        if status == "failed":
+            print(f"WARNING: couldn't post message {message['seq']} of Slack batch {message['batch']}: "
+                  f"{error}")
+        with self._lock, self._con:
+            self._con.execute("""UPDATE messages SET status = ?, channel = ?, ts = ?, error = ?,
+                                 attempts = attempts + ? WHERE id = ?""",
+                              (status, channel, ts, error, attempts, message["id"]))
@@ -0,0 +1,55 @@
+import pandas as pd
+
+from author_matcher import MATCH_CACHE_SIZE, AuthorMatcher
+
+MEMBERS = [{"first_name": "Tom", "last_name": "Wagg", "orcid": "0000-0000-0000-0001"},
+           {"first_name": "Jane", "last_name": "Doe", "orcid": "0000-0000-0000-0002"}]
+
+
+def matcher():
+    return AuthorMatcher(MEMBERS, alternate_names={})
+
+
+def test_match_table_mixed():
+    papers = pd.DataFrame({"bibcode": ["a", "b", "c"],
+                           "authors": [["Wagg, Tom", "Smith, A."], [], ["Smith, B.", "Doe, J."]]})
+    attribution, members = matcher().match_table(papers)
+
+    assert attribution["bibcode"].tolist() == ["a", "b", "c"]
+    assert attribution["uw_first_author"].tolist() == [True, False, False]
+    assert attribution["total_uw"].tolist() == [1, 0, 1]
+    links = sorted(map(tuple, members[["bibcode", "orcid"]].to_numpy()))
+    assert links == [("a", "0000-0000-0000-0001"), ("c", "0000-0000-0000-0002")]
+
+    # same answers as matching each paper on its own
+    for authors, first, total in zip(papers["authors"], attribution["uw_first_author"],
+                                     attribution["total_uw"]):
+        result = matcher().match(authors)
+        assert (result.first_author, result.total_uw) == (first, total)
+
+
+def test_match_table_no_authors():
+    papers = pd.DataFrame({"bibcode": ["a", "b"], "authors": [[], []]})
+    attribution, members = matcher().match_table(papers)
+
+    assert attribution["uw_first_author"].tolist() == [False, False]
+    assert attribution["total_uw"].tolist() == [0, 0]
+    assert len(members) == 0
+
+
+def test_match_table_no_papers():
+    papers = pd.DataFrame({"bibcode": pd.Series(dtype=object), "authors": pd.Series(dtype=object)})
+    attribution, members = matcher().match_table(papers)
+
+    assert len(attribution) == 0
+    assert len(members) == 0
+    assert list(members.columns) == ["bibcode", "orcid"]
+
+
+def test_match_author_cache_is_bounded():
+    m = matcher()
+    assert m.match_author("Wagg, Tom") == (True, MEMBERS[0])
+    assert m.match_author("Wagg, Tom") == (True, MEMBERS[0])
+    assert m.match_author("Nobody, A.") == (False, None)
+    info = m.match_author.cache_info()
+    assert (info.hits, info.currsize, info.maxsize) == (1, 2, MATCH_CACHE_SIZE)
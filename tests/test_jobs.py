@@ -0,0 +1,59 @@
+from slack_sdk.errors import SlackApiError
+
+from jobs import JobQueue, has_working_message
+
+
+class FakeClient():
+    """Records the messages a job queue sends, failing whichever methods it is told to"""
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+
+    def _call(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        if method in self.failing:
+            raise SlackApiError(f"{method} failed", {"ok": False, "error": "fatal_error"})
+        return {"ok": True, "channel": kwargs.get("channel"), "ts": "1.0"}
+
+    def chat_postMessage(self, **kwargs):
+        return self._call("chat_postMessage", **kwargs)
+
+    def chat_update(self, **kwargs):
+        return self._call("chat_update", **kwargs)
+
+    def chat_delete(self, **kwargs):
+        return self._call("chat_delete", **kwargs)
+
+
+def run_job(client, func):
+    jobs = JobQueue(client, max_workers=1)
+    try:
+        return jobs.submit("test:job", func, status={"channel": "C1"}).result()
+    finally:
+        jobs.pool.shutdown()
+
+
+def test_working_message_seen_by_job():
+    client = FakeClient()
+    seen = []
+    run_job(client, lambda: seen.append(has_working_message()) or "done")
+    assert seen == [True]
+    assert [method for method, _ in client.calls] == ["chat_postMessage", "chat_update"]
+    assert not has_working_message()
+
+
+def test_no_working_message_posts_result():
+    # the working message fails to post, so the result should go out as a new message (which fails too
+    # here, but it is the attempt that matters)
+    client = FakeClient(failing=("chat_postMessage",))
+    seen = []
+    run_job(client, lambda: seen.append(has_working_message()) or "done")
+    assert seen == [False]
+    assert client.calls[-1] == ("chat_postMessage", {"channel": "C1", "text": "done"})
+
+
+def test_failed_update_posts_result():
+    client = FakeClient(failing=("chat_update",))
+    run_job(client, lambda: "done")
+    assert [method for method, _ in client.calls] == ["chat_postMessage", "chat_update", "chat_postMessage"]
+    assert client.calls[-1] == ("chat_postMessage", {"channel": "C1", "text": "done"})
@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+import paper_archive
+import paper_store
+from author_matcher import AuthorMatcher
+
+pytest.importorskip("pyarrow")
+
+MEMBERS = [{"first_name": "Tom", "last_name": "Wagg", "orcid": "0000-0000-0000-0001"}]
+
+PAPERS = [
+    {"bibcode": "2024a", "title": "First paper", "authors": ["Wagg, Tom", "Doe, Jane"],
+     "date": datetime.date(2024, 1, 1), "publisher": "ApJ", "keywords": ["stars"], "citations": 3,
+     "reads": 10, "uw_first_author": True, "total_uw": 1, "orcids": ["0000-0000-0000-0001"]},
+    {"bibcode": "2023b", "title": "Second paper", "authors": [], "date": datetime.date(2023, 6, 1),
+     "publisher": "MNRAS", "keywords": None, "citations": 0, "reads": 1, "uw_first_author": False,
+     "total_uw": 0},
+]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # the store and the archive both live in data/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    paper_store.add_papers([dict(paper) for paper in PAPERS])
+    return tmp_path
+
+
+def test_build_and_read_archive(store):
+    version = paper_archive.build_archive()
+    assert paper_archive.archive_version() == version == paper_store.get_version()
+
+    archive = paper_archive.Archive()
+    table = archive.read(["bibcode", "authors", "date", "orcids"])
+    assert table.column_names == ["bibcode", "authors", "date", "orcids"]
+    assert table.to_pylist() == [
+        {"bibcode": "2024a", "authors": ["Wagg, Tom", "Doe, Jane"], "date": datetime.date(2024, 1, 1),
+         "orcids": ["0000-0000-0000-0001"]},
+        {"bibcode": "2023b", "authors": [], "date": datetime.date(2023, 6, 1), "orcids": []},
+    ]
+    assert len(archive) == 2
+
+
+def test_archive_follows_store(store):
+    archive = paper_archive.Archive()
+    assert len(archive) == 2
+
+    paper_store.add_papers([{**PAPERS[1], "bibcode": "2022c", "title": "Third paper"}])
+    assert len(archive) == 3
+    assert archive.version == paper_store.get_version()
+
+
+def test_archive_matches_like_store(store):
+    # reattribute_papers.py reads the author lists from the archive instead of the store when it can
+    matcher = AuthorMatcher(MEMBERS, alternate_names={})
+    from_store = matcher.match_table(paper_store.get_table(["bibcode", "authors"]))
+    from_archive = matcher.match_table(paper_archive.Archive().to_pandas(["bibcode", "authors"]))
+    for store_table, archive_table in zip(from_store, from_archive):
+        columns = list(store_table.columns)
+        assert (store_table.sort_values(columns).reset_index(drop=True).to_dict("list")
+                == archive_table.sort_values(columns).reset_index(drop=True).to_dict("list"))
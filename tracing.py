@@ -0,0 +1,420 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Lightweight tracing of where the time goes. Every Slack event and every job gets a trace with its own ID
+# and the slow parts of the work (ADS searches, the paper store, author matching and Slack calls) are
+# recorded as nested spans within it. Finished traces are appended to a JSON-lines file with one line per
+# span, anything slower than the threshold is logged with its breakdown and a trace can be run under
+# cProfile with the stats saved alongside the traces.
+
+TRACE_DIR = "data/traces"
+TRACE_PATH = os.path.join(TRACE_DIR, "traces.jsonl")
+
+# the trace file is moved aside to TRACE_PATH + ".1" once it gets this big (bytes)
+MAX_TRACE_SIZE = 50 * 1024**2
+
+# set this to "off" to stop recording traces
+TRACING_VAR = "GEOFFREY_TRACING"
+
+# traces that take longer than this many seconds are logged with their breakdown
+SLOW_TRACE_VAR = "GEOFFREY_SLOW_TRACE"
+DEFAULT_SLOW_TRACE = 3.0
+
+# comma separated names of traces to run under cProfile (e.g. "scheduled:every_morning,job:roundup"), or
+# "all" for every one
+PROFILE_VAR = "GEOFFREY_PROFILE"
+
+# most spans kept in one trace, so that a huge job can't eat all of the memory
+MAX_SPANS = 10000
+
+_current = ContextVar("geoffrey_span", default=None)
+_write_lock = threading.Lock()
+
+
+class Span():
+    """A timed piece of work within a trace
+
+    Parameters
+    ----------
+    name : `str`
+        What the work is (e.g. "ads.search" or "slack.chat.postMessage")
+    trace : `Trace`
+        Trace that the span belongs to
+    parent : `Span`, optional
+        Span that this one is nested in, by default None (the root of the trace)
+    attributes : `dict`, optional
+        Anything else worth recording about the work, by default nothing
+    """
+    def __init__(self, name, trace, parent=None, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = {} if attributes is None else dict(attributes)
+        self.children = []
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+        self._start = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes):
+        """Add attributes to the span"""
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        """Stop the clock on the span
+
+        Parameters
+        ----------
+        error : `Exception`, optional
+            Error the work failed with, by default it succeeded
+        """
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self):
+        """The span as a line of the trace file"""
+        return {"trace_id": self.trace.trace_id, "span_id": self.span_id,
+                "parent_id": None if self.parent is None else self.parent.span_id, "name": self.name,
+                "start": self.start, "duration_ms": None if self.duration is None else self.duration * 1e3,
+                "attributes": self.attributes, "error": self.error}
+
+
+class NullSpan():
+    """Stands in for a span when nothing is being traced so that callers don't have to check"""
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Trace():
+    """Every span recorded for one Slack event or job
+
+    Parameters
+    ----------
+    trace_id : `str`, optional
+        ID of the trace, by default a new random one
+    """
+    def __init__(self, trace_id=None):
+        self.trace_id = uuid.uuid4().hex if trace_id is None else trace_id
+        self.spans = []
+        self.n_dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        """Add a span (and link it to its parent) unless the trace is full
+
+        Returns
+        -------
+        added : `bool`
+            Whether the span was kept
+        """
+        with self._lock:
+            if len(self.spans) >= MAX_SPANS:
+                self.n_dropped += 1
+                return False
+            self.spans.append(span)
+            if span.parent is not None:
+                span.parent.children.append(span)
+            return True
+
+
+def enabled():
+    """Whether traces are being recorded"""
+    return os.environ.get(TRACING_VAR, "").lower() != "off"
+
+
+def slow_threshold():
+    """Number of seconds after which a trace is logged as slow"""
+    try:
+        return float(os.environ.get(SLOW_TRACE_VAR, DEFAULT_SLOW_TRACE))
+    except ValueError:
+        return DEFAULT_SLOW_TRACE
+
+
+def should_profile(name):
+    """Whether the environment asks for a trace to be run under cProfile"""
+    names = [n.strip() for n in os.environ.get(PROFILE_VAR, "").split(",") if n.strip() != ""]
+    return "all" in names or name in names
+
+
+def current_span():
+    """The span that the current code is running in (None outside of a trace)"""
+    return _current.get()
+
+
+def current_trace_id():
+    """ID of the trace that the current code is running in (None outside of a trace)"""
+    span = _current.get()
+    return None if span is None else span.trace.trace_id
+
+
+def annotate(**attributes):
+    """Add attributes to the current span (if there is one)"""
+    span = _current.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record the body of a ``with`` block as a span nested in the current one
+
+    Outside of a trace this does nothing, so it is cheap to sprinkle around code that is also used by
+    scripts.
+
+    Parameters
+    ----------
+    name : `str`
+        What the work is
+    **attributes
+        Anything else worth recording about the work
+
+    Yields
+    ------
+    span : `Span`
+        The new span (or `NULL_SPAN` if there is no trace) so that more attributes can be added
+    """
+    parent = _current.get()
+    if parent is None:
+        yield NULL_SPAN
+        return
+
+    new_span = Span(name, parent.trace, parent=parent, attributes=attributes)
+    if not parent.trace.add(new_span):
+        yield NULL_SPAN
+        return
+
+    token = _current.set(new_span)
+    error = None
+    try:
+        yield new_span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        new_span.finish(error)
+        _current.reset(token)
+
+
+def start_span(name, **attributes):
+    """Start a span nested in the current one for work that doesn't fit in a ``with`` block, everything
+    until `end_span` is called (in the same thread) is nested in it
+
+    Parameters
+    ----------
+    name : `str`
+        What the work is
+    **attributes
+        Anything else worth recording about the work
+
+    Returns
+    -------
+    span : `Span`
+        The new span (or `NULL_SPAN` if there is no trace)
+    """
+    parent = _current.get()
+    if parent is None:
+        return NULL_SPAN
+    new_span = Span(name, parent.trace, parent=parent, attributes=attributes)
+    if not parent.trace.add(new_span):
+        return NULL_SPAN
+    new_span._token = _current.set(new_span)
+    return new_span
+
+
+def end_span(span, error=None):
+    """Finish a span started with `start_span`
+
+    Parameters
+    ----------
+    span : `Span`
+        The span
+    error : `Exception`, optional
+        Error the work failed with, by default it succeeded
+    """
+    if span is NULL_SPAN:
+        return
+    span.finish(error)
+    _current.reset(span._token)
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Record the body of a ``with`` block as a new trace (or as a span if there already is one)
+
+    When the trace finishes it is written to `TRACE_PATH`, logged with its breakdown if it was slower than
+    the threshold and, if `PROFILE_VAR` names it, run under cProfile with the stats saved in `TRACE_DIR`
+    as ``<trace ID>.prof`` (only the thread that started the trace is profiled).
+
+    Parameters
+    ----------
+    name : `str`
+        What the work is (e.g. "event:mention" or "job:roundup")
+    **attributes
+        Anything else worth recording about the work
+
+    Yields
+    ------
+    span : `Span`
+        The root span (or `NULL_SPAN` if tracing is turned off)
+    """
+    if _current.get() is not None:
+        with span(name, **attributes) as nested:
+            yield nested
+        return
+    if not enabled():
+        yield NULL_SPAN
+        return
+
+    root = Span(name, Trace(), attributes=attributes)
+    root.trace.add(root)
+    token = _current.set(root)
+
+    profiler = None
+    if should_profile(name):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # only one profiler can run at a time
+            print(f"WARNING: couldn't profile {name}: {e}")
+            profiler = None
+
+    error = None
+    try:
+        yield root
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        root.finish(error)
+        _current.reset(token)
+        _finish_trace(root, profiler)
+
+
+def traced(name, root=False):
+    """Decorate a function to record each call as a span (works for async functions too)
+
+    Parameters
+    ----------
+    name : `str`
+        What the work is
+    root : `bool`, optional
+        Whether a call outside of a trace should start a new one (e.g. for a scheduled job), by default
+        calls are only recorded within a trace
+    """
+    context = trace if root else span
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with context(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with context(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(func):
+    """Wrap a function so that it runs inside the current span when it is called on another thread (the
+    thread pools don't carry the context over on their own)
+
+    Parameters
+    ----------
+    func : `function`
+        Function to wrap
+
+    Returns
+    -------
+    wrapper : `function`
+        Function that runs ``func`` within the current span
+    """
+    parent = _current.get()
+    if parent is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+def format_breakdown(root):
+    """Describe where the time in a trace went, one indented line per span
+
+    Parameters
+    ----------
+    root : `Span`
+        Root span of the trace
+
+    Returns
+    -------
+    breakdown : `str`
+        The spans with their durations
+    """
+    lines = []
+
+    def describe(span, depth):
+        duration = "unfinished" if span.duration is None else f"{span.duration * 1e3:.1f} ms"
+        error = "" if span.error is None else f" [{span.error}]"
+        lines.append(f"{'  ' * depth}{span.name} {duration}{error}")
+        # spans that ran in parallel are listed in the order they started
+        for child in sorted(span.children, key=lambda s: s.start):
+            describe(child, depth + 1)
+
+    describe(root, 1)
+    if root.trace.n_dropped > 0:
+        lines.append(f"  ...and {root.trace.n_dropped} more spans that weren't kept")
+    return "\n".join(lines)
+
+
+def _finish_trace(root, profiler=None):
+    """Save a finished trace (and its profile) and log it if it was slow"""
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        if profiler is not None:
+            profile_path = os.path.join(TRACE_DIR, f"{root.trace.trace_id}.prof")
+            profiler.dump_stats(profile_path)
+            root.set(profile=profile_path)
+            print(f"Saved the profile of {root.name} to {profile_path}")
+        if root.trace.n_dropped > 0:
+            root.set(dropped_spans=root.trace.n_dropped)
+
+        with root.trace._lock:
+            lines = [json.dumps(span.to_dict(), default=str) for span in root.trace.spans]
+        with _write_lock:
+            if os.path.exists(TRACE_PATH) and os.path.getsize(TRACE_PATH) > MAX_TRACE_SIZE:
+                os.replace(TRACE_PATH, TRACE_PATH + ".1")
+            with open(TRACE_PATH, "a") as f:
+                f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"WARNING: couldn't save trace {root.trace.trace_id}: {e}")
+
+    if root.duration > slow_threshold():
+        print(f"WARNING: {root.name} took {root.duration:.2f} s (trace {root.trace.trace_id})\n"
+              f"{format_breakdown(root)}")
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+
+# Remembers what everyone's home tab was last published with. Slack keeps showing a published home tab
+# until a new one replaces it, so when someone opens it again and nothing that goes into it has changed
+# (their roster entry and their paper statistics) there is no need to build the view or call views.publish.
+
+
+def content_hash(*parts):
+    """Hash of everything that goes into a view
+
+    Parameters
+    ----------
+    *parts
+        Anything that can be written as JSON (dates and the like are written as strings)
+
+    Returns
+    -------
+    digest : `str`
+        Hex digest of the parts
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ViewCache():
+    """The content hash of the home tab most recently published for each user
+
+    Entries are replaced whenever the content changes and can also be dropped for a user (e.g. when they
+    update their information) or for every user with one of a set of ORCIDs (e.g. when papers are saved).
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def is_current(self, user, digest):
+        """Whether the view last published for a user was built from the same content
+
+        Parameters
+        ----------
+        user : `str`
+            Slack ID of the user
+        digest : `str`
+            Content hash of the view they would get now
+
+        Returns
+        -------
+        current : `bool`
+            Whether publishing again can be skipped
+        """
+        with self._lock:
+            entry = self._entries.get(user)
+        return entry is not None and entry[0] == digest
+
+    def remember(self, user, digest, orcid=None):
+        """Note that a view has been published
+
+        Parameters
+        ----------
+        user : `str`
+            Slack ID of the user
+        digest : `str`
+            Content hash of the view
+        orcid : `str`, optional
+            ORCID of the user (so that the entry can be invalidated when their papers change), by default
+            they don't have one
+        """
+        with self._lock:
+            self._entries[user] = (digest, orcid)
+
+    def invalidate(self, users=None, orcids=None):
+        """Forget the views of some users so that they are published again next time
+
+        Parameters
+        ----------
+        users : `list`, optional
+            Slack IDs of the users, by default nobody
+        orcids : `list`, optional
+            ORCIDs of the users, by default nobody
+        """
+        users = set() if users is None else set(users)
+        orcids = set() if orcids is None else set(orcids)
+        with self._lock:
+            for user in [user for user, (_, orcid) in self._entries.items()
+                         if user in users or (orcid is not None and orcid in orcids)]:
+                del self._entries[user]
+
+    def clear(self):
+        """Forget every view"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_view_cache = None
+_view_cache_lock = threading.Lock()
+
+
+def get_view_cache():
+    """Get the shared home tab cache, creating it the first time
+
+    Returns
+    -------
+    view_cache : `ViewCache`
+        The shared cache
+    """
+    global _view_cache
+    with _view_cache_lock:
+        if _view_cache is None:
+            _view_cache = ViewCache()
+    return _view_cache